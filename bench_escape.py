@@ -0,0 +1,73 @@
+"""
+Замер экранирования одиночных скобок: прежняя цепочка из трёх регексов по
+декодированному тексту против escape_single_braces() по байтам. Заодно
+проверяет, что экранированная копия каждого шаблона компилируется docxtpl.
+
+    python bench_escape.py [шаблон.docx ...] [-n 20]
+"""
+import re
+import sys
+import time
+import zipfile
+import argparse
+
+import docgen_core as core
+import docgen_render as render
+
+# прежняя реализация (до однопроходного токенайзера) — только для сравнения
+_single_open_re = re.compile(r'(?<!\{)\{(?!\{)')
+_single_close_re = re.compile(r'(?<!\})\}(?!\})')
+_placeholder_re = re.compile(r'(?<!\{)\{([\w\.\-]+)\}(?!\})', flags=re.UNICODE)
+
+
+def regex_chain(data):
+    text = data.decode("utf-8", errors="replace")
+    text = _placeholder_re.sub(r'{{ \1 }}', text)
+    text = _single_open_re.sub('{{', text)
+    text = _single_close_re.sub('}}', text)
+    return text.encode("utf-8")
+
+
+def word_parts(path):
+    with zipfile.ZipFile(path) as z:
+        return [z.read(n) for n in z.namelist() if n.startswith("word/") and n.endswith(".xml")]
+
+
+def bench(label, fn, parts, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        for data in parts:
+            fn(data)
+    ms = (time.perf_counter() - started) / n * 1000
+    print(f"  {label:<26}{ms:8.2f} мс/шаблон")
+    return ms
+
+
+def compiles(data):
+    try:
+        render.CompiledTemplate(data)
+        return "компилируется"
+    except Exception as e:
+        return f"ошибка: {type(e).__name__}: {e}"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("templates", nargs="*", default=[str(p) for p in core.DOCUMENT_TEMPLATES.values() if p.exists()])
+    ap.add_argument("-n", type=int, default=20, help="число прогонов на вариант")
+    args = ap.parse_args(argv)
+
+    for path in args.templates:
+        parts = word_parts(path)
+        print(f"{path}: {len(parts)} частей word/*.xml, {sum(map(len, parts)) // 1024} КБ")
+        old = bench("три регекса (str)", regex_chain, parts, args.n)
+        new = bench("токенайзер (bytes)", render.escape_single_braces, parts, args.n)
+        print(f"  ускорение: x{old / new:.1f}")
+        with open(path, "rb") as f:
+            src = f.read()
+        print(f"  экранированная копия: {compiles(render.escape_docx_bytes(src))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
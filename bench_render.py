@@ -0,0 +1,96 @@
+"""
+Замер рендеринга одного шаблона: docxtpl «с нуля», кэш CompiledTemplate и
+быстрый путь SpliceTemplate. Заодно проверяет, что быстрый путь даёт тот же
+текст документа (абзацы, таблицы, колонтитулы), что и docxtpl.
+
+    python bench_render.py [шаблон.docx] [-n 20]
+"""
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+from docx import Document
+from docxtpl import DocxTemplate
+
+import docgen_core as core
+import docgen_render as render
+
+
+def sample_ctx(template_path):
+    ctx = dict(core.load_json(core.DEFAULTS_FILE, {}) or {})
+    # без & и <: docxtpl их не экранирует, и lxml молча выбрасывает их из документа
+    ctx["content"] = "строка 1\nстрока 2"
+    store = core.open_worker_store(core.load_json(core.SETTINGS_FILE, {}) or {})
+    store.load()
+    ctx["workers"] = [card.get("fio", "") for card in store.data[:5]]
+    ctx = core.complete_ctx(ctx, store.index)
+    return dict(core.document_context("permit", template_path, ctx, "1606-А"))
+
+
+def doc_text(path):
+    doc = Document(path)
+    lines = [p.text for p in doc.paragraphs]
+    for table in doc.tables:
+        for row in table.rows:
+            lines.extend(cell.text for cell in row.cells)
+    for section in doc.sections:
+        for part in (section.header, section.footer):
+            lines.extend(p.text for p in part.paragraphs)
+    return lines
+
+
+def bench(label, fn, n):
+    fn()  # прогрев: разбор шаблона в кэш
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    per_doc = (time.perf_counter() - started) / n * 1000
+    print(f"{label:<28}{per_doc:9.1f} мс/док")
+    return per_doc
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("template", nargs="?", default=str(core.TEMPLATE_PERMIT))
+    ap.add_argument("-n", type=int, default=20, help="число рендеров на вариант")
+    args = ap.parse_args(argv)
+
+    template = Path(args.template)
+    ctx = sample_ctx(template)
+    splice = render.get_splice_template(template)
+    if not splice.fast:
+        print(f"Быстрый путь недоступен: {splice.reason}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ref, fast = Path(tmp) / "docxtpl.docx", Path(tmp) / "splice.docx"
+
+        def plain():
+            tpl = DocxTemplate(str(template))
+            tpl.render(ctx)
+            tpl.save(str(ref))
+
+        def compiled():
+            tpl = render.get_compiled_template(template)
+            with tpl.lock:
+                tpl.render(ctx)
+                tpl.save(str(ref))
+
+        def spliced():
+            if not splice.save(ctx, str(fast)):
+                raise SystemExit("контекст требует docxtpl")
+
+        base = bench("docxtpl", plain, args.n)
+        bench("docxtpl + кэш шаблона", compiled, args.n)
+        if splice.fast:
+            ms = bench("склейка строк", spliced, args.n)
+            print(f"ускорение относительно docxtpl: x{base / ms:.1f}")
+            same = doc_text(ref) == doc_text(fast)
+            print("текст совпадает" if same else "ТЕКСТ РАЗЛИЧАЕТСЯ")
+            return 0 if same else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+DocGen без GUI: пакетная генерация наборов документов из JSONL.
+
+    python docgen_cli.py jobs.jsonl -o results.jsonl -j 4
+
+Каждая строка входного файла — JSON-объект с теми же ключами, что даёт
+form_snapshot (fio, fio1, a, aa, ..., hazards, workers).
+Полные даты (дд.мм.гггг), hazards одной строкой и workers в виде списка ФИО
+тоже принимаются — недостающие производные ключи достраиваются, ФИО ищутся
+в карточках работников. Каждое задание получает свой номер (номера берутся
+из counters.json блоками под блокировкой файла), рендерится полный набор
+документов, а в результаты пишется одна JSONL-строка (в порядке завершения
+заданий).
+
+    some-producer | python docgen_cli.py --pipe -j 4 | some-consumer
+
+В режиме --pipe задания читаются из stdin по мере поступления: номер
+выдаётся на каждое задание сразу (без ожидания блока), шаблоны разбираются
+один раз при старте воркеров, а строка результата уходит в stdout, как только
+задание готово. В работе одновременно не больше 2*workers заданий, поэтому
+память не растёт, сколько бы строк ни пришло.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import docgen_core as core
+
+NUMBER_BLOCK = 32  # сколько номеров выдавать одной блокировкой counters.json
+
+
+def iter_jobs(stream):
+    """(номер строки, задание, ошибка разбора) для каждой непустой строки JSONL."""
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f"некорректный JSON: {e}"
+            continue
+        if not isinstance(job, dict):
+            yield line_no, None, "задание должно быть JSON-объектом"
+            continue
+        yield line_no, job, None
+
+
+def run_job(record, doc_jobs):
+    """Рендер набора документов одного задания (выполняется в процессе пула)."""
+    started = time.perf_counter()
+    outs, errors = core.render_documents(doc_jobs)
+    record["outputs"] = outs
+    record["errors"] = [{"template": p, "error": msg} for p, msg, tb in errors]
+    if errors:
+        record["log"] = str(core.write_error_log(errors, tag=record.get("numb")))
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def _emit(out, record):
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+def _chunks(items, size):
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch(src, out, output_dir, workers=core.RENDER_POOL_SIZE, counters_path=core.COUNTERS_FILE,
+              block_size=NUMBER_BLOCK):
+    """
+    Прочитать задания из src, отрендерить и записать результаты в out.
+    Номера выдаются в главном процессе блоками по block_size заданий (одна
+    блокировка counters.json на блок); в пуле одновременно находится не больше
+    2*workers заданий, так что входной файл может быть любым. Номера заданий,
+    не давших ни одного документа, в конце возвращаются, если после них
+    никто не получал номеров. Возвращает (успешных, с ошибками).
+    """
+    workers_store = core.open_worker_store(core.load_json(core.SETTINGS_FILE, {}) or {})
+    workers_store.load()
+    workers_db = workers_store.index
+    ok = failed = 0
+    blocks = []
+    numb_by_line = {}   # строка входа -> выданный номер
+    used = set()        # номера, под которыми создан хотя бы один документ
+
+    def collect_future(future, line_no):
+        try:
+            record = future.result()
+        except Exception as e:
+            # задание не должно ронять остальные: падение пула или pickle — ошибка этой строки
+            record = {"line": line_no, "errors": [{"error": f"{type(e).__name__}: {e}"}]}
+        collect(record)
+
+    def collect(record):
+        nonlocal ok, failed
+        if record.get("errors"):
+            failed += 1
+        else:
+            ok += 1
+        if record.get("outputs"):
+            used.add(numb_by_line.get(record["line"]))
+        _emit(out, record)
+
+    def prepared():
+        """(номер строки, аргументы run_job, ошибка разбора) — с номерами, выданными блоком на чанк."""
+        for chunk in _chunks(iter_jobs(src), block_size):
+            valid = sum(1 for line_no, job, err in chunk if not err)
+            block = core.reserve_numbers(valid, counters_path) if valid else None
+            if block is not None:
+                blocks.append(block)
+                numbers = iter(block.numbers())
+            for line_no, job, err in chunk:
+                if err:
+                    yield line_no, None, err
+                    continue
+                n = next(numbers)
+                record = {"line": line_no}
+                if "id" in job:
+                    record["id"] = job["id"]
+                record["numb"] = block.format(n)
+                try:
+                    ctx = core.complete_ctx(job, workers_db)
+                    doc_jobs = core.build_document_jobs(ctx, record["numb"], output_dir)
+                except Exception as e:
+                    # номер остаётся неиспользованным и вернётся при откате блока
+                    yield line_no, None, f"{type(e).__name__}: {e}"
+                    continue
+                numb_by_line[line_no] = n
+                yield line_no, (record, doc_jobs), None
+
+    try:
+        if workers <= 1:
+            for line_no, args, err in prepared():
+                if err:
+                    collect({"line": line_no, "errors": [{"error": err}]})
+                    continue
+                try:
+                    record = run_job(*args)
+                except Exception as e:
+                    record = {"line": line_no, "errors": [{"error": f"{type(e).__name__}: {e}"}]}
+                collect(record)
+            return ok, failed
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            lines = {}
+            for line_no, args, err in prepared():
+                if err:
+                    collect({"line": line_no, "errors": [{"error": err}]})
+                    continue
+                lines[pool.submit(run_job, *args)] = line_no
+                if len(lines) >= workers * 2:
+                    done, _ = wait(lines, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        collect_future(f, lines.pop(f))
+            while lines:
+                done, _ = wait(lines, return_when=FIRST_COMPLETED)
+                for f in done:
+                    collect_future(f, lines.pop(f))
+        return ok, failed
+    finally:
+        # откат с конца: освобождённый хвост последнего блока может открыть хвост предыдущего
+        for block in reversed(blocks):
+            block.release(n for n in block.numbers() if n not in used)
+
+
+def run_pipe(src, out, output_dir, workers=core.RENDER_POOL_SIZE, counters_path=core.COUNTERS_FILE):
+    """
+    Потоковый режим: задания из src обрабатываются по мере чтения, результаты
+    пишутся в out в порядке завершения. Каждое задание получает номер сразу;
+    номер задания без единого документа возвращается, если после него никто
+    не получал номеров. Возвращает (успешных, с ошибками).
+    """
+    workers_store = core.open_worker_store(core.load_json(core.SETTINGS_FILE, {}) or {})
+    workers_store.load()
+    workers_db = workers_store.index
+    for path in core.DOCUMENT_TEMPLATES.values():
+        if path.exists():
+            core.template_manifest(path)
+    counts = {"ok": 0, "failed": 0}
+    out_lock = threading.Lock()
+
+    def collect(record, block):
+        if block is not None and not record.get("outputs"):
+            block.release(block.numbers())
+        with out_lock:
+            counts["failed" if record.get("errors") else "ok"] += 1
+            _emit(out, record)
+
+    def prepare(line_no, job):
+        record = {"line": line_no, "id": job.get("id", line_no)}
+        ctx = core.complete_ctx(job, workers_db)
+        block = core.reserve_numbers(1, counters_path)
+        record["numb"] = block.format(block.start)
+        try:
+            return record, core.build_document_jobs(ctx, record["numb"], output_dir), block
+        except Exception:
+            block.release(block.numbers())
+            raise
+
+    def failed(line_no, job, e):
+        return {"line": line_no, "id": job.get("id", line_no), "errors": [{"error": f"{type(e).__name__}: {e}"}]}
+
+    if workers <= 1:
+        core.warm_templates()
+        for line_no, job, err in iter_jobs(src):
+            if err:
+                collect({"line": line_no, "id": line_no, "errors": [{"error": err}]}, None)
+                continue
+            try:
+                record, doc_jobs, block = prepare(line_no, job)
+            except Exception as e:
+                collect(failed(line_no, job, e), None)
+                continue
+            try:
+                record = run_job(record, doc_jobs)
+            except Exception as e:
+                record = failed(line_no, job, e)
+            collect(record, block)
+        return counts["ok"], counts["failed"]
+
+    slots = threading.BoundedSemaphore(workers * 2)
+    with ProcessPoolExecutor(max_workers=workers, initializer=core.warm_templates) as pool:
+
+        def finished(future, record, block):
+            try:
+                record = future.result()
+            except Exception as e:
+                record["errors"] = [{"error": f"{type(e).__name__}: {e}"}]
+            try:
+                collect(record, block)
+            finally:
+                slots.release()
+
+        for line_no, job, err in iter_jobs(src):
+            if err:
+                collect({"line": line_no, "id": line_no, "errors": [{"error": err}]}, None)
+                continue
+            try:
+                record, doc_jobs, block = prepare(line_no, job)
+            except Exception as e:
+                collect(failed(line_no, job, e), None)
+                continue
+            slots.acquire()
+            try:
+                future = pool.submit(run_job, record, doc_jobs)
+            except Exception:
+                slots.release()
+                block.release(block.numbers())
+                raise
+            future.add_done_callback(lambda f, r=record, b=block: finished(f, r, b))
+    return counts["ok"], counts["failed"]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="docgen", description="Пакетная генерация документов DocGen без GUI.")
+    ap.add_argument("jobs", nargs="?", default="-", help="JSONL-файл с заданиями ('-' — читать из stdin, по умолчанию)")
+    ap.add_argument("-o", "--results", default="-", help="куда писать JSONL с результатами ('-' — stdout, по умолчанию)")
+    ap.add_argument("-j", "--workers", type=int, default=core.RENDER_POOL_SIZE,
+                    help=f"число процессов рендеринга (по умолчанию {core.RENDER_POOL_SIZE}; 1 — без пула)")
+    ap.add_argument("--output-dir", help="папка для документов (по умолчанию output_dir из settings.json)")
+    ap.add_argument("--counters", default=str(core.COUNTERS_FILE), help="counters.json, из которого выдаются номера")
+    ap.add_argument("--compresslevel", type=int, choices=range(10), metavar="0-9",
+                    help="уровень сжатия изменённых частей .docx (по умолчанию docx_compresslevel из settings.json или 6)")
+    ap.add_argument("--pipe", action="store_true",
+                    help="потоковый режим: номер на каждое задание сразу, результат — как только задание готово")
+    args = ap.parse_args(argv)
+
+    if args.compresslevel is not None:
+        # через окружение уровень дойдёт и до процессов пула (docgen_render читает его при импорте)
+        os.environ["DOCGEN_COMPRESSLEVEL"] = str(args.compresslevel)
+    output_dir = Path(args.output_dir) if args.output_dir else core.get_output_dir()
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    src = sys.stdin if args.jobs == "-" else open(args.jobs, encoding="utf-8")
+    out = sys.stdout if args.results == "-" else open(args.results, "a", encoding="utf-8")
+    try:
+        run = run_pipe if args.pipe else run_batch
+        ok, failed = run(src, out, output_dir, workers=args.workers, counters_path=Path(args.counters))
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
+    print(f"Готово: {ok}, с ошибками: {failed}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1257 @@
+"""
+Ядро DocGen без GUI: хранилища, номера, построение контекста и рендеринг наборов документов.
+
+Модуль не импортирует tkinter/customtkinter и не читает хранилища при
+загрузке, поэтому его можно импортировать в процессах пула рендеринга,
+из пакетного режима и вообще без дисплея. docxtpl/lxml подгружаются
+(через docgen_render) только при первой генерации.
+"""
+import os
+import re
+import sys
+import json
+import time
+import errno
+import atexit
+import hashlib
+import platform
+import tempfile
+import threading
+import traceback
+from contextlib import contextmanager
+from collections.abc import Mapping
+from pathlib import Path
+from datetime import datetime
+
+# --- каталог данных приложения ---
+if platform.system() == 'Darwin':
+    APPDIR = Path.home() / 'Library' / 'Application Support' / 'DocGenApp'
+else:
+    APPDIR = Path(os.getenv('APPDATA') or Path.home()) / 'DocGenApp'
+APPDIR.mkdir(parents=True, exist_ok=True)
+
+DEFAULTS_FILE = APPDIR / "defaults.json"
+TEMPLATES_FILE = APPDIR / "templates.json"
+WORKERS_FILE = APPDIR / "workers.json"
+COUNTERS_FILE = APPDIR / "counters.json"
+SETTINGS_FILE = APPDIR / "settings.json"
+BRIGADES_FILE = APPDIR / "brigades.json"
+WORKERS_DB_FILE = APPDIR / "workers.db"   # SQLite-хранилище карточек (settings.json: "workers_backend": "sqlite")
+
+DEFAULT_NUMB = 1606
+
+def get_base_path() -> Path:
+    """Return folder with static resources in dev and in bundled apps.
+       Handles: direct script run, PyInstaller (--onefile and --onedir) and py2app."""
+    if getattr(sys, "frozen", False):
+        meipass = getattr(sys, "_MEIPASS", None)
+        if meipass:
+            return Path(meipass)
+        exe = Path(sys.argv[0]).resolve()
+        maybe_resources = exe.parent.parent / "Resources"
+        if maybe_resources.exists():
+            return maybe_resources
+        return exe.parent
+    return Path(__file__).resolve().parent
+
+base = get_base_path()
+
+TEMPLATE_PERMIT = base / "template_permit.docx"
+TEMPLATE_SPISOK = base / "template_spisok.docx"
+TEMPLATE_ORDER = base / "template_order.docx"
+TEMPLATE_PB_ORDER = base / "template_pb_order.docx"
+
+# набор документов «Сгенерировать Все»: ключ -> шаблон, и человекочитаемые имена файлов
+DOCUMENT_TEMPLATES = {"permit": TEMPLATE_PERMIT, "spisok": TEMPLATE_SPISOK, "order": TEMPLATE_ORDER, "pb_order": TEMPLATE_PB_ORDER}
+DOCUMENT_NAMES = {"permit": "наряд-допуск", "spisok": "список", "order": "приказ", "pb_order": "приказ-пб"}
+
+# -------------------------
+# Поля формы (mapping: группа -> ключ -> подпись)
+# -------------------------
+mapping = {
+    "shared": {
+        "fio": {"label": "Ответственный руководитель (И.п/Р.п/Д.п)"},
+
+        "fio1": {"label": "Ответственный исполнитель (ФИО)"},
+        "fio3": {"label": "Лицо, выдавшее наряд (ФИО)"},
+        "a": {"label": "Выдан"},
+        "aa": {"label": "Выдан — месяц.год (формируется из a)"},
+        "b": {"label": "Действителен до"},
+        "bb": {"label": "Действителен до — месяц.год (формируется из b)"},
+        "d": {"label": "Начало работ"},
+        "dd": {"label": "Начало работ — месяц.год (формируется из d)"},
+        "e": {"label": "Окончание работ"},
+        "ee": {"label": "Окончание работ — месяц.год (формируется из e)"},
+        "location_address": {"label": "Место выполнения работ"},
+        "numb": {"label": "Глобальный номер документа"}
+    },
+    "permit": {
+        "work_scope": {"label": "На выполнение работ"},
+        "content": {"label": "Содержание работ"},
+        "terms": {"label": "Условия проведения работ"},
+        "w0": {"label": "Работник 0 (Фамилия И.О. для наряда)"},
+        "w1": {"label": "Работник 1 (Фамилия И.О.)"},
+        "w2": {"label": "Работник 2 (Фамилия И.О.)"},
+        "w3": {"label": "Работник 3 (Фамилия И.О.)"},
+        "w4": {"label": "Работник 4 (Фамилия И.О.)"},
+        "w5": {"label": "Работник 5 (Фамилия И.О.)"},
+        "w6": {"label": "Работник 6 (Фамилия И.О.)"},
+        "w7": {"label": "Работник 7 (Фамилия И.О.)"},
+        "w8": {"label": "Работник 8 (Фамилия И.О.)"},
+        "w9": {"label": "Работник 9 (Фамилия И.О.)"},
+        "w10": {"label": "Работник 10 (Фамилия И.О.)"},
+        "w11": {"label": "Работник 11 (Фамилия И.О.)"},
+        "materials": {"label": "Материалы"},
+        "tools": {"label": "Инструменты"},
+        "devices": {"label": "Приспособления"},
+        "time": {"label": "Время"},
+        "hazards": {"label": "Опасные и вредные факторы"}
+    },
+    "spisok": {
+        "predmet": {"label": "На выполнение работ и содержание (в Р.п.)"},
+        "workers": {"label": "Список работников"},
+        # Поля position и place убраны из UI по запросу, но могут присутствовать в worker-карточках.
+        "position": {"label": "Должность (общая)"},
+        "birth": {"label": "Дата рождения (общая)"},
+        "pass": {"label": "Серия и номер (общая)"},
+        "place": {"label": "Кем выдан (общая)"}
+    }
+}
+
+# -------------------------
+# JSON-хранилище и блокировки
+# -------------------------
+def load_json(path, default=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def dumps_json(obj):
+    return json.dumps(obj, ensure_ascii=False, indent=2)
+
+def write_text_atomic(path, text):
+    """Записать текст во временный файл рядом и переименовать: читатель никогда не увидит полузаписанный файл."""
+    path = Path(path)
+    fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_name, path)
+    except Exception:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+def write_json_atomic(path, obj):
+    write_text_atomic(path, dumps_json(obj))
+
+LOCK_TIMEOUT = 120  # секунд ожидания чужой блокировки на Windows, после чего — TimeoutError
+
+@contextmanager
+def locked_file(path, timeout=LOCK_TIMEOUT):
+    """
+    Эксклюзивная межпроцессная блокировка <path>.lock (flock на POSIX, msvcrt на Windows).
+    Работает и между экземплярами DocGen, смотрящими в одну папку.
+    """
+    fd = os.open(str(path) + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+    locked = False
+    try:
+        if os.name == "nt":
+            import msvcrt
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError as e:
+                    # LK_LOCK сдаётся через ~10 с с EDEADLK/EACCES — это занятая блокировка, ждём дальше;
+                    # любая другая ошибка (ввод-вывод, права) — настоящая и поднимается сразу
+                    if e.errno not in (errno.EDEADLK, errno.EACCES):
+                        raise
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"{path}.lock занят дольше {timeout} с") from e
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        locked = True
+        yield
+    finally:
+        try:
+            if locked and os.name == "nt":
+                import msvcrt
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            elif locked:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+class JsonStore:
+    """
+    Один JSON-файл хранилища: данные держатся в памяти (self.data) и
+    изменяются на месте. save() пишет файл, только если содержимое
+    отличается от последнего загруженного/записанного (сравнение по хешу).
+    """
+    def __init__(self, path, default, tolerant=False, bus=None):
+        self.path = Path(path)
+        self.default = default      # callable -> пустое значение для нового файла
+        self.tolerant = tolerant    # битый файл/чужой тип -> пустое значение вместо исключения
+        self.bus = bus              # ChangeBus: после сохранения изменений публикуется тема self.topic
+        self.topic = self.path.stem
+        self.data = None
+        self._digest = None         # хеш того, что сейчас лежит (или уже поставлено в запись) на диске
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def ensure(self):
+        if not self.path.exists():
+            write_json_atomic(self.path, self.default())
+
+    def load(self):
+        self.ensure()
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if self.tolerant and not isinstance(data, type(self.default())):
+                data = self.default()
+        except ValueError:
+            if not self.tolerant:
+                raise
+            data = self.default()
+        self.data = data
+        self._digest = self._hash(dumps_json(data))
+        self._loaded()
+        return data
+
+    def _loaded(self):
+        pass
+
+    def reload(self):
+        """Перечитать файл, сохранив сам объект self.data (на него могут ссылаться снаружи)."""
+        old = self.data
+        new = self.load()
+        if isinstance(old, dict) and isinstance(new, dict):
+            old.clear(); old.update(new)
+        elif isinstance(old, list) and isinstance(new, list):
+            old[:] = new
+        else:
+            return new
+        self.data = old
+        return old
+
+    def save(self, writer=None):
+        """
+        Записать изменения; возвращает True, если данные отличались от сохранённых.
+        Текст снимается сразу (в потоке вызывающего), а с writer (StoreWriter)
+        сам файл пишется в фоне.
+        """
+        text = dumps_json(self.data)
+        digest = self._hash(text)
+        if digest == self._digest:
+            return False
+        self._digest = digest
+        if writer is not None:
+            writer.submit(self, text)
+        else:
+            write_text_atomic(self.path, text)
+        if self.bus is not None:
+            self._publish_changes()
+        return True
+
+    def _publish_changes(self):
+        self.bus.publish(self.topic)
+
+    def invalidate(self):
+        # запись не удалась — следующий save() запишет файл, даже если данные те же
+        self._digest = None
+
+class TemplatesStore(JsonStore):
+    """
+    templates.json: {"fields": {ключ поля: [шаблоны]}}. После сохранения публикует
+    "templates.fields.<ключ>" только для тех полей, чей список действительно изменился.
+    """
+    def __init__(self, path=TEMPLATES_FILE, bus=None):
+        super().__init__(path, lambda: {"fields": {}}, bus=bus)
+        self._fields = {}
+
+    def _field_digests(self):
+        fields = self.data.get("fields", {}) if isinstance(self.data, dict) else {}
+        return {k: self._hash(dumps_json(v)) for k, v in fields.items()}
+
+    def _loaded(self):
+        self._fields = self._field_digests()
+
+    def _publish_changes(self):
+        new = self._field_digests()
+        changed = sorted(k for k in set(new) | set(self._fields) if new.get(k) != self._fields.get(k))
+        self._fields = new
+        for key in changed:
+            self.bus.publish(f"templates.fields.{key}")
+
+class ChangeBus:
+    """
+    Уведомления об изменениях хранилищ: подписка на точную тему
+    ("templates.fields.hazards") или на все темы с префиксом ("templates.fields.*").
+    Колбэки вызываются синхронно в потоке publish() и получают тему.
+    """
+    def __init__(self):
+        self._subs = []
+
+    def subscribe(self, topic, callback):
+        sub = (topic, callback)
+        self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        try:
+            self._subs.remove(sub)
+        except ValueError:
+            pass
+
+    def publish(self, topic):
+        for pattern, callback in list(self._subs):
+            if pattern == topic or (pattern.endswith("*") and topic.startswith(pattern[:-1])):
+                try:
+                    callback(topic)
+                except Exception:
+                    traceback.print_exc()
+
+class StoreWriter:
+    """
+    Фоновая запись хранилищ. Для каждого файла в очереди держится только
+    последний текст, так что серия автосохранений сливается в одну запись.
+    flush() дожидается, пока всё поставленное в очередь окажется на диске.
+    """
+    def __init__(self):
+        self._pending = {}   # path -> (store, text)
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self.last_error = None
+
+    def submit(self, store, text):
+        with self._cond:
+            self._pending[str(store.path)] = (store, text)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="docgen-store-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch, self._pending = self._pending, {}
+                self._busy = True
+            for path, (store, text) in batch.items():
+                try:
+                    write_text_atomic(path, text)
+                except Exception as e:
+                    self.last_error = e
+                    store.invalidate()
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+def make_stores(settings=None, bus=None):
+    """Хранилища приложения по именам (ещё не загруженные); settings выбирает хранилище карточек."""
+    return {
+        "defaults": JsonStore(DEFAULTS_FILE, dict, bus=bus),
+        "templates": TemplatesStore(TEMPLATES_FILE, bus=bus),
+        "workers": open_worker_store(settings),
+        "counters": JsonStore(COUNTERS_FILE, lambda: {"numb": DEFAULT_NUMB}, bus=bus),
+        "settings": JsonStore(SETTINGS_FILE, lambda: {"autosave": True}, bus=bus),
+        "brigades": JsonStore(BRIGADES_FILE, list, tolerant=True, bus=bus),
+    }
+
+def load_stores(bus=None):
+    """
+    Создать недостающие файлы и загрузить все хранилища; возвращает {имя: хранилище}.
+    С bus (ChangeBus) хранилища публикуют свои изменения при сохранении.
+    """
+    settings = JsonStore(SETTINGS_FILE, lambda: {"autosave": True}, bus=bus)
+    settings.load()
+    stores = make_stores(settings.data, bus)
+    stores["settings"] = settings
+    for name, store in stores.items():
+        if name != "settings":
+            store.load()
+    return stores
+
+def tpl_name(item):
+    '''Return a display name for a template entry (handles dicts and legacy strings).'''
+    try:
+        if isinstance(item, dict):
+            name = item.get("name", "") or (item.get("content", "").splitlines()[0] if item.get("content","") else "")
+            return str(name)
+        s = str(item)
+        lines = s.splitlines()
+        return lines[0] if lines else s
+    except Exception:
+        try:
+            return str(item)
+        except Exception:
+            return ""
+
+def tpl_content(item):
+    '''Return the full content for a template entry (dict or string).'''
+    try:
+        if isinstance(item, dict):
+            return item.get("content", "") or ""
+        return str(item)
+    except Exception:
+        return ""
+
+# -------------------------
+# Карточки работников
+# -------------------------
+def normalize_fio(fio):
+    """Ключ поиска карточки: ФИО без лишних пробелов и без учёта регистра, ё = е."""
+    return " ".join(str(fio or "").replace("ё", "е").replace("Ё", "Е").split()).casefold()
+
+class WorkerIndex:
+    """
+    Карточки workers_db по нормализованному ФИО — поиск за O(1) вместо прохода по списку.
+    При одинаковых ФИО находится первая добавленная карточка. Индекс не перестраивается
+    при поиске: тот, кто меняет карточки, обновляет его через add/replace/remove.
+    """
+    def __init__(self, workers_db=()):
+        self._by_fio = {}
+        for card in workers_db:
+            self.add(card)
+
+    def add(self, card):
+        self._by_fio.setdefault(normalize_fio(card.get("fio", "")), []).append(card)
+
+    def remove(self, card):
+        key = normalize_fio(card.get("fio", ""))
+        cards = self._by_fio.get(key, [])
+        for i, c in enumerate(cards):
+            if c is card:
+                del cards[i]
+                break
+        if not cards:
+            self._by_fio.pop(key, None)
+
+    def replace(self, old, new):
+        self.remove(old)
+        self.add(new)
+
+    def get(self, fio):
+        cards = self._by_fio.get(normalize_fio(fio))
+        return cards[0] if cards else None
+
+class JsonWorkerStore(JsonStore):
+    """
+    workers.json: весь список карточек в одном файле, save() переписывает его целиком.
+    Карточки меняются через add/replace/remove — они же поддерживают индекс по ФИО.
+    """
+    def __init__(self, path=WORKERS_FILE):
+        super().__init__(path, list)
+        self.index = WorkerIndex()
+        self.dirty = False
+
+    def load(self):
+        super().load()
+        self.index = WorkerIndex(self.data)
+        self.dirty = False
+        return self.data
+
+    def add(self, card):
+        self.data.append(card)
+        self.index.add(card)
+        self.dirty = True
+
+    def replace(self, i, card):
+        self.index.replace(self.data[i], card)
+        self.data[i] = card
+        self.dirty = True
+
+    def remove(self, i):
+        card = self.data.pop(i)
+        self.index.remove(card)
+        self.dirty = True
+        return card
+
+    def save(self, writer=None):
+        # карточки меняются только через add/replace/remove: без них нечего и сериализовать
+        if not self.dirty:
+            return False
+        self.dirty = False
+        return super().save(writer)
+
+    def invalidate(self):
+        super().invalidate()
+        self.dirty = True
+
+_WORKER_COLUMNS = ("fio", "position", "birth", "pass", "place", "notes")
+
+class SqliteWorkerStore:
+    """
+    Карточки в SQLite (workers.db): каждая правка — одна строка в своей транзакции,
+    save() ничего не переписывает. При первом открытии карточки один раз
+    переносятся из workers.json (сам файл остаётся как резервная копия).
+    self.data — список карточек в порядке добавления, как у JsonWorkerStore.
+    """
+    def __init__(self, path=WORKERS_DB_FILE, json_path=WORKERS_FILE):
+        self.path = Path(path)
+        self.json_path = Path(json_path)
+        self.conn = None
+        self.data = []
+        self._rowids = []   # id строки для каждой карточки из self.data
+        self.index = WorkerIndex()
+
+    def _connect(self):
+        import sqlite3
+        conn = sqlite3.connect(str(self.path))
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS workers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fio TEXT NOT NULL DEFAULT '', fio_key TEXT NOT NULL DEFAULT '',
+                position TEXT NOT NULL DEFAULT '', birth TEXT NOT NULL DEFAULT '',
+                pass TEXT NOT NULL DEFAULT '', place TEXT NOT NULL DEFAULT '',
+                notes TEXT NOT NULL DEFAULT '', extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS workers_fio ON workers(fio_key);
+            CREATE INDEX IF NOT EXISTS workers_position ON workers(position);
+            CREATE INDEX IF NOT EXISTS workers_pass ON workers(pass);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        return conn
+
+    @staticmethod
+    def _row(card):
+        # основные поля — отдельными колонками, всё прочее из карточки — JSON в extra
+        extra = {k: v for k, v in card.items() if k not in _WORKER_COLUMNS}
+        return ([str(card.get(k, "") or "") for k in _WORKER_COLUMNS]
+                + [normalize_fio(card.get("fio", "")), json.dumps(extra, ensure_ascii=False) if extra else None])
+
+    def _migrate_from_json(self):
+        if self.conn.execute("SELECT value FROM meta WHERE key = 'migrated_from'").fetchone():
+            return
+        cards = load_json(self.json_path, []) if self.json_path.exists() else []
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO workers (fio, position, birth, pass, place, notes, fio_key, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(c) for c in (cards or []) if isinstance(c, dict)])
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from', ?)", (str(self.json_path),))
+
+    def ensure(self):
+        if self.conn is None:
+            self.conn = self._connect()
+            self._migrate_from_json()
+
+    def load(self):
+        # читается через своё соединение: load() может звать другой поток (например, обработчик HTTP),
+        # а self.conn привязан к потоку, который его открыл
+        self.ensure()
+        data, rowids = [], []
+        conn = self._connect()
+        try:
+            for row in conn.execute("SELECT id, fio, position, birth, pass, place, notes, extra FROM workers ORDER BY id"):
+                card = dict(zip(_WORKER_COLUMNS, row[1:7]))
+                if row[7]:
+                    card.update(json.loads(row[7]))
+                data.append(card)
+                rowids.append(row[0])
+        finally:
+            conn.close()
+        self.data, self._rowids = data, rowids
+        self.index = WorkerIndex(self.data)
+        return self.data
+
+    def add(self, card):
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO workers (fio, position, birth, pass, place, notes, fio_key, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._row(card))
+        self.data.append(card)
+        self._rowids.append(cur.lastrowid)
+        self.index.add(card)
+
+    def replace(self, i, card):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE workers SET fio = ?, position = ?, birth = ?, pass = ?, place = ?, notes = ?, fio_key = ?, extra = ? WHERE id = ?",
+                self._row(card) + [self._rowids[i]])
+        self.index.replace(self.data[i], card)
+        self.data[i] = card
+
+    def remove(self, i):
+        with self.conn:
+            self.conn.execute("DELETE FROM workers WHERE id = ?", (self._rowids[i],))
+        del self._rowids[i]
+        card = self.data.pop(i)
+        self.index.remove(card)
+        return card
+
+    def save(self, writer=None):
+        return False  # все изменения уже записаны построчно
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def open_worker_store(settings=None):
+    """Хранилище карточек по settings.json: "workers_backend": "sqlite" — workers.db, иначе workers.json."""
+    if (settings or {}).get("workers_backend") == "sqlite":
+        return SqliteWorkerStore()
+    return JsonWorkerStore()
+
+
+# -------------------------
+# Номера документов
+# -------------------------
+def format_numb(n, suffix=""):
+    return str(n) + (("-" + str(suffix)) if suffix else "")
+
+class NumberBlock:
+    """
+    Номера start..start+count-1, выданные одним reserve_numbers(). Номера, которые так
+    и не пошли в документы, можно вернуть через release(): счётчик откатывается, только
+    если это хвост блока и после него никто ничего не выдавал, — иначе номер остаётся пропуском.
+    """
+    def __init__(self, start, count, suffix="", path=COUNTERS_FILE):
+        self.start = start
+        self.count = count
+        self.suffix = suffix
+        self.path = Path(path)
+        self.end = start + count   # первый номер после блока (до отката)
+
+    def numbers(self):
+        return range(self.start, self.start + self.count)
+
+    def format(self, n):
+        return format_numb(n, self.suffix)
+
+    def release(self, unused):
+        """Вернуть неиспользованные номера; возвращает, сколько номеров счётчик получил обратно."""
+        unused = set(unused)
+        new_end = self.end
+        while new_end > self.start and (new_end - 1) in unused:
+            new_end -= 1
+        if new_end == self.end:
+            return 0
+        with locked_file(self.path):
+            counters = load_json(self.path, {}) or {}
+            if int(counters.get("numb", DEFAULT_NUMB)) != self.end:
+                return 0   # после нас уже выдавали номера
+            counters["numb"] = new_end
+            write_json_atomic(self.path, counters)
+        released, self.end = self.end - new_end, new_end
+        return released
+
+def reserve_numbers(count=1, path=COUNTERS_FILE):
+    """
+    Выдать count подряд идущих номеров из counters.json одной операцией под блокировкой
+    файла (атомарная запись через временный файл). Безопасно между процессами и
+    экземплярами DocGen, смотрящими в одну папку.
+    """
+    with locked_file(path):
+        counters = load_json(path, {}) or {}
+        n = int(counters.get("numb", DEFAULT_NUMB))
+        counters["numb"] = n + count
+        write_json_atomic(path, counters)
+    return NumberBlock(n, count, str(counters.get("numb_suffix", "") or ""), path)
+
+def set_numb(n, suffix="", path=COUNTERS_FILE):
+    """Задать следующий номер и суффикс вручную (под той же блокировкой, что и выдача)."""
+    with locked_file(path):
+        counters = load_json(path, {}) or {}
+        counters["numb"] = int(n)
+        counters["numb_suffix"] = suffix
+        write_json_atomic(path, counters)
+
+def peek_numb(counters):
+    """Текущий (ещё не выданный) номер и суффикс из уже загруженного counters.json."""
+    return int(counters.get("numb", DEFAULT_NUMB)), str(counters.get("numb_suffix", "") or "")
+
+# -------------------------
+# Построение контекста (общая часть для GUI и пакетного режима)
+# -------------------------
+WORKER_FIELDS = ("fio", "position", "birth", "pass", "place", "notes")
+SLOT_COUNT = 12  # слотов работников (position..position11, w0..w11), если манифест шаблона неизвестен
+
+def parse_ddmmyyyy(text):
+    t=(text or "").strip()
+    if not t: return "", ""
+    p=t.split(".")
+    return (p[0].zfill(2), f"{p[1].zfill(2)}.{p[2]}") if len(p)==3 else ("","")
+
+def short_name(full):
+    s=(full or "").strip()
+    if not s: return ""
+    parts = s.split()
+    if len(parts)==1: return parts[0]
+    surname = parts[0]
+    initials = ""
+    for p in parts[1:3]:
+        if p: initials += p[0].upper() + "."
+    return f"{surname} {initials}"
+
+def resolve_workers(items, workers_db):
+    """
+    Строки списка (ФИО) -> карточки работников; не найденные остаются как {"fio": ...}.
+    workers_db — WorkerIndex или просто список карточек (тогда индекс строится на один вызов).
+    Готовые словари (например, из JSON-задания) пропускаются как есть.
+    """
+    index = workers_db if isinstance(workers_db, WorkerIndex) else WorkerIndex(workers_db)
+    workers = []
+    for item in items:
+        if isinstance(item, dict):
+            workers.append(dict(item))
+            continue
+        ln = str(item).strip()
+        found = index.get(ln)
+        if found:
+            workers.append({k: found.get(k, "") for k in WORKER_FIELDS})
+        else:
+            workers.append({"fio": ln})
+    return workers
+
+# -------------------------
+# Манифест шаблона и ленивый контекст
+# -------------------------
+MANIFEST_FILE = APPDIR / "template_manifests.json"  # sha1 шаблона -> {"template", "variables"}
+MANIFEST_LIMIT = 64  # сколько версий шаблонов помнить
+
+_manifests = {}         # sha1 -> frozenset имён (None — шаблон не разобрался)
+_manifest_digests = {}  # path -> (mtime_ns, size, sha1)
+_manifest_lock = threading.Lock()
+
+def template_manifest(template_path):
+    """
+    Имена переменных верхнего уровня, которые использует шаблон (frozenset),
+    или None, если их не удалось определить (тогда контекст строится целиком).
+    Считается один раз на версию шаблона (ключ — sha1) и хранится в
+    MANIFEST_FILE, так что docxtpl для этого импортируется только при изменении шаблона.
+    """
+    path = Path(template_path)
+    with _manifest_lock:
+        data = None
+        try:
+            st = path.stat()
+            known = _manifest_digests.get(str(path))
+            if known and known[:2] == (st.st_mtime_ns, st.st_size):
+                digest = known[2]
+            else:
+                data = path.read_bytes()
+                digest = hashlib.sha1(data).hexdigest()
+                _manifest_digests[str(path)] = (st.st_mtime_ns, st.st_size, digest)
+        except OSError:
+            return None
+        if digest in _manifests:
+            return _manifests[digest]
+        stored = load_json(MANIFEST_FILE, {})
+        stored = stored if isinstance(stored, dict) else {}
+        entry = stored.get(digest)
+        if isinstance(entry, dict) and isinstance(entry.get("variables"), list):
+            names = frozenset(entry["variables"])
+        else:
+            try:
+                import docgen_render
+                variables = docgen_render.template_variables(data if data is not None else path.read_bytes())
+            except Exception:
+                _manifests[digest] = None
+                return None
+            names = frozenset(variables)
+            stored[digest] = {"template": path.name, "variables": variables}
+            while len(stored) > MANIFEST_LIMIT:
+                del stored[next(iter(stored))]
+            try:
+                write_json_atomic(MANIFEST_FILE, stored)
+            except Exception:
+                pass
+        _manifests[digest] = names
+        return names
+
+def _derive_hazard(m, values):
+    lines = str(values.get("hazards", "") or "").splitlines()
+    i = int(m.group(1)) - 1
+    return lines[i].strip() if i < len(lines) else ""
+
+def _derive_worker(m, values):
+    workers = values.get("workers") or []
+    i = int(m.group(1) or 0)
+    return workers[i].get(m.group(2) or "fio", "") if i < len(workers) else ""
+
+def _derive_slot(m, values):
+    i = int(m.group(2) or 0)
+    workers = values.get("workers") or []
+    return workers[i].get(m.group(1), "") if i < len(workers) else ""
+
+def _derive_w(m, values):
+    i = int(m.group(1) or 0)
+    workers = values.get("workers") or []
+    return short_name(workers[i].get("fio", "")) if i < len(workers) else ""
+
+def _hazard_keys(values):
+    return [f"hazards{i}" for i in range(1, 5)]
+
+def _worker_keys(values):
+    keys = []
+    for i in range(len(values.get("workers") or [])):
+        prefix = "worker" if i == 0 else f"worker{i}"
+        keys += ["worker", "worker0"] if i == 0 else [prefix]
+        keys += [f"{prefix}_{f}" for f in ("position", "birth", "pass", "place", "notes")]
+    return keys
+
+def _slot_keys(values, max_slots=SLOT_COUNT):
+    return [f"{f}{i or ''}" for i in range(max_slots) for f in ("position", "birth", "pass", "place")]
+
+def _w_keys(values, max_slots=SLOT_COUNT):
+    return ["w"] + [f"w{i}" for i in range(max_slots)]
+
+# семейства производных ключей: регулярка имени, вычисление значения, полный список ключей
+_DERIVED_KEYS = {
+    "hazards": (re.compile(r"hazards([1-4])$"), _derive_hazard, _hazard_keys),
+    "worker": (re.compile(r"worker(\d*)(?:_(position|birth|pass|place|notes))?$"), _derive_worker, _worker_keys),
+    "slot": (re.compile(r"(position|birth|pass|place)(\d*)$"), _derive_slot, _slot_keys),
+    "w": (re.compile(r"w(\d*)$"), _derive_w, _w_keys),
+}
+CTX_FAMILIES = ("hazards", "worker", "slot")
+PERMIT_FAMILIES = CTX_FAMILIES + ("w",)
+# номер группы регулярки с индексом работника в семействах, привязанных к слотам
+_SLOT_INDEX_GROUP = {"worker": 1, "slot": 2, "w": 1}
+
+def _match_derived(key, families):
+    for family in families:
+        regex, derive, _ = _DERIVED_KEYS[family]
+        m = regex.match(key) if isinstance(key, str) else None
+        if m:
+            return derive, m
+    return None
+
+def template_slot_capacity(names, families=CTX_FAMILIES):
+    """
+    Сколько работников помещается в шаблон: наибольший номер слота (position5,
+    w11, worker3_pass...) из манифеста names + 1. Учитываются только слоты с
+    номером: одиночные position/pass/worker — это общее поле или первый
+    работник, а не таблица. None — ограничения нет: манифест неизвестен,
+    шаблон обходит workers циклом или в нём нет нумерованных слотов.
+    """
+    if names is None or "workers" in names:
+        return None
+    top = 0
+    for name in names:
+        for family in families:
+            group = _SLOT_INDEX_GROUP.get(family)
+            m = _DERIVED_KEYS[family][0].match(name) if group else None
+            if m and m.group(group):
+                top = max(top, int(m.group(group)))
+    return top + 1 if top > 0 else None
+
+class ContextSnapshot(Mapping):
+    """
+    Неизменяемый снимок значений формы (или задания) на момент генерации:
+    строится один раз — в GUI на потоке Tk — и общий для всех документов
+    набора. Производные ключи (семейства _DERIVED_KEYS) вычисляются при
+    первом запросе и запоминаются в снимке, поэтому hazards/слоты работников
+    считаются один раз на набор. Снимок не меняется после создания, так что
+    его можно отдавать фоновым потокам и процессам пула (pickle).
+    """
+    def __init__(self, values):
+        values = dict(values)
+        if isinstance(values.get("workers"), list):
+            values["workers"] = tuple(values["workers"])
+        self._values = values
+        self._derived = {}
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def derive(self, key, families):
+        """Значение производного ключа из семейств families; KeyError, если ключ не производный."""
+        if key in self._derived:
+            return self._derived[key]
+        found = _match_derived(key, families)
+        if found is None:
+            raise KeyError(key)
+        derive, m = found
+        value = self._derived[key] = derive(m, self._values)
+        return value
+
+    def derived_keys(self, families):
+        keys = []
+        for family in families:
+            keys += [k for k in _DERIVED_KEYS[family][2](self._values) if k not in self._values]
+        return list(dict.fromkeys(keys))
+
+class LazyContext(Mapping):
+    """
+    Контекст документа: снимок (ContextSnapshot) + небольшой слой значений
+    конкретного документа (numb) + производные ключи (hazards1..4, worker*,
+    position*/birth*/pass*/place*, w*), которые вычисляются при первом
+    обращении. names — манифест шаблона: если он известен, из производных
+    существуют только те ключи, что шаблон использует; иначе доступны все,
+    как раньше. Слой документа важнее снимка, снимок — важнее производных.
+    Объект передаётся в процессы пула как есть (pickle).
+    """
+    def __init__(self, values, families=CTX_FAMILIES, names=None, overlay=None):
+        self._base = values if isinstance(values, ContextSnapshot) else ContextSnapshot(values)
+        self._overlay = dict(overlay or {})
+        self._families = tuple(families)
+        self._names = names
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        if key in self._base:
+            return self._base[key]
+        if self._names is not None and key not in self._names:
+            raise KeyError(key)
+        return self._base.derive(key, self._families)
+
+    def _derived_keys(self):
+        if self._names is not None:
+            return [k for k in self._names if k not in self._overlay and k not in self._base
+                    and _match_derived(k, self._families)]
+        return [k for k in self._base.derived_keys(self._families) if k not in self._overlay]
+
+    def __iter__(self):
+        yield from self._overlay
+        yield from (k for k in self._base if k not in self._overlay)
+        yield from self._derived_keys()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+# Контекст из формы. form — плоский словарь значений полей GUI по ключам widgets
+# (fio_combined — три строки И.п/Р.п/Д.п, a/b/d/e — полные даты, hazards — по строке
+# на фактор, spisok_workers — ФИО по строке и т.д.), строки уже без крайних пробелов.
+_DERIVED_SHARED = ("fio", "fio2", "fio4", "fio1", "fio3", "aa", "bb", "dd", "ee", "numb")
+_DATE_KEYS = (("a", "aa"), ("b", "bb"), ("d", "dd"), ("e", "ee"))
+
+def _is_worker_slot(key):
+    # w, w0..w11 заполняются из списка работников, а не из формы (work_scope — обычное поле)
+    return re.fullmatch(r"w\d*", key) is not None
+
+def split_fio(form):
+    fio_lines = (form.get("fio_combined") or "").strip().splitlines()
+    return {k: (fio_lines[i] if i < len(fio_lines) else "") for i, k in enumerate(("fio", "fio2", "fio4"))}
+
+def profile_from_form(form):
+    """Значения формы, которые сохраняются в defaults.json (без производных aa/bb/.. и w0..w11)."""
+    new = split_fio(form)
+    for k in ("fio1", "fio3"):
+        if k in form: new[k] = form[k]
+    for k in mapping["shared"]:
+        if k in _DERIVED_SHARED: continue
+        if k in form: new[k] = form[k]
+    for k in mapping["spisok"]:
+        if k in form: new[k] = form[k]
+    for k in mapping["permit"]:
+        if _is_worker_slot(k): continue
+        if k in form: new[k] = form[k]
+    return new
+
+def _common_values(form):
+    ctx = split_fio(form)
+    for k in ("fio1", "fio3"):
+        if k in form: ctx[k] = form[k]
+    for k in mapping["shared"]:
+        if k in _DERIVED_SHARED: continue
+        if k in form: ctx[k] = form[k]
+    for dkey, mkey in _DATE_KEYS:
+        ctx[dkey], ctx[mkey] = parse_ddmmyyyy(form.get(dkey, ""))
+
+    # permit-поля (не включая w0..w11)
+    for k in mapping["permit"]:
+        if _is_worker_slot(k): continue
+        if k in form: ctx[k] = form[k]
+    return ctx
+
+def _spisok_values(form, workers_db=(), defaults=None):
+    ctx = _common_values(form)
+    defaults = defaults or {}
+
+    spisok_fields = {}
+    for k in mapping["spisok"]:
+        # если поля нет в форме — берем значение из defaults если есть, иначе пустую строку
+        val = form[k] if k in form else defaults.get(k, "")
+        ctx[k] = val
+        spisok_fields[k] = val
+    # для шаблонов, которые обращаются как {{ spisok.predmet }}
+    ctx["spisok"] = spisok_fields
+
+    sp = form.get("spisok_workers", "")
+    ctx["workers"] = resolve_workers([l.strip() for l in sp.splitlines() if l.strip()], workers_db)
+    if ctx["workers"]:
+        # position/birth/pass/place — слот 0, то есть первый работник; общие значения остаются в ctx["spisok"]
+        for k in ("position", "birth", "pass", "place"):
+            ctx.pop(k, None)
+    return ctx
+
+def complete_ctx(ctx, workers_db=()):
+    """
+    Дополнить готовый контекст (ключи form_snapshot) тем, чего в нём нет:
+    месяц.год из полных дат дд.мм.гггг и карточки работников. hazards1..4 и слоты
+    работников достраивает LazyContext в build_document_jobs. Явно заданные ключи не перезаписываются.
+    """
+    ctx = dict(ctx)
+    for dkey, mkey in (("a", "aa"), ("b", "bb"), ("d", "dd"), ("e", "ee")):
+        if mkey not in ctx and ctx.get(dkey):
+            day, month_year = parse_ddmmyyyy(str(ctx[dkey]))
+            if month_year:
+                ctx[dkey], ctx[mkey] = day, month_year
+    items = ctx.get("workers") or []
+    if isinstance(items, str):
+        items = [ln for ln in items.splitlines() if ln.strip()]
+    ctx["workers"] = resolve_workers(items, workers_db)
+    return ctx
+
+def _families(key):
+    return PERMIT_FAMILIES if key == "permit" else CTX_FAMILIES
+
+def document_context(key, template_path, values, numb, overlay=None):
+    """
+    Контекст одного документа набора: общий снимок values (ContextSnapshot
+    или словарь) + слой с numb (и overlay); производные ключи — по манифесту
+    шаблона, слоты w/w0..w11 — только у наряда-допуска.
+    """
+    layer = {"numb": numb}
+    layer.update(overlay or {})
+    return LazyContext(values, _families(key), template_manifest(template_path), overlay=layer)
+
+def form_snapshot(form, workers_db=(), defaults=None):
+    """
+    Снимок формы для генерации: ФИО (fio, fio2, fio4, fio1, fio3), даты
+    (день + месяц.год: a/aa, b/bb, d/dd, e/ee), поля наряда, поля списка
+    (и вложенный spisok — для {{ spisok.predmet }}) и workers — карточки
+    работников. Производные ключи (hazards1..4, worker, worker1..,
+    workerN_position.., position/position1.., birth.., pass.., place.., w/w0..)
+    достраивает LazyContext документа по манифесту шаблона.
+    """
+    return ContextSnapshot(_spisok_values(form, workers_db, defaults))
+
+def output_filename(key, numb, sheet=1):
+    """Имя итогового файла вида «наряд-допуск (1606-А).docx» (продолжения — «... лист 2.docx») без запрещённых символов."""
+    human = DOCUMENT_NAMES.get(key, key)
+    tail = f" лист {sheet}" if sheet > 1 else ""
+    return re.sub(r'[\\/:*?"<>|]', '_', f"{human} ({numb}){tail}.docx")
+
+def template_jobs(key, template_path, snapshot, numb, output_dir):
+    """
+    Задания render_documents() для одного документа набора. Если работников
+    больше, чем слотов в шаблоне (template_slot_capacity), список режется на
+    листы: у каждого свой снимок с частью workers (слоты снова с 0) и в
+    контексте sheet/sheets. Первый лист сохраняет обычное имя файла,
+    продолжения — «лист 2», «лист 3»...; в пуле листы рендерятся параллельно.
+    """
+    workers = snapshot.get("workers") or ()
+    capacity = template_slot_capacity(template_manifest(template_path), _families(key))
+    if not capacity or len(workers) <= capacity:
+        return [(template_path, document_context(key, template_path, snapshot, numb),
+                 str(Path(output_dir) / output_filename(key, numb)))]
+    chunks = [workers[i:i + capacity] for i in range(0, len(workers), capacity)]
+    values = dict(snapshot)
+    jobs = []
+    for n, chunk in enumerate(chunks, 1):
+        sheet = ContextSnapshot(dict(values, workers=chunk))
+        ctx = document_context(key, template_path, sheet, numb, {"sheet": n, "sheets": len(chunks)})
+        jobs.append((template_path, ctx, str(Path(output_dir) / output_filename(key, numb, n))))
+    return jobs
+
+def build_document_jobs(ctx, numb, output_dir):
+    """
+    Задания render_documents() для полного набора документов с одним номером.
+    ctx — ContextSnapshot или словарь (он один раз превращается в снимок); все
+    документы делят снимок, у каждого свой слой с numb. Длинный список
+    работников даёт несколько листов документа (см. template_jobs).
+    """
+    snapshot = ctx if isinstance(ctx, ContextSnapshot) else ContextSnapshot(ctx)
+    jobs = []
+    for key, path in DOCUMENT_TEMPLATES.items():
+        if not path.exists():
+            continue
+        jobs += template_jobs(key, path, snapshot, numb, output_dir)
+    return jobs
+
+def get_output_dir(settings=None):
+    if settings is None:
+        settings = load_json(SETTINGS_FILE, {}) or {}
+    return Path(settings.get("output_dir") or APPDIR)
+
+def write_error_log(errors, tag=None) -> Path:
+    """Подробный лог ошибок генерации: errors — список (template_path, message, traceback)."""
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    name = f"docgen_error_{tag}_{stamp}.log" if tag else f"docgen_error_{stamp}.log"
+    log_path = APPDIR / re.sub(r'[\\/:*?"<>|]', '_', name)
+    with open(log_path, "w", encoding="utf-8") as lf:
+        for p, msg, tb in errors:
+            lf.write(f"=== {p} ===\n{msg}\n{tb}\n\n")
+    return log_path
+
+def render_docx_safely(template_path: Path, ctx: dict, out_path: str):
+    """Отрендерить шаблон в out_path (см. docgen_render.render_docx_safely); docxtpl импортируется здесь, а не при загрузке ядра."""
+    import docgen_render
+    return docgen_render.render_docx_safely(template_path, ctx, out_path)
+
+def render_docx_bytes(template_path: Path, ctx: dict) -> bytes:
+    """Отрендерить шаблон в память и вернуть готовый .docx (см. docgen_render.render_docx_bytes)."""
+    import docgen_render
+    return docgen_render.render_docx_bytes(template_path, ctx)
+
+# -------------------------
+# Рендеринг набора документов (последовательно или в пуле процессов)
+# -------------------------
+RENDER_POOL_SIZE = min(4, os.cpu_count() or 1)
+
+_render_pool = None
+_render_pool_initializer = None  # запоминается, чтобы пул, пересозданный после падения, тоже прогревался
+_render_pool_lock = threading.Lock()
+
+def warm_templates():
+    """Разобрать все шаблоны набора (склейка и docxtpl) в кэш процесса — инициализатор процессов пула."""
+    import docgen_render
+    for path in DOCUMENT_TEMPLATES.values():
+        if path.exists():
+            try:
+                docgen_render.get_splice_template(path)
+                docgen_render.get_compiled_template(path)
+            except Exception:
+                pass  # сломанный шаблон даст ошибку в своём документе
+
+def get_render_pool(initializer=None):
+    """
+    Пул процессов живёт до выхода из программы: в каждом воркере остаётся
+    свой прогретый кэш шаблонов, поэтому повторные генерации не платят за разбор .docx.
+    initializer (например, warm_templates) запоминается и применяется к пулу
+    при создании — в том числе когда пул пересоздаётся после падения процесса.
+    """
+    global _render_pool, _render_pool_initializer
+    with _render_pool_lock:
+        if initializer is not None:
+            _render_pool_initializer = initializer
+        if _render_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_POOL_SIZE, initializer=_render_pool_initializer)
+        return _render_pool
+
+def shutdown_render_pool(wait=False):
+    global _render_pool
+    with _render_pool_lock:
+        pool, _render_pool = _render_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+def _render_job(template_path, ctx, out_path):
+    """Рендер одного документа; вместо исключения возвращает (сообщение, traceback) — так ошибка переживает pickle."""
+    try:
+        render_docx_safely(Path(template_path), ctx, out_path)
+        return None
+    except Exception as e:
+        return (str(e), traceback.format_exc())
+
+def _render_bytes_job(template_path, ctx):
+    """Как _render_job, но документ возвращается байтами: (данные, None) или (None, (сообщение, traceback))."""
+    try:
+        return render_docx_bytes(Path(template_path), ctx), None
+    except Exception as e:
+        return None, (str(e), traceback.format_exc())
+
+def render_documents_bytes(items, parallel=False):
+    """
+    Отрендерить документы без записи на диск. items — список (template_path, ctx);
+    для каждого возвращается (данные .docx, None) или (None, (сообщение, traceback)).
+    При parallel=True документы рендерятся одновременно в пуле процессов с
+    прогретым кэшем шаблонов; если пул упал — в текущем процессе.
+    """
+    results = {}
+    if parallel and items:
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            pool = get_render_pool()
+            futures = [pool.submit(_render_bytes_job, str(path), ctx) for path, ctx in items]
+            for i, f in enumerate(futures):
+                results[i] = f.result()
+        except (BrokenProcessPool, OSError):
+            shutdown_render_pool()
+    return [results[i] if i in results else _render_bytes_job(str(path), ctx) for i, (path, ctx) in enumerate(items)]
+
+def render_documents(jobs, parallel=False, on_done=None, cancel=None):
+    """
+    jobs: список (template_path, ctx, out_path).
+    Возвращает (outs, errors): пути созданных файлов в порядке jobs и
+    ошибки в формате generate_docx_all — (template_path, message, traceback).
+    При parallel=True документы рендерятся одновременно в пуле процессов;
+    если пул не смог запуститься или упал, набор рендерится в текущем процессе.
+    on_done(i, res) вызывается по мере готовности каждого документа (res — None
+    или (сообщение, traceback)); cancel — threading.Event: ещё не начатые
+    документы пропускаются и не попадают ни в outs, ни в errors.
+    """
+    results = {}
+
+    def finish(i, res):
+        results[i] = res
+        if on_done is not None:
+            on_done(i, res)
+
+    if parallel and jobs:
+        from concurrent.futures import wait, FIRST_COMPLETED
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            pool = get_render_pool()
+            futures = {pool.submit(_render_job, str(path), ctx, str(out)): i for i, (path, ctx, out) in enumerate(jobs)}
+            pending = set(futures)
+            cancelled = False
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for f in done:
+                    if not f.cancelled():
+                        finish(futures[f], f.result())
+                if not cancelled and cancel is not None and cancel.is_set():
+                    # уже запущенные документы дорендериваются — файл не останется недописанным
+                    cancelled = True
+                    for f in pending:
+                        f.cancel()
+        except (BrokenProcessPool, OSError):
+            shutdown_render_pool()
+    if len(results) < len(jobs):
+        # последовательный режим, а также то, что не успел сделать упавший пул
+        for i, (path, ctx, out) in enumerate(jobs):
+            if cancel is not None and cancel.is_set():
+                break
+            if i not in results:
+                finish(i, _render_job(str(path), ctx, str(out)))
+
+    outs = []
+    errors = []
+    for i, (path, ctx, out) in enumerate(jobs):
+        if i not in results:
+            continue
+        res = results[i]
+        if res is None:
+            outs.append(str(out))
+        else:
+            errors.append((str(path), res[0], res[1]))
+    return outs, errors
@@ -0,0 +1,2896 @@
+import os
+import queue
+import threading
+import traceback
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import tkinter as tk
+import customtkinter as ctk
+import platform
+
+from docgen_core import (
+    APPDIR, base, TEMPLATE_PERMIT, TEMPLATE_SPISOK, TEMPLATE_ORDER, TEMPLATE_PB_ORDER,
+    DEFAULTS_FILE, TEMPLATES_FILE, SETTINGS_FILE, BRIGADES_FILE,
+    mapping, load_stores, StoreWriter, ChangeBus, write_json_atomic, tpl_name, tpl_content,
+    peek_numb, format_numb, reserve_numbers, set_numb, profile_from_form, form_snapshot, build_document_jobs, write_error_log, render_documents,
+)
+
+DEFAULTS_JSON = base / "defaults.json"
+TEMPLATES_JSON = base / "templates.json"
+WORKERS_JSON = base / "workers.json"
+COUNTERS_JSON = base / "counters.json"
+SETTINGS_JSON = base / "settings.json"
+BRIGADES_JSON = base / "brigades.json"
+F_1606 = base / "наряд-допуск (1606-А).docx"
+HUMAN_SAFE_NUMB = base / "{human} ({safe_numb}).docx"
+TOGGLE_APPEARANCE_MODE_BETWEEN_LIGHT_AND_DARK_AND_PERSIST_IN_SETTINGS_JSON = base / "Toggle appearance mode between Light and Dark and persist in settings.json"
+
+ctk.set_appearance_mode('Light')  # System, Dark, Light
+ctk.set_default_color_theme('blue')
+
+
+
+# --- Автоматические биндинги для полей ввода ---
+# Оборачиваем конструкторы ctk.CTkEntry, tk.Text и ctk.CTkEntry так, чтобы у всех полей были стандартные горячие клавиши и поведение клика.
+# Реализуем copy/paste/cut через clipboard, и не возвращаем "break" для клика, чтобы сохранить стандартное поведение фокуса.
+try:
+    _orig_tk_Entry = ctk.CTkEntry
+    _orig_tk_Text = tk.Text
+    _orig_ttk_Entry = ctk.CTkEntry
+except Exception:
+    _orig_tk_Entry = None
+
+def _add_edit_bindings(w):
+    try:
+        # Copy
+        def copy_ev(e=None):
+            try:
+                # for Text widgets, selection_get works; for Entry too.
+                try:
+                    sel = w.selection_get()
+                except Exception:
+                    return
+                w.clipboard_clear()
+                w.clipboard_append(sel)
+            except Exception:
+                pass
+            # let default handlers (if any) run
+            return
+
+        # Paste
+        def paste_ev(e=None):
+            try:
+                txt = w.clipboard_get()
+            except Exception:
+                return
+            try:
+                # replace selection if any
+                try:
+                    sel_first = w.index("sel.first")
+                    sel_last = w.index("sel.last")
+                    w.delete(sel_first, sel_last)
+                except Exception:
+                    pass
+                try:
+                    w.insert("insert", txt)
+                except Exception:
+                    # for Entry widgets, use icursor and insert at position
+                    try:
+                        pos = w.index("insert")
+                        w.insert(pos, txt)
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+            return
+
+        # Cut
+        def cut_ev(e=None):
+            try:
+                try:
+                    sel = w.selection_get()
+                except Exception:
+                    sel = ""
+                if sel:
+                    w.clipboard_clear()
+                    w.clipboard_append(sel)
+                    try:
+                        w.delete("sel.first", "sel.last")
+                    except Exception:
+                        # Entry may require numeric indices
+                        try:
+                            start = w.index("sel.first")
+                            end = w.index("sel.last")
+                            w.delete(start, end)
+                        except Exception:
+                            pass
+            except Exception:
+                pass
+            return
+
+        # Click: set cursor and focus, but do not block event propagation
+        def on_click(e):
+            try:
+                # for Text: index like "line.column", for Entry: numeric index
+                if hasattr(w, "index"):
+                    try:
+                        idx = w.index("@%d,%d" % (e.x, e.y))
+                        try:
+                            w.mark_set("insert", idx)
+                        except Exception:
+                            try:
+                                w.icursor(idx)
+                            except Exception:
+                                pass
+                    except Exception:
+                        pass
+                w.focus_set()
+            except Exception:
+                try:
+                    w.focus_set()
+                except Exception:
+                    pass
+            # do not return "break" so default behavior (selection, click) still works
+            return
+
+        # Bindings for common accelerators (Ctrl/Command)
+        w.bind("<Control-c>", lambda e: copy_ev(e), add=True)
+        w.bind("<Control-x>", lambda e: cut_ev(e), add=True)
+        w.bind("<Control-v>", lambda e: paste_ev(e), add=True)
+        w.bind("<Control-C>", lambda e: copy_ev(e), add=True)
+        w.bind("<Control-X>", lambda e: cut_ev(e), add=True)
+        w.bind("<Control-V>", lambda e: paste_ev(e), add=True)
+        # macOS Command key
+        w.bind("<Command-c>", lambda e: copy_ev(e), add=True)
+        w.bind("<Command-x>", lambda e: cut_ev(e), add=True)
+        w.bind("<Command-v>", lambda e: paste_ev(e), add=True)
+
+        # Click-to-set-insert (works for Entry and Text). Use add=True to not override existing binds.
+        w.bind("<Button-1>", on_click, add=True)
+    except Exception:
+        pass
+
+def _Entry(*args, **kwargs):
+    w = _orig_tk_Entry(*args, **kwargs)
+    _add_edit_bindings(w)
+    return w
+
+def _Text(*args, **kwargs):
+    w = _orig_tk_Text(*args, **kwargs)
+    _add_edit_bindings(w)
+    return w
+
+def _ttk_Entry(*args, **kwargs):
+    w = _orig_ttk_Entry(*args, **kwargs)
+    _add_edit_bindings(w)
+    return w
+
+# Apply replacements if available
+try:
+    if _orig_tk_Entry is not None:
+        ctk.CTkEntry = _Entry
+        # tk.Text = _Text  # disabled to avoid scrolledtext import error
+        ctk.CTkEntry = _ttk_Entry
+except Exception:
+    pass
+
+# --- конец биндингов ---
+
+
+from tkinter import ttk, Toplevel, messagebox, scrolledtext, filedialog
+import ctypes
+
+# --- helper: create a CTk-styled toplevel, fallback to Toplevel with CTk frame bg ---
+def make_ctk_toplevel(root, title="", geometry=None):
+    """
+    Try to create ctk.CTkToplevel (so window chrome follows CTk theme).
+    If not available, create plain Toplevel and set its bg to CTk frame fg_color (if possible).
+    Ensure the window is deiconified, lifted and focused to avoid immediate minimization on some systems.
+    """
+    try:
+        win = ctk.CTkToplevel(root)
+        if geometry:
+            try: win.geometry(geometry)
+            except Exception: pass
+        if title:
+            try: win.title(title)
+            except Exception: pass
+        try:
+            win.update_idletasks()
+            win.deiconify(); win.lift(); win.focus_force()
+            try:
+                win.attributes("-topmost", True)
+                win.after(100, lambda: win.attributes("-topmost", False))
+            except Exception:
+                pass
+        except Exception:
+            pass
+        return win
+    except Exception:
+        win = Toplevel(root)
+        if geometry:
+            try: win.geometry(geometry)
+            except Exception: pass
+        if title:
+            try: win.title(title)
+            except Exception: pass
+        try:
+            tmp = ctk.CTkFrame(win)
+            bg = tmp.cget("fg_color")
+            tmp.destroy()
+            try:
+                win.configure(bg=bg)
+            except Exception:
+                pass
+        except Exception:
+            pass
+        try:
+            win.update_idletasks()
+            win.deiconify(); win.lift(); win.focus_force()
+            try:
+                win.attributes("-topmost", True)
+                win.after(100, lambda: win.attributes("-topmost", False))
+            except Exception:
+                pass
+        except Exception:
+            pass
+        return win
+
+
+
+def _do_add_selected_inner(sel_window, names, vars_list):
+    try:
+        picks = [name for i,name in enumerate(names) if vars_list[i].get()]
+        if not picks:
+            messagebox.showwarning("Внимание","Выберите хотя бы одного работника")
+            return
+        s = widgets["spisok_workers"]["widget"]
+        try:
+            existing = [ln.strip() for ln in s.get("1.0","end").splitlines() if ln.strip()]
+        except Exception:
+            existing = []
+        to_add = [n for n in picks if n not in existing]
+        if to_add:
+            add_text = "\n".join(to_add)
+            try:
+                if existing:
+                    s.insert("end", "\n" + add_text)
+                else:
+                    s.insert("1.0", add_text)
+            except Exception:
+                try:
+                    s.insert("1.0", add_text)
+                except Exception:
+                    pass
+            schedule_autosave(); refresh_permit_workers_display()
+        try:
+            sel_window.destroy()
+        except Exception:
+            pass
+    except Exception:
+        try:
+            sel_window.destroy()
+        except Exception:
+            pass
+
+def _do_add_all_inner(sel_window, all_names):
+    try:
+        if not all_names:
+            messagebox.showwarning("Внимание","Список работников пуст")
+            return
+        s = widgets["spisok_workers"]["widget"]
+        try:
+            existing = [ln.strip() for ln in s.get("1.0","end").splitlines() if ln.strip()]
+        except Exception:
+            existing = []
+        to_add = [n for n in all_names if n not in existing]
+        if not to_add:
+            messagebox.showinfo("Внимание", "Нечего добавлять — все работники уже в списке.")
+            try:
+                sel_window.destroy()
+            except Exception:
+                pass
+            return
+        add_text = "\n".join(to_add)
+        try:
+            if existing:
+                s.insert("end", "\n" + add_text)
+            else:
+                s.insert("1.0", add_text)
+        except Exception:
+            try:
+                s.insert("1.0", add_text)
+            except Exception:
+                pass
+        schedule_autosave(); refresh_permit_workers_display()
+        try:
+            sel_window.destroy()
+        except Exception:
+            pass
+    except Exception:
+        try:
+            sel_window.destroy()
+        except Exception:
+            pass
+
+
+# -------------------------
+# Хранилища (файлы в APPDIR, логика — в docgen_core)
+# -------------------------
+bus = ChangeBus()  # уведомления об изменениях хранилищ ("templates.fields.<ключ>", ...)
+stores = load_stores(bus)
+defaults = stores["defaults"].data
+templates = stores["templates"].data
+workers_store = stores["workers"]  # workers.json или workers.db — см. open_worker_store
+workers_db = workers_store.data
+counters = stores["counters"].data
+settings = stores["settings"].data
+brigades_db = stores["brigades"].data
+workers_index = workers_store.index  # поиск карточек по ФИО; store обновляет его вместе с workers_db
+
+# Apply saved appearance mode (Light/Dark) from settings
+try:
+    appearance = settings.get("appearance_mode", "Light")
+    ctk.set_appearance_mode(appearance)
+except Exception:
+    pass
+
+# Хранилища пишутся в фоновом потоке и только если содержимое изменилось
+store_writer = StoreWriter()
+_stores_by_path = {str(s.path): s for s in stores.values()}
+
+def save_json(path, obj):
+    # изменения хранилища публикуются в bus — виджеты, подписанные на
+    # "templates.fields.<ключ>", обновятся сами
+    store = _stores_by_path.get(str(Path(path)))
+    if store is not None and store.data is obj:
+        store.save(store_writer)
+    else:
+        write_json_atomic(path, obj)
+
+def save_brigades_db():
+    global brigades_db
+    save_json(BRIGADES_FILE, brigades_db)
+
+# UI constants (подогнаны чтобы кнопки внизу помещали текст)
+# --- UI: единые шрифт/размеры/размеры полей ---
+BUTTON_WIDTH_DEFAULT = 20
+BUTTON_WIDTH_LARGE = 36
+
+#  Настройте здесь желаемый шрифт и размеры:
+if platform.system() == 'Darwin':
+    UI_FONT_FAMILY = ''  # let Tk use system default on macOS (San Francisco)
+else:
+    UI_FONT_FAMILY = 'Segoe UI'   # можно поставить "Segoe UI", "Tahoma" или др.
+UI_FONT_SIZE   = 12        # базовый размер шрифта для интерфейса
+UI_BUTTON_SIZE = 11        # размер шрифта для кнопок
+UI_BUTTON_LARGE_SIZE = 12  # для больших кнопок (если нужно)
+
+# Константы для единого размера полей и текстовых блоков:
+ENTRY_WIDTH_DEFAULT = 80   # используйте вместо литералов width=80/100
+TEXT_HEIGHT_DEFAULT = 4    # используйте вместо литералов height=4/18 и т.д.
+
+# Готовые к использованию кортежи (как раньше)
+BUTTON_FONT = (UI_FONT_FAMILY, UI_BUTTON_SIZE)
+BUTTON_FONT_LARGE = (UI_FONT_FAMILY, UI_BUTTON_LARGE_SIZE)
+DEFAULT_FONT = (UI_FONT_FAMILY, UI_FONT_SIZE)
+
+# Helper to create a combobox using CTk if available, falling back to ttk.Combobox.
+
+# Registry for template comboboxes so they can be refreshed when templates change
+template_combos = []  # list of tuples (key, combo_instance)
+
+
+
+
+
+
+class TemplateCombo:
+    """
+    Simplified TemplateCombo: NO display text field (only a toggle button).
+    The button opens a popup list of templates; selecting an item sets the variable.
+    Clicking the button when popup is open will close it (arrow toggles ▲/▼).
+    API: get(), set(val), set_values(list), bind(event, callback), pack/grid/place proxies.
+    """
+    def __init__(self, parent, var=None, values=None, width=58, show_display=False):
+        self.parent = parent
+        self.var = var if var is not None else tk.StringVar()
+        self.values = list(values) if values else []
+        self.container = ctk.CTkFrame(parent) if hasattr(ctk, 'CTkFrame') else ttk.Frame(parent)
+        # We intentionally do NOT create a display widget; only the button remains.
+        self.show_display = False
+
+        # Create only the button with arrow that toggles the popup
+        try:
+            self.button = ctk.CTkButton(self.container, text="▾", width=32, command=self._toggle_popup)
+            self.button.grid(row=0, column=0, padx=(0,0))
+        except Exception:
+            self.button = ttk.Button(self.container, text="▾", command=self._toggle_popup)
+            try:
+                self.button.grid(row=0, column=0, padx=(0,0))
+            except Exception:
+                pass
+
+        # make container column config consistent
+        try:
+            self.container.grid_columnconfigure(0, weight=1)
+        except Exception:
+            pass
+
+        self.popup = None
+        self._callbacks = []
+
+    def _toggle_popup(self):
+        # Explicitly toggle: if popup exists -> close, else -> open
+        if self.popup and getattr(self.popup, "winfo_exists", lambda: False)():
+            self._close_popup()
+        else:
+            self._open_popup()
+
+    def _open_popup(self):
+        # create popup to show values; if already exists, do nothing
+        try:
+            if self.popup and getattr(self.popup, "winfo_exists", lambda: False)():
+                return
+            self.popup = tk.Toplevel(self.container)
+            self.popup.wm_overrideredirect(True)
+            # place below the container/button
+            x = self.container.winfo_rootx()
+            y = self.container.winfo_rooty() + self.container.winfo_height()
+            self.popup.wm_geometry(f"+{x}+{y}")
+            # build listbox
+            lb = tk.Listbox(self.popup, exportselection=False)
+            for v in self.values:
+                lb.insert("end", v)
+            lb.pack(side="left", fill="both", expand=True)
+            # scroll bar
+            sb = ttk.Scrollbar(self.popup, command=lb.yview)
+            lb.config(yscrollcommand=sb.set)
+            sb.pack(side="right", fill="y")
+            # bind selection
+            def on_select(evt):
+                sel = None
+                try:
+                    idx = lb.curselection()
+                    if idx:
+                        sel = lb.get(idx)
+                except Exception:
+                    pass
+                if sel is not None:
+                    try:
+                        self.set(sel)
+                    except Exception:
+                        try:
+                            self.var.set(sel)
+                        except Exception:
+                            pass
+                    # call callbacks bound to <<ComboboxSelected>>
+                    for cb in list(self._callbacks):
+                        try:
+                            cb(None)
+                        except Exception:
+                            pass
+                    self._close_popup()
+            lb.bind("<<ListboxSelect>>", on_select)
+
+            # change arrow to up immediately
+            try:
+                if hasattr(self.button, "configure"):
+                    try:
+                        self.button.configure(text="▴")
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+
+            # clicking outside should close popup: bind focus out on the popup and global click
+            self.popup.bind("<FocusOut>", lambda e: self._close_popup())
+            # Also bind a global click on root to close when clicking outside
+            try:
+                root = self.container.winfo_toplevel()
+                self._global_bind_after_id = None
+                try:
+                    # delay binding so the current click that opened the popup is not captured
+                    self._global_bind_after_id = root.after(100, lambda: root.bind_all("<Button-1>", self._global_click_handler, add="+"))
+                except Exception:
+                    self._global_bind_after_id = None
+            except Exception:
+                pass
+
+            # try to focus the popup so FocusOut works
+            try:
+                self.popup.focus_force()
+            except Exception:
+                pass
+
+        except Exception:
+            self.popup = None
+
+    def _global_click_handler(self, event):
+        # close popup if click occurred outside the popup window
+        try:
+            if not (self.popup and getattr(self.popup, "winfo_exists", lambda: False)()):
+                return
+            w = event.widget
+            # If clicked widget is inside the popup, ignore
+            if str(w).startswith(str(self.popup)):
+                return
+            # If clicked widget is the button, allow toggle to handle it (do not close here)
+            if w is self.button or str(w).startswith(str(self.button)):
+                return
+            self._close_popup()
+        except Exception:
+            pass
+
+    def _close_popup(self):
+        try:
+            # unbind global click handler to avoid leaks
+            try:
+                root = self.container.winfo_toplevel()
+                try:
+                    # cancel scheduled global bind if it wasn't executed yet
+                    if getattr(self, '_global_bind_after_id', None):
+                        try:
+                            root.after_cancel(self._global_bind_after_id)
+                        except Exception:
+                            pass
+                        self._global_bind_after_id = None
+                except Exception:
+                    pass
+                try:
+                    root.unbind_all("<Button-1>")
+                except Exception:
+                    pass
+            except Exception:
+                pass
+
+            if self.popup and getattr(self.popup, "winfo_exists", lambda: False)():
+                try:
+                    self.popup.destroy()
+                except Exception:
+                    try:
+                        self.popup.withdraw()
+                    except Exception:
+                        pass
+            self.popup = None
+            # restore arrow down
+            try:
+                if hasattr(self.button, "configure"):
+                    try:
+                        self.button.configure(text="▾")
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+        except Exception:
+            self.popup = None
+
+    def set_values(self, values):
+        # rebuild values list; if popup open, recreate it to reflect changes
+        try:
+            self.values = list(values)
+        except Exception:
+            self.values = []
+        if self.popup and getattr(self.popup, "winfo_exists", lambda: False)():
+            try:
+                self._close_popup()
+                self._open_popup()
+            except Exception:
+                pass
+
+    def bind(self, ev, callback):
+        # accept '<<ComboboxSelected>>' and store callbacks
+        if ev == '<<ComboboxSelected>>':
+            try:
+                if callable(callback):
+                    self._callbacks.append(callback)
+            except Exception:
+                pass
+        else:
+            try:
+                self.container.bind(ev, callback)
+            except Exception:
+                try:
+                    self.button.bind(ev, callback)
+                except Exception:
+                    pass
+
+    def grid(self, *a, **k): return self.container.grid(*a, **k)
+    def pack(self, *a, **k): return self.container.pack(*a, **k)
+    def place(self, *a, **k): return self.container.place(*a, **k)
+    def widget(self): return self.button
+
+    def get(self):
+        try:
+            return self.var.get()
+        except Exception:
+            return ""
+
+    def set(self, val):
+        try:
+            self.var.set(val)
+        except Exception:
+            pass
+
+
+def make_combo(parent, textvariable, values, width=58, key=None, show_display=True):
+    """
+    Factory: returns a TemplateCombo instance. If key provided, registers combo in template_combos.
+    """
+    combo = TemplateCombo(parent, textvariable, values=values, width=width, show_display=show_display)
+    if key is not None:
+        try:
+            template_combos.append((key, combo))
+            bus.subscribe(f"templates.fields.{key}", lambda topic, k=key, c=combo: refresh_template_combo(k, c))
+        except Exception:
+            pass
+    return combo
+
+def refresh_template_combo(key, combo):
+    vals = [tpl_name(it) for it in templates.get("fields", {}).get(key, [])]
+    combo.set_values(vals)
+    # clear selection if current value not in vals
+    try:
+        if combo.get() not in vals:
+            combo.set("")
+    except Exception:
+        pass
+
+def refresh_all_template_combos():
+    # Update values for all registered template combos based on templates dict
+    try:
+        for key, combo in template_combos:
+            refresh_template_combo(key, combo)
+    except Exception:
+        pass
+def make_button(parent, text, command=None, width=None, font=None):
+    w = BUTTON_WIDTH_DEFAULT if width is None else width
+    btn = ctk.CTkButton(parent, text=text, width=w, command=command)
+    try:
+        if font is not None:
+            btn.configure(font=font)
+        else:
+            btn.configure(font=BUTTON_FONT)
+    except Exception:
+        pass
+    return btn
+
+# -------------------------
+# GUI init
+# -------------------------
+root = ctk.CTk()
+
+# Global mouse-wheel handler: scroll the widget under cursor if it supports yview
+# Наладим именованные шрифты — это гарантирует, что ttk и стандартные виджеты
+# унаследуют единый шрифт/размер.
+import tkinter.font as tkfont
+try:
+    default = tkfont.nametofont("TkDefaultFont")
+    default.configure(family=UI_FONT_FAMILY, size=UI_FONT_SIZE)
+    # применим к основным именованным шрифтам (если они есть в текущей теме)
+    for name in ("TkTextFont", "TkHeadingFont", "TkMenuFont", "TkFixedFont"):
+        try:
+            tkfont.nametofont(name).configure(family=UI_FONT_FAMILY, size=UI_FONT_SIZE)
+        except Exception:
+            pass
+except Exception:
+    pass
+
+if platform.system() == 'Windows':
+    try:
+        ctypes.windll.shcore.SetProcessDpiAwareness(1)
+    except Exception:
+        pass
+try:
+    root.tk.call('tk', 'scaling', 1.25)
+except Exception:
+    pass
+root.title("DocGen v2")
+root.geometry("1180x780")
+
+# NOTE: статус-бар "Готово" удалён по требованию — автосохранение теперь тихое,
+# уведомление о сохранении показывается ТОЛЬКО при явном нажатии "Сохранить профиль".
+
+autosave_var = tk.BooleanVar(value=settings.get("autosave", True))
+_autosave_id = None
+
+# Параллельная генерация: документы набора рендерятся одновременно в пуле процессов
+parallel_var = tk.BooleanVar(value=settings.get("parallel_render", False))
+
+def _toggle_parallel_render():
+    settings["parallel_render"] = bool(parallel_var.get())
+    save_json(SETTINGS_FILE, settings)
+
+def schedule_autosave(delay=800):
+    if not autosave_var.get(): return
+    global _autosave_id
+    if _autosave_id: root.after_cancel(_autosave_id)
+    _autosave_id = root.after(delay, autosave_now)
+
+def autosave_now():
+    global _autosave_id
+    _autosave_id = None
+    # тихо сохраняем профиль без визуальной индикации
+    save_profile(False)
+
+# -------------------------
+# Mousewheel support helper
+# -------------------------
+def add_mousewheel_support(widget):
+    """Legacy placeholder: no global mousewheel handling. Left empty to keep compatibility."""
+    try:
+        return
+    except Exception:
+        pass
+    """
+    Adds mousewheel scrolling to the widget for multiple platforms.
+    Works for widgets exposing yview_scroll (Text, Listbox, ScrolledText, etc.).
+    """
+    def _on_mousewheel(event):
+        # determine delta in "units" for yview_scroll
+        if hasattr(event, "delta") and event.delta:
+            # Windows/Mac
+            # On Windows, delta usually is multiple of 120.
+            delta = -1 * int(event.delta / 120)
+        else:
+            # X11: Button-4 = up, Button-5 = down
+            if event.num == 4:
+                delta = -1
+            else:
+                delta = 1
+        try:
+            widget.yview_scroll(delta, "units")
+        except Exception:
+            try:
+                # some widgets expose .scroll
+                widget.scroll(delta, "units")
+            except Exception:
+                pass
+
+    # bind directly to widget (safer than bind_all)
+    try:
+        widget.bind("<MouseWheel>", _on_mousewheel)   # Windows / Mac
+        widget.bind("<Button-4>", _on_mousewheel)     # Linux scroll up
+        widget.bind("<Button-5>", _on_mousewheel)     # Linux scroll down
+    except Exception:
+        pass
+
+# -------------------------
+# GUI widgets container
+# -------------------------
+widgets = {}
+
+# Снимок значений всех полей формы: {ключ widgets: строка}; из него docgen_core строит контексты
+def read_form():
+    form = {}
+    for key, info in widgets.items():
+        w = info["widget"]
+        try:
+            if info["type"] == "text":
+                form[key] = "" if getattr(w, "_placeholder_active", False) else w.get("1.0", "end").strip()
+            else:
+                form[key] = w.get().strip()
+        except Exception:
+            form[key] = ""
+    return form
+
+tabview = ctk.CTkTabview(root)
+tabview.pack(fill='both', expand=True)
+# Try to center the tabbar (works if CTkTabview internal structure exposes it)
+try:
+    if hasattr(tabview, '_tabbar'):
+        try:
+            tabview._tabbar.pack_configure(anchor='center')
+        except Exception:
+            pass
+    if hasattr(tabview, '_segmented_button'):
+        try:
+            tabview._segmented_button.pack_configure(anchor='center')
+        except Exception:
+            pass
+except Exception:
+    pass
+# Remove unexpected top frames that may have appeared before the notebook
+def _remove_top_rects():
+    """Aggressively remove stray widgets placed above the notebook (visual artefacts).
+    Scans both root children and root children and destroys/forgets
+    widgets that are located above the notebook's Y coordinate or are tiny/empty.
+    """
+    try:
+        root.update_idletasks()
+    except Exception:
+        pass
+        try:
+            nb_y = nb.winfo_rooty()
+        except Exception:
+            nb_y = None
+
+        # helper to test and remove a widget if it's above the notebook or empty/small
+        def _maybe_remove(w):
+            try:
+                # ignore known important containers
+                if w in (frame_bot,) or getattr(w, "_preserve_widget", False):
+                    return False
+            except Exception:
+                pass
+            try:
+                cy = None
+                try:
+                    cy = w.winfo_rooty()
+                except Exception:
+                    cy = None
+                # if widget is placed above notebook -> remove
+                if nb_y is not None and cy is not None and cy < nb_y + 10:
+                    try:
+                        w.destroy()
+                        return True
+                    except Exception:
+                        try:
+                            w.pack_forget()
+                            return True
+                        except Exception:
+                            try:
+                                w.place_forget()
+                                return True
+                            except Exception:
+                                return False
+                # else, if very small and empty -> remove
+                try:
+                    ch_h = w.winfo_height()
+                    if ch_h is not None and ch_h < 30:
+                        kids = w.winfo_children()
+                        if not kids:
+                            try:
+                                w.destroy()
+                                return True
+                            except Exception:
+                                try:
+                                    w.pack_forget()
+                                    return True
+                                except Exception:
+                                    return False
+                        else:
+                            empty = True
+                            for k in kids:
+                                try:
+                                    if hasattr(k, 'cget') and 'text' in k.keys():
+                                        if k.cget('text').strip():
+                                            empty = False
+                                            break
+                                except Exception:
+                                    empty = False
+                                    break
+                            if empty:
+                                try:
+                                    w.destroy()
+                                    return True
+                                except Exception:
+                                    return False
+                except Exception:
+                    pass
+            except Exception:
+                pass
+            return False
+
+        # scan direct children of root
+        try:
+            for child in list(root.winfo_children()):
+                try:
+                    _maybe_remove(child)
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+        # scan children of root (they may be stacked above nb)
+        try:
+            pass
+        except Exception:
+            pass
+
+    except Exception:
+        pass
+
+
+def load_fio_templates_normalized():
+    """
+    Normalize templates['fields']['fio_combined'] into a list of dicts:
+    [{"name": <first line>, "content": <full content>}, ...]
+    Also migrates old string entries to dict form if found.
+    """
+    tpl_field = templates.setdefault("fields", {}).setdefault("fio_combined", [])
+    norm = []
+    changed = False
+    for item in tpl_field:
+        if isinstance(item, dict):
+            name = item.get("name","") or (item.get("content","").splitlines()[0] if item.get("content","") else "")
+            content = item.get("content","")
+            norm.append({"name": name, "content": content})
+        else:
+            content = str(item)
+            first = content.splitlines()[0] if content.splitlines() else content
+            norm.append({"name": first, "content": content})
+            changed = True
+    if changed:
+        templates["fields"]["fio_combined"] = norm
+        save_json(TEMPLATES_FILE, templates)
+    return norm
+
+fio_templates_norm = load_fio_templates_normalized()
+fio_combobox_var = tk.StringVar()
+tabview.add("Общее")
+tab_shared = tabview.tab("Общее")
+ctk.CTkLabel(tab_shared, text="Ответственный руководитель").pack(anchor="w", padx=6, pady=(8,2))
+tpl_frame = ctk.CTkFrame(tab_shared); tpl_frame.pack(fill="x", padx=6, pady=(2,4))
+fio_combobox = make_combo(tpl_frame, fio_combobox_var, [t["name"] for t in fio_templates_norm], width=58)
+fio_combobox.grid(row=0, column=0, padx=(0,6))
+fio_combobox.bind('<<ComboboxSelected>>', lambda e: fio_load_template())
+
+
+
+def refresh_fio_combobox_values():
+    """
+    Обновляет значения в выпадашке 'Ответственный руководитель'.
+    Использует публичный метод set_values(...) у кастомного TemplateCombo, если он доступен,
+    и корректно очищает текущее значение, если оно больше не присутствует в списке.
+    """
+    global fio_templates_norm
+    try:
+        fio_templates_norm = load_fio_templates_normalized()
+    except Exception:
+        # Если функция загрузки отсутствует или падает — оставим старый список пустым
+        fio_templates_norm = []
+
+    vals = [t.get("name", "") for t in fio_templates_norm]
+
+    # Сначала попробуем аккуратно установить значения через API виджета
+    try:
+        # Если это кастомный TemplateCombo с методом set_values
+        fio_combobox.set_values(vals)
+    except Exception:
+        # Фоллбек: если это обычный ttk.Combobox
+        try:
+            fio_combobox["values"] = vals
+        except Exception:
+            # Всё равно игнорируем — пусть останутся предыдущие значения
+            pass
+
+    # Проверяем текущее значение — если оно отсутствует, очищаем выбор
+    try:
+        cur = ""
+        # Попробуем получить через get()
+        try:
+            cur = fio_combobox.get().strip()
+        except Exception:
+            # Или через переменную, если используется StringVar
+            try:
+                cur = fio_combobox_var.get().strip()
+            except Exception:
+                cur = ""
+        if cur and cur not in vals:
+            try:
+                # Попытка очистить выбор через API виджета
+                fio_combobox.set("")
+            except Exception:
+                try:
+                    fio_combobox_var.set("")
+                except Exception:
+                    pass
+    except Exception:
+        # На всякий случай — сбросим переменную, если она есть
+        try:
+            fio_combobox_var.set("")
+        except Exception:
+            pass
+
+bus.subscribe("templates.fields.fio_combined", lambda topic: refresh_fio_combobox_values())
+
+def fio_load_template():
+    name = fio_combobox_var.get().strip()
+    if not name:
+        return
+    t = next((x for x in fio_templates_norm if x.get("name","") == name), None)
+    if not t:
+        t = next((x for x in fio_templates_norm if x.get("content","") == name), None)
+    if t:
+        fio_txt.delete("1.0","end")
+        fio_txt.insert("1.0", t.get("content",""))
+        schedule_autosave()
+
+def fio_add_template():
+    txt = fio_txt.get("1.0","end").rstrip()
+    if not txt:
+        return
+    first = txt.splitlines()[0] if txt.splitlines() else txt
+    templates.setdefault("fields",{}).setdefault("fio_combined", [])
+    lst = templates["fields"]["fio_combined"]
+    idx = next((i for i,item in enumerate(lst) if (isinstance(item, dict) and item.get("name","")==first) or (isinstance(item, str) and item.splitlines()[0]==first)), None)
+    if idx is not None:
+        if not messagebox.askyesno("Подтвердите", f'Шаблон с именем "{first}" существует. Перезаписать?'):
+            return
+        lst[idx] = {"name": first, "content": txt}
+    else:
+        lst.append({"name": first, "content": txt})
+    save_json(TEMPLATES_FILE, templates)
+    schedule_autosave()
+
+def fio_del_template():
+    name = fio_combobox_var.get().strip()
+    if not name:
+        messagebox.showwarning("Внимание", "Выберите шаблон для удаления")
+        return
+    lst = templates.setdefault("fields",{}).setdefault("fio_combined", [])
+    idx = next((i for i, item in enumerate(lst) if (isinstance(item, dict) and item.get("name","")==name) or (isinstance(item, str) and item.splitlines()[0]==name)), None)
+    if idx is None:
+        messagebox.showinfo("Внимание", "Шаблон не найден")
+        return
+    if not messagebox.askyesno("Подтвердите", f"Удалить шаблон '{name}'?"):
+        return
+    lst.pop(idx)
+    save_json(TEMPLATES_FILE, templates)
+
+def fio_clear():
+    fio_txt.delete("1.0","end"); schedule_autosave()
+
+make_button(tpl_frame, text="Добавить шаблон", command=fio_add_template).grid(row=0, column=2, padx=4)
+make_button(tpl_frame, text="Удалить шаблон", command=fio_del_template).grid(row=0, column=3, padx=4)
+make_button(tpl_frame, text="Очистить", command=fio_clear).grid(row=0, column=4, padx=6)
+
+
+
+# Ответственный руководитель — три однострочных поля (Именительный, Родительный, Дательный падеж)
+# Create entries with placeholders for the three grammatical cases
+fio_entries = []
+placeholders = ["Именительный падеж", "Родительный падеж", "Дательный падеж"]
+for i, ph in enumerate(placeholders):
+    ent = ctk.CTkEntry(tab_shared, width=300, font=DEFAULT_FONT, placeholder_text=ph)
+    ent.pack(fill="x", padx=6, pady=(0 if i>0 else 2, 4))
+    ent.bind("<KeyRelease>", lambda e: schedule_autosave())
+    fio_entries.append(ent)
+
+# Wrapper to emulate tk.Text API for existing code that uses fio_txt
+class FioWidget:
+    def __init__(self, entries):
+        self.entries = entries
+    def get(self, *args, **kwargs):
+        # simulate tk.Text.get("1.0","end") => join with newlines
+        lines = [e.get().strip() for e in self.entries]
+        return "\n".join(lines)
+    def delete(self, *args, **kwargs):
+        for e in self.entries:
+            try:
+                e.delete(0, "end")
+            except Exception:
+                try:
+                    e.delete(0, tk.END)
+                except Exception:
+                    pass
+    def insert(self, *args, **kwargs):
+        # handle insert(index, text) or insert(text)
+        if len(args) >= 2:
+            text = args[1]
+        elif len(args) == 1:
+            text = args[0]
+        else:
+            text = kwargs.get('text', '')
+        parts = str(text).splitlines()
+        for i in range(len(self.entries)):
+            try:
+                self.entries[i].delete(0, "end")
+            except Exception:
+                pass
+            if i < len(parts):
+                try:
+                    self.entries[i].insert(0, parts[i])
+                except Exception:
+                    pass
+
+# Prefill fio entries from defaults (fio, fio2, fio4)
+try:
+    # Use separate keys fio, fio2, fio4 if present
+    v0 = defaults.get('fio', '')
+    v1 = defaults.get('fio2', '')
+    v2 = defaults.get('fio4', '')
+    if v0 or v1 or v2:
+        try:
+            if isinstance(v0, str) and v0:
+                fio_entries[0].delete(0, 'end'); fio_entries[0].insert(0, v0)
+        except Exception:
+            pass
+        try:
+            if isinstance(v1, str) and v1:
+                fio_entries[1].delete(0, 'end'); fio_entries[1].insert(0, v1)
+        except Exception:
+            pass
+        try:
+            if isinstance(v2, str) and v2:
+                fio_entries[2].delete(0, 'end'); fio_entries[2].insert(0, v2)
+        except Exception:
+            pass
+except Exception:
+    pass
+
+fio_txt = FioWidget(fio_entries)
+widgets["fio_combined"] = {"type":"text", "widget": fio_txt}
+
+
+# helper: template-enabled single-line field
+
+def make_template_entry(parent, key, label):
+    '''
+    Factory: returns a TemplateCombo instance for single-line template-enabled fields.
+    Stores templates consistently as dicts: {"name": <first line>, "content": <full text>}
+    '''
+    ctk.CTkLabel(parent, text=label).pack(anchor="w", padx=6, pady=(6,0))
+    frame = ctk.CTkFrame(parent); frame.pack(fill="x", padx=6, pady=(0,2))
+    combo_var = tk.StringVar()
+    # Prepare name-only values from stored templates (supports dicts and legacy strings)
+    vals_raw = templates.get("fields", {}).get(key, [])
+    vals = [tpl_name(it) for it in vals_raw]
+    combo = make_combo(frame, textvariable=combo_var, values=vals, width=60, key=key)
+    combo.grid(row=0, column=0, padx=(0,4))
+    combo.bind('<<ComboboxSelected>>', lambda e: load())
+    def load(): 
+        entry.delete(0,"end"); 
+        # determine selection from combo or variable
+        try:
+            sel = combo.get().strip()
+        except Exception:
+            sel = combo_var.get().strip()
+        # find template by display name
+        try:
+            lst = templates.get("fields", {}).get(key, [])
+            t = next((it for it in lst if tpl_name(it) == sel), None)
+            content = tpl_content(t) if t is not None else sel
+        except Exception:
+            content = sel
+        entry.insert(0, content); schedule_autosave()
+
+    def add_template():
+        # save current widget content as a template (store as dict {name,content})
+        w = widgets.get(key, {}).get("widget")
+        if not w:
+            return
+        if widgets.get(key, {}).get("type") == "text":
+            try:
+                txt = w.get("1.0","end").strip()
+            except Exception:
+                txt = ""
+        else:
+            try:
+                txt = w.get().strip()
+            except Exception:
+                try:
+                    txt = w.get("1.0","end").strip()
+                except Exception:
+                    txt = ""
+        if not txt:
+            return
+        first = txt.splitlines()[0] if txt.splitlines() else txt
+        templates.setdefault("fields",{}).setdefault(key, [])
+        lst = templates["fields"][key]
+        # normalize legacy string entries to dicts
+        for i,item in enumerate(list(lst)):
+            if not isinstance(item, dict):
+                lst[i] = {"name": tpl_name(item), "content": tpl_content(item)}
+        # check for existing by name
+        idx = next((i for i,item in enumerate(lst) if (isinstance(item, dict) and item.get("name","")==first)), None)
+        if idx is not None:
+            if not messagebox.askyesno("Подтвердите", f'Шаблон с именем "{first}" существует. Перезаписать?'):
+                return
+            lst[idx] = {"name": first, "content": txt}
+        else:
+            lst.append({"name": first, "content": txt})
+        save_json(TEMPLATES_FILE, templates)
+        # update combo values
+        try:
+            vals = [tpl_name(it) for it in templates.get("fields", {}).get(key, [])]
+            combo.set_values(vals)
+        except Exception:
+            pass
+
+    def del_template():
+        v = ""
+        try:
+            v = combo.get().strip()
+        except Exception:
+            try:
+                v = combo_var.get().strip()
+            except Exception:
+                v = ""
+        if not v:
+            return
+        lst = templates.get("fields",{}).get(key,[])
+        # find by display name
+        idx = next((i for i,item in enumerate(lst) if tpl_name(item) == v), None)
+        if idx is None:
+            return
+        removed = lst.pop(idx)
+        save_json(TEMPLATES_FILE, templates)
+        try:
+            vals = [tpl_name(it) for it in templates.get("fields",{}).get(key,[])]
+            combo.set_values(vals)
+        except Exception:
+            pass
+        try:
+            combo_var.set("")
+        except Exception:
+            try:
+                combo.set("")
+            except Exception:
+                pass
+        try:
+            w = widgets.get(key, {}).get("widget")
+            if w:
+                try:
+                    cur_text = w.get("1.0", "end").strip() if widgets.get(key,{},).get("type")=="text" else w.get().strip()
+                except Exception:
+                    cur_text = ""
+                rem_content = tpl_content(removed)
+                if cur_text == rem_content:
+                    try:
+                        if widgets.get(key, {}).get("type") == "text":
+                            w.delete("1.0","end")
+                        else:
+                            w.delete(0,"end")
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+
+    def clear_entry():
+        entry.delete(0,"end"); schedule_autosave()
+    make_button(frame, text="Добавить шаблон", command=add_template).grid(row=0, column=2, padx=4)
+    make_button(frame, text="Удалить шаблон", command=del_template).grid(row=0, column=3, padx=4)
+    make_button(frame, text="Очистить", command=clear_entry).grid(row=0, column=4, padx=6)
+    entry = ctk.CTkEntry(parent, width=100); entry.insert(0, defaults.get(key,""))
+    entry.pack(fill="x", padx=6, pady=(0,6)); entry.bind("<KeyRelease>", lambda e: schedule_autosave())
+    widgets[key] = {"type":"entry","widget":entry}
+    #add_mousewheel_support(entry)  # harmless if no yview
+    return combo, combo_var, entry
+
+# fio1 and fio3 are template-enabled
+make_template_entry(tab_shared, "fio1", mapping["shared"]["fio1"]["label"])
+make_template_entry(tab_shared, "fio3", mapping["shared"]["fio3"]["label"])
+
+# other shared fields (dates and others)
+for k, meta in mapping["shared"].items():
+    if k in ("fio","fio2","fio4","fio1","fio3","aa","bb","dd","ee","numb"): continue
+    if k in ("a","b","d","e"):
+        ctk.CTkLabel(tab_shared, text=meta["label"]).pack(anchor="w", padx=6, pady=2)
+        ent = ctk.CTkEntry(tab_shared, width=100, font=DEFAULT_FONT, placeholder_text="дд.мм.гг")
+        _val = defaults.get(k,"")
+        if _val:
+            ent.insert(0, _val)
+        ent.pack(fill="x", padx=6, pady=2)
+        ent.bind("<KeyRelease>", lambda e: schedule_autosave())
+        widgets[k] = {"type":"entry","widget":ent}
+        #add_mousewheel_support(ent)
+
+    else:
+        ctk.CTkLabel(tab_shared, text=meta["label"]).pack(anchor="w", padx=6, pady=2)
+        ent = ctk.CTkEntry(tab_shared, width=80); ent.insert(0, defaults.get(k,"")); ent.pack(fill="x", padx=6, pady=2)
+        try:
+            ent.bind("<KeyRelease>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        try:
+            ent.bind("<FocusOut>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        widgets[k] = {"type":"entry","widget":ent}
+        #add_mousewheel_support(ent)
+
+# numb display
+ctk.CTkLabel(tab_shared, text=mapping["shared"]["numb"]["label"]).pack(anchor="w", padx=6, pady=2)
+ent_num = ctk.CTkEntry(tab_shared, width=160, font=DEFAULT_FONT)
+ent_num.insert(0, format_numb(*peek_numb(counters)))
+ent_num.configure(state="readonly")
+
+def refresh_numb_display():
+    # counters.json мог поменять другой экземпляр DocGen или пакетный режим — показываем то, что в файле
+    stores["counters"].reload()
+    try:
+        ent_num.configure(state="normal")
+        ent_num.delete(0, "end")
+        ent_num.insert(0, format_numb(*peek_numb(counters)))
+        ent_num.configure(state="readonly")
+    except Exception:
+        pass
+ent_num.pack(anchor="w", padx=6, pady=2)
+widgets["numb"] = {"type": "entry", "widget": ent_num}
+make_button(tab_shared, text="Редактировать", command=lambda: edit_numb_dialog(), width=18).pack(anchor="w", padx=6,
+                                                                                                 pady=(0, 6))
+# TAB: Наряд-допуск
+
+# Create a scrollable area for the "Наряд-допуск" tab so the user can scroll with mouse wheel.
+tabview.add("Наряд-допуск")
+tab_permit_outer = tabview.tab("Наряд-допуск")
+# Canvas and vertical scrollbar (replaced with CTkScrollableFrame for consistent CTk look)
+tab_permit_outer = tabview.tab("Наряд-допуск")
+tab_permit = ctk.CTkScrollableFrame(tab_permit_outer)
+tab_permit.pack(fill="both", expand=True, padx=6, pady=6)
+
+permit_text_keys_with_templates = {"work_scope","content","terms","materials","tools","devices"}
+
+
+
+
+def create_template_block(parent, key, label_text):
+    """
+    Creates a template-enabled block for the given key.
+    The combo shows only template names (first line). Selecting a template inserts
+    the full content into the target widget. Templates are stored as dicts:
+    {"name": <first line>, "content": <full text>}.
+    """
+    single_line_permit = {"content", "terms", "materials", "tools", "devices",'work_scope'}
+
+    ctk.CTkLabel(parent, text=label_text).pack(anchor="w", padx=6, pady=(8,2))
+    frame_tpl = ctk.CTkFrame(parent); frame_tpl.pack(anchor="w", padx=6, pady=(0,2))
+
+    combo_var = tk.StringVar()
+    # prepare name-only values
+    vals_raw = templates.get("fields", {}).get(key, [])
+    vals = [ (it.get("name") if isinstance(it, dict) else (str(it).splitlines()[0] if str(it).splitlines() else str(it))) for it in vals_raw ]
+    combo = make_combo(frame_tpl, combo_var, values=vals, width=58, key=key)
+    combo.grid(row=0, column=0, padx=(0,4))
+    combo.bind('<<ComboboxSelected>>', lambda e: load_to_target())
+
+    def load_to_target():
+        v = ""
+        try:
+            v = combo.get().strip()
+        except Exception:
+            try:
+                v = combo_var.get().strip()
+            except Exception:
+                v = ""
+        if v and widgets.get(key):
+            w = widgets[key]["widget"]
+            # find template by name
+            try:
+                lst = templates.get("fields", {}).get(key, [])
+                t = next((it for it in lst if (isinstance(it, dict) and it.get("name","")==v) or (not isinstance(it, dict) and (str(it).splitlines()[0] if str(it).splitlines() else str(it))==v)), None)
+                content = t.get("content","") if isinstance(t, dict) else (str(t) if t is not None else "")
+                if t is None:
+                    content = v
+            except Exception:
+                content = v
+            try:
+                if widgets[key].get("type") == "text":
+                    try:
+                        w.delete("1.0","end"); w.insert("1.0", content)
+                    except Exception:
+                        pass
+                else:
+                    try:
+                        w.delete(0,"end"); w.insert(0, content)
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+        schedule_autosave()
+
+    def add_template():
+        # save current widget content as a template (name = first line)
+        w = widgets.get(key, {}).get("widget")
+        if not w:
+            return
+        if widgets.get(key, {}).get("type") == "text":
+            try:
+                txt = w.get("1.0","end").strip()
+            except Exception:
+                txt = ""
+        else:
+            try:
+                txt = w.get().strip()
+            except Exception:
+                try:
+                    txt = w.get("1.0","end").strip()
+                except Exception:
+                    txt = ""
+        if not txt:
+            return
+        first = txt.splitlines()[0] if txt.splitlines() else txt
+        templates.setdefault("fields",{}).setdefault(key, [])
+        lst = templates["fields"][key]
+        # check for existing by name
+        idx = next((i for i,item in enumerate(lst) if (isinstance(item, dict) and item.get("name","")==first) or (not isinstance(item, dict) and (str(item).splitlines()[0] if str(item).splitlines() else str(item))==first)), None)
+        if idx is not None:
+            if not messagebox.askyesno("Подтвердите", f'Шаблон с именем "{first}" существует. Перезаписать?'):
+                return
+            lst[idx] = {"name": first, "content": txt}
+        else:
+            lst.append({"name": first, "content": txt})
+        save_json(TEMPLATES_FILE, templates)
+        # update combo values
+        try:
+            vals = [it.get("name") if isinstance(it, dict) else (str(it).splitlines()[0] if str(it).splitlines() else str(it)) for it in templates.get("fields",{}).get(key,[])]
+            combo.set_values(vals)
+        except Exception:
+            pass
+
+    def del_template():
+        v = ""
+        try:
+            v = combo.get().strip()
+        except Exception:
+            try:
+                v = combo_var.get().strip()
+            except Exception:
+                v = ""
+        if not v:
+            return
+        lst = templates.get("fields",{}).get(key,[])
+        idx = next((i for i,item in enumerate(lst) if (isinstance(item, dict) and item.get("name","")==v) or (not isinstance(item, dict) and (str(item).splitlines()[0] if str(item).splitlines() else str(item))==v)), None)
+        if idx is None:
+            return
+        removed = lst.pop(idx)
+        save_json(TEMPLATES_FILE, templates)
+        try:
+            vals = [it.get("name") if isinstance(it, dict) else (str(it).splitlines()[0] if str(it).splitlines() else str(it)) for it in templates.get("fields",{}).get(key,[])]
+            combo.set_values(vals)
+        except Exception:
+            pass
+        try:
+            combo_var.set("")
+        except Exception:
+            try:
+                combo.set("")
+            except Exception:
+                pass
+        try:
+            w = widgets.get(key, {}).get("widget")
+            if w:
+                try:
+                    cur_text = w.get("1.0", "end").strip() if widgets.get(key,{}).get("type")=="text" else w.get().strip()
+                except Exception:
+                    cur_text = ""
+                rem_content = removed.get("content") if isinstance(removed, dict) else str(removed)
+                if cur_text == rem_content:
+                    try:
+                        if widgets.get(key, {}).get("type") == "text":
+                            w.delete("1.0","end")
+                        else:
+                            w.delete(0,"end")
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+
+    make_button(frame_tpl, text="Добавить шаблон", command=add_template).grid(row=0, column=2, padx=4)
+    make_button(frame_tpl, text="Удалить шаблон", command=del_template).grid(row=0, column=3, padx=4)
+    
+    def clear_target():
+        """
+        Clear the target widget associated with this template block (key).
+        Works for both text widgets and single-line entries.
+        """
+        try:
+            w = widgets.get(key, {}).get("widget")
+            if not w:
+                return
+            if widgets.get(key, {}).get("type") == "text":
+                try:
+                    w.delete("1.0", "end")
+                except Exception:
+                    pass
+            else:
+                try:
+                    w.delete(0, "end")
+                except Exception:
+                    try:
+                        w.delete("1.0", "end")
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+        try:
+            schedule_autosave()
+        except Exception:
+            pass
+    make_button(frame_tpl, text="Очистить", command=clear_target).grid(row=0, column=4, padx=6)
+
+    # Choose widget type based on whether the field is single-line or multi-line
+    if key in single_line_permit:
+        txt = ctk.CTkEntry(parent, width=100, font=DEFAULT_FONT)
+        txt.insert(0, defaults.get(key,""))
+        txt.pack(fill="x", padx=6, pady=2)
+        try:
+            txt.bind("<KeyRelease>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        try:
+            txt.bind("<FocusOut>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        widgets[key] = {"type":"entry","widget":txt}
+    else:
+        txt = tk.Text(parent, height=4, font=DEFAULT_FONT)
+        txt.insert("1.0", defaults.get(key,""))
+        txt.pack(fill="x", padx=6, pady=2)
+        txt.bind("<<Modified>>", lambda e:(e.widget.edit_modified(False), schedule_autosave()))
+        widgets[key] = {"type":"text","widget":txt}
+
+
+# Ensure "На выполнение работ" (work_scope) is at the top of the permit tab
+try:
+    if "work_scope" in mapping.get("permit", {}):
+        create_template_block(tab_permit, "work_scope", mapping["permit"]["work_scope"].get("label", "На выполнение работ"))
+    else:
+        create_template_block(tab_permit, "work_scope", "На выполнение работ")
+except Exception:
+    try:
+        create_template_block(tab_permit, "work_scope", "На выполнение работ")
+    except Exception:
+        pass
+for k, meta in mapping["permit"].items():
+    if k.startswith("w"):
+        continue
+    # Пропускаем однострочную графу "hazards" — используем только специализированный многострочный блок ниже
+    if k == "hazards":
+        continue
+    if k in permit_text_keys_with_templates:
+        create_template_block(tab_permit, k, meta["label"])
+    else:
+        ctk.CTkLabel(tab_permit, text=meta["label"]).pack(anchor="w", padx=6, pady=(8,2))
+        ent = ctk.CTkEntry(tab_permit, width=80); ent.insert(0, defaults.get(k,"")); ent.pack(fill="x", padx=6, pady=2)
+        try:
+            ent.bind("<KeyRelease>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        try:
+            ent.bind("<FocusOut>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        widgets[k] = {"type":"entry","widget":ent}
+        #add_mousewheel_support(ent)
+
+# Hazards block: Опасные и вредные факторы — 4 строки с плейсхолдерами и поддержкой шаблонов
+ctk.CTkLabel(tab_permit, text="Опасные и вредные факторы").pack(anchor="w", padx=6, pady=(12,2))
+frame_tpl = ctk.CTkFrame(tab_permit); frame_tpl.pack(anchor="w", padx=6, pady=(0,2))
+
+hazards_combo_var = tk.StringVar()
+
+def _get_hazard_templates():
+    try:
+        return templates.get("fields", {}).get("hazards", [])
+    except Exception:
+        return []
+
+def _hazards_template_names():
+    lst = _get_hazard_templates()
+    names = []
+    for it in lst:
+        if isinstance(it, dict):
+            name = (it.get("name") or "").strip()
+            if not name:
+                content = it.get("content","")
+                name = content.splitlines()[0] if content else ""
+        else:
+            s = str(it) if it is not None else ""
+            name = s.splitlines()[0] if s.splitlines() else s
+        names.append(name)
+    return names
+
+hazards_combo = make_combo(frame_tpl, hazards_combo_var, values=_hazards_template_names(), width=58, key="hazards")
+hazards_combo.grid(row=0, column=0, padx=(0,4))
+hazards_combo.bind('<<ComboboxSelected>>', lambda e: hazards_load())
+
+# Wrapper to adapt 4 single-line entries to the existing Text-like API used by templates logic
+class HazardWidget:
+    def __init__(self, entries):
+        self.entries = entries  # list of CTkEntry
+    def get(self, *args, **kwargs):
+        # emulate Text.get("1.0","end") => join lines with newline
+        lines = [e.get().strip() for e in self.entries]
+        return "\n".join(lines)
+    def delete(self, *args, **kwargs):
+        for e in self.entries:
+            try:
+                e.delete(0, "end")
+            except Exception:
+                try:
+                    e.delete(0, tk.END)
+                except Exception:
+                    pass
+    def insert(self, *args, **kwargs):
+        # insert(index, text) or insert(text)
+        if len(args) >= 2:
+            text = args[1]
+        elif len(args) == 1:
+            text = args[0]
+        else:
+            text = kwargs.get('text', '')
+        parts = str(text).splitlines()
+        for i in range(len(self.entries)):
+            try:
+                self.entries[i].delete(0, "end")
+            except Exception:
+                pass
+            if i < len(parts):
+                try:
+                    self.entries[i].insert(0, parts[i])
+                except Exception:
+                    pass
+
+# Create 4 single-line entries with placeholders "Фактор 1".."Фактор 4" (без отдельных надписей)
+hazard_entries = []
+for i in range(4):
+    ent = ctk.CTkEntry(tab_permit, width=200, font=DEFAULT_FONT, placeholder_text=f"Фактор {i+1}")
+    ent.pack(fill="x", padx=6, pady=(8 if i==0 else 2,4))
+    ent.bind("<KeyRelease>", lambda e: schedule_autosave())
+    hazard_entries.append(ent)
+
+hazards_widget = HazardWidget(hazard_entries)
+widgets["hazards"] = {"type":"text", "widget": hazards_widget}
+# Prefill hazards entries from defaults
+try:
+    hv = defaults.get('hazards', '')
+    if hv:
+        try:
+            hazards_widget.insert(hv)
+        except Exception:
+            # fallback: populate entries manually
+            parts = str(hv).splitlines()
+            for i, ent in enumerate(getattr(hazards_widget, 'entries', [])[:4]):
+                try:
+                    ent.delete(0, 'end')
+                    if i < len(parts):
+                        ent.insert(0, parts[i])
+                except Exception:
+                    pass
+except Exception:
+    pass
+
+
+def hazards_load(event=None):
+    # Load selected hazards template (full content) into the 4 hazard entries.
+    v = hazards_combo_var.get().strip()
+    if not v:
+        return
+    # find template object by matching first-line (name) or by content
+    lst = templates.get('fields', {}).get('hazards', [])
+    chosen_content = None
+    for it in lst:
+        try:
+            if isinstance(it, dict):
+                name = (it.get('name') or '').strip()
+                content = it.get('content','')
+                if not name and content:
+                    name = content.splitlines()[0] if content.splitlines() else ''
+                if name == v:
+                    chosen_content = content; break
+                # also allow matching entire content stored as name-less dict
+                if content.strip() == v:
+                    chosen_content = content; break
+            else:
+                s = str(it) if it is not None else ''
+                nm = s.splitlines()[0] if s.splitlines() else s
+                if nm == v:
+                    chosen_content = s; break
+        except Exception:
+            continue
+    # fallback: if not found, assume combo contains the actual content (v)
+    if chosen_content is None:
+        chosen_content = v
+    # Split into up to 4 lines
+    parts = [line.rstrip() for line in str(chosen_content).splitlines()]
+    # Normalize to 4 elements
+    while len(parts) < 4:
+        parts.append('')
+    # Now put values into the widget stored in widgets['hazards']
+    wmeta = widgets.get('hazards', {})
+    w = wmeta.get('widget')
+    if not w:
+        return
+    try:
+        # If it's the HazardWidget wrapper (supports delete/insert like Text)
+        # try to call delete/insert as Text-like
+        try:
+            w.delete('1.0', 'end')
+        except Exception:
+            try:
+                w.delete(0, 'end')
+            except Exception:
+                pass
+        try:
+            # insert full content joined by newlines
+            w.insert('1.0', '\n'.join(parts))
+        except Exception:
+            try:
+                w.insert('\n'.join(parts))
+            except Exception:
+                # if it's a list of CTkEntry widgets
+                if isinstance(w, list):
+                    for i, ent in enumerate(w[:4]):
+                        try:
+                            ent.delete(0, 'end')
+                        except Exception:
+                            pass
+                        try:
+                            ent.insert(0, parts[i])
+                        except Exception:
+                            pass
+                else:
+                    # last resort: if w has attribute 'entries' (HazardWidget), populate them
+                    try:
+                        entries = getattr(w, 'entries', None)
+                        if entries:
+                            for i, ent in enumerate(entries[:4]):
+                                try: ent.delete(0, 'end')
+                                except Exception: pass
+                                try: ent.insert(0, parts[i])
+                                except Exception: pass
+                    except Exception:
+                        pass
+    except Exception:
+        # unexpected - try populate as list fallback
+        try:
+            if isinstance(w, list):
+                for i, ent in enumerate(w[:4]):
+                    try: ent.delete(0, 'end')
+                    except Exception: pass
+                    try: ent.insert(0, parts[i])
+                    except Exception: pass
+        except Exception:
+            pass
+    schedule_autosave()
+def hazards_add():
+    # save current hazards entries as a template: name = first non-empty line, content = joined 4 lines
+    entries = widgets.get("hazards", {}).get("widget")
+    if not entries:
+        return
+    try:
+        # entries is HazardWidget in original code: use its get()
+        txt = entries.get("1.0","end").strip()
+    except Exception:
+        try:
+            txt = entries.get().strip()
+        except Exception:
+            # fallback: join list of entry widgets
+            lst = []
+            for e in entries:
+                try:
+                    lst.append(e.get().strip())
+                except Exception:
+                    lst.append("")
+            txt = "\n".join(lst).strip()
+    if not txt:
+        messagebox.showwarning("Внимание","Нечего сохранять в шаблон.")
+        return
+    name = txt.splitlines()[0] if txt.splitlines() else txt
+    templates.setdefault("fields",{}).setdefault("hazards",[])
+    lst = templates["fields"]["hazards"]
+    # avoid duplicate by exact content
+    exists = False
+    for it in lst:
+        if isinstance(it, dict):
+            if it.get("content","") == txt:
+                exists = True; break
+        else:
+            if str(it) == txt:
+                exists = True; break
+    if not exists:
+        lst.append({"name": name, "content": txt})
+        save_json(TEMPLATES_FILE, templates)
+    # refresh combo
+    try:
+        hazards_combo.set_values(_hazards_template_names())
+    except Exception:
+        refresh_all_template_combos()
+    try:
+        hazards_combo_var.set("")
+    except Exception:
+        pass
+    schedule_autosave()
+
+def hazards_del():
+    v = hazards_combo_var.get().strip()
+    if not v:
+        messagebox.showwarning("Внимание","Выберите шаблон для удаления")
+        return
+    lst = templates.get("fields", {}).get("hazards", [])
+    newlst = []
+    removed = False
+    for it in lst:
+        if isinstance(it, dict):
+            nm = (it.get("name") or "").strip() or (it.get("content","").splitlines()[0] if it.get("content","") else "")
+            if nm == v:
+                removed = True
+                continue
+        else:
+            s = str(it) if it is not None else ""
+            nm = s.splitlines()[0] if s.splitlines() else s
+            if nm == v:
+                removed = True
+                continue
+        newlst.append(it)
+    if removed:
+        templates.setdefault("fields",{})["hazards"] = newlst
+        save_json(TEMPLATES_FILE, templates)
+        try:
+            hazards_combo.set_values(_hazards_template_names())
+            hazards_combo_var.set("")
+        except Exception:
+            refresh_all_template_combos()
+    else:
+        messagebox.showinfo("Внимание","Шаблон не найден или уже удалён.")
+    schedule_autosave()
+def hazards_clear():
+    try:
+        w = widgets.get("hazards", {}).get("widget")
+        if w:
+            try:
+                w.delete("1.0", "end")
+            except Exception:
+                try:
+                    w.delete(0, "end")
+                except Exception:
+                    pass
+    except Exception:
+        pass
+    schedule_autosave()
+
+make_button(frame_tpl, text="Добавить шаблон", command=hazards_add).grid(row=0, column=2, padx=4)
+make_button(frame_tpl, text="Удалить шаблон", command=hazards_del).grid(row=0, column=3, padx=4)
+make_button(frame_tpl, text="Очистить", command=hazards_clear).grid(row=0, column=4, padx=6)
+
+
+
+# Hazards block (многострочный) — оставляем полностью с логикой шаблонов
+
+
+def refresh_permit_workers_display():
+    # UI-отображение работников во вкладке "Наряд-допуск" удалено — функция оставлена безопасной заглушкой
+    return
+# TAB: Список
+tabview.add("Список")
+tab_spisok = tabview.tab("Список")
+
+for k, meta in mapping["spisok"].items():
+    # убираем поля position и place из UI (по запросу)
+    if k in ("birth","pass","position","place"):
+        continue
+    ctk.CTkLabel(tab_spisok, text=meta["label"]).pack(anchor="w", padx=6, pady=2)
+    if k == "workers":
+        try:
+            txt = ctk.CTkTextbox(tab_spisok, height=15, font=DEFAULT_FONT)
+            txt.insert("1.0", defaults.get("spisok_workers",""))
+            txt.pack(fill="both", padx=6, pady=2)
+        except Exception:
+            txt = scrolledtext.ScrolledText(tab_spisok, height=15, font=DEFAULT_FONT)
+            txt.insert("1.0", defaults.get("spisok_workers",""))
+            try:
+                if ctk.get_appearance_mode().lower() == "dark":
+                    try:
+                        tmp = ctk.CTkFrame(tab_spisok)
+                        bg = tmp.cget("fg_color"); tmp.destroy()
+                    except Exception:
+                        bg = "#2b2b2b"
+                    fg = "#e6e6e6"
+                    try:
+                        txt.configure(bg=bg, fg=fg, insertbackground=fg, selectbackground="#4b4b4b")
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+            txt.pack(fill="both", padx=6, pady=2)
+        def on_spisok_modified(e):
+            try:
+                e.widget.edit_modified(False)
+            except Exception:
+                pass
+            schedule_autosave(); refresh_permit_workers_display()
+        try:
+            txt.bind("<<Modified>>", on_spisok_modified)
+        except Exception:
+            try:
+                txt.bind("<KeyRelease>", lambda e: on_spisok_modified(e))
+            except Exception:
+                pass
+        widgets["spisok_workers"] = {"type":"text","widget":txt}
+        #add_mousewheel_support(txt)
+
+        ctrl_frame = ctk.CTkFrame(tab_spisok); ctrl_frame.pack(anchor="w", padx=6, pady=4)
+        def open_worker_selector_multi():
+            sel = make_ctk_toplevel(root, "Выбрать работника(ов)", "720x520")
+            try:
+                # try to set Toplevel background to CTk frame background for consistent dark theme
+                bg = None
+                try:
+                    tmp = ctk.CTkFrame(sel)
+                    bg = tmp.cget("fg_color")
+                    tmp.destroy()
+                except Exception:
+                    bg = None
+                if bg:
+                    try:
+                        sel.configure(bg=bg)
+                    except Exception:
+                        pass
+            except Exception:
+                pass
+            sel_frame_top = ctk.CTkFrame(sel); sel_frame_top.pack(fill="x", padx=8, pady=6)
+            ctk.CTkLabel(sel_frame_top, text="Поиск / фильтр:").pack(side="left", padx=(0,6))
+            search_var = tk.StringVar()
+            search_entry = ctk.CTkEntry(sel_frame_top, textvariable=search_var, width=40)
+            search_entry.pack(side="left", padx=(0,6))
+
+            # Use CTkScrollableFrame with CheckBoxes for multi-select
+            sel_container = ctk.CTkScrollableFrame(sel)
+            sel_container.pack(fill="both", expand=True, padx=6, pady=6)
+            sel_row_vars = []
+            sel_row_frames = []
+            sel_row_names = []
+
+            def repopulate(filter_text=""):
+                # clear existing rows
+                for fr in list(sel_row_frames):
+                    try: fr.destroy()
+                    except Exception: pass
+                sel_row_frames.clear(); sel_row_vars.clear(); sel_row_names.clear()
+                f = (filter_text or "").strip().lower()
+                for w in workers_db:
+                    fio = w.get("fio","")
+                    if not f or f in fio.lower():
+                        row = ctk.CTkFrame(sel_container)
+                        row.pack(fill="x", padx=4, pady=2)
+                        var = tk.BooleanVar(value=False)
+                        chk = ctk.CTkCheckBox(row, text=fio, variable=var)
+                        chk.pack(fill="x", side="left", expand=True, padx=(6,2), pady=6)
+                        # clicking row selects it (visual highlight)
+                        def _make_onclick(idx):
+                            return lambda e=None: None
+                        try:
+                            row.bind("<Button-1>", _make_onclick(len(sel_row_frames)))
+                            chk.bind("<Button-1>", _make_onclick(len(sel_row_frames)))
+                        except Exception:
+                            pass
+                        sel_row_frames.append(row)
+                        sel_row_vars.append(var)
+                        sel_row_names.append(fio)
+
+            def on_search_change(*_):
+                repopulate(search_var.get())
+            search_var.trace_add("write", on_search_change)
+            repopulate()
+
+
+
+
+
+            def do_add_selected():
+                picks = [name for i,name in enumerate(sel_row_names) if sel_row_vars[i].get()]
+                if not picks:
+                    messagebox.showwarning("Внимание","Выберите хотя бы одного работника")
+                    return
+                s = widgets["spisok_workers"]["widget"]
+                existing = [ln.strip() for ln in s.get("1.0","end").splitlines() if ln.strip()]
+                to_add = []
+                for name in picks:
+                    if name not in existing and name not in to_add:
+                        to_add.append(name)
+                if to_add:
+                    if existing:
+                        s.insert("end", "\n" + "\n".join(to_add))
+                    else:
+                        s.insert("1.0", "\n".join(to_add))
+                    schedule_autosave()
+                    refresh_permit_workers_display()
+                sel.destroy()
+
+            def do_add_all():
+                all_names = sel_row_names[:]
+                if not all_names:
+                    messagebox.showwarning("Внимание","Список работников пуст")
+                    return
+                s = widgets["spisok_workers"]["widget"]
+                existing = [ln.strip() for ln in s.get("1.0","end").splitlines() if ln.strip()]
+                to_add = []
+                for name in all_names:
+                    if name not in existing and name not in to_add:
+                        to_add.append(name)
+                if not to_add:
+                    messagebox.showinfo("Внимание", "Нечего добавлять — все работники уже в списке.")
+                    return
+                if existing:
+                    s.insert("end", "\n" + "\n".join(to_add))
+                else:
+                    s.insert("1.0", "\n".join(to_add))
+                schedule_autosave()
+                refresh_permit_workers_display()
+                sel.destroy()
+
+            # Buttons
+            btns = ctk.CTkFrame(sel)
+            btns.pack(side="bottom", fill="x", padx=8, pady=(6,8))
+            make_button(btns, text="Добавить выбранных", command=lambda: _do_add_selected_inner(sel, sel_row_names, sel_row_vars), width=18).pack(side="left", padx=8)
+            make_button(btns, text="Добавить всех", command=lambda: _do_add_all_inner(sel, sel_row_names), width=18).pack(side="left", padx=8)
+            make_button(btns, text="Отмена", command=sel.destroy, width=18).pack(side="right", padx=8)
+
+
+
+
+            def do_add_all():
+                all_names = [w.get('fio','') for w in workers_db]
+                if not all_names:
+                    messagebox.showwarning("Внимание","Список работников пуст")
+                    return
+                s = widgets["spisok_workers"]["widget"]
+                existing = [ln.strip() for ln in s.get("1.0","end").splitlines() if ln.strip()]
+                to_add = []
+                for name in all_names:
+                    if name not in existing and name not in to_add:
+                        to_add.append(name)
+                if not to_add:
+                    messagebox.showinfo("Внимание", "Нечего добавлять — все работники уже в списке.")
+                    return
+                if existing:
+                    s.insert("end", "\n" + "\n".join(to_add))
+                else:
+                    s.insert("1.0", "\n".join(to_add))
+                schedule_autosave()
+                refresh_permit_workers_display()
+                sel.destroy()
+
+            """
+            Диалог сборки бригады: multi-select работников + ввод названия бригады.
+            Кнопка 'Сохранить бригаду' сохраняет шаблон бригады и вставляет её в spisok.
+            """
+
+        make_button(ctrl_frame, text="Добавить работника", command=open_worker_selector_multi, width=BUTTON_WIDTH_LARGE, font=BUTTON_FONT_LARGE).pack(side="left", padx=6)
+        make_button(ctrl_frame, text="Очистить список работников", command=lambda:(widgets["spisok_workers"]["widget"].delete("1.0","end"), schedule_autosave(), refresh_permit_workers_display()), width=BUTTON_WIDTH_LARGE, font=BUTTON_FONT_LARGE).pack(side="left", padx=6)
+    else:
+        ent = ctk.CTkEntry(tab_spisok, width=80)
+        ent.insert(0, defaults.get(k,""))
+        ent.pack(fill="x", padx=6, pady=2)
+        try:
+
+            ent.bind("<KeyRelease>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        try:
+            ent.bind("<FocusOut>", lambda e: schedule_autosave())
+        except Exception:
+            pass
+        widgets[k] = {"type":"entry","widget":ent}
+        #add_mousewheel_support(ent)
+
+
+
+
+# --- Автосохранение: рекурсивно привязываем события сохранения ко всем полям во вкладке "Наряд-допуск" ---
+def bind_autosave_for_permit_children():
+    try:
+        def _safe_bind_text(w):
+            try:
+                # для tk.Text и ScrolledText используем <<Modified>>
+                w.bind("<<Modified>>", lambda e, ww=w: (ww.edit_modified(False), schedule_autosave()))
+            except Exception:
+                try:
+                    w.bind("<KeyRelease>", lambda e, ww=w: schedule_autosave())
+                except Exception:
+                    pass
+        def _safe_bind_entry(w):
+            try:
+                w.bind("<KeyRelease>", lambda e, ww=w: schedule_autosave())
+            except Exception:
+                try:
+                    w.bind("<<Modified>>", lambda e, ww=w: schedule_autosave())
+                except Exception:
+                    pass
+        def recurse(widget):
+            try:
+                children = widget.winfo_children()
+            except Exception:
+                return
+            for ch in children:
+                try:
+                    # текстовые виджеты TK / ScrolledText
+                    if isinstance(ch, tk.Text) or (hasattr(scrolledtext, 'ScrolledText') and isinstance(ch, scrolledtext.ScrolledText)):
+                        _safe_bind_text(ch)
+                    else:
+                        # CTkEntry / CTkTextbox / tk.Entry
+                        name = ch.__class__.__name__
+                        if name in ("CTkEntry", "CTkTextbox") or isinstance(ch, tk.Entry):
+                            _safe_bind_entry(ch)
+                    # рекурсивно пройти глубже
+                    recurse(ch)
+                except Exception:
+                    pass
+        # Запускаем привязку от корня таба permit (если он существует)
+        try:
+            if 'tab_permit' in globals() and tab_permit is not None:
+                recurse(tab_permit)
+        except Exception:
+            pass
+    except Exception:
+        pass
+
+# Вызовим привязку (гарантируем, что все поля во вкладке теперь будут автосохраняться)
+try:
+    bind_autosave_for_permit_children()
+except Exception:
+    pass
+
+# --- Конец вставки автосохранения ---
+
+# TAB: Работники
+
+tabview.add("Работники")
+tab_workers = tabview.tab("Работники")
+class VirtualWorkerList:
+    """
+    Виртуализированный список работников: создаются только строки, помещающиеся
+    в окне, и при прокрутке те же CTkCheckBox показывают другие карточки.
+    Отметки живут в модели (self.checked — id карточек), активная строка —
+    self.active (сама карточка), поэтому перерисовка не зависит от размера workers_db.
+    """
+    ROW_HEIGHT = 38
+    WHEEL_ROWS = 3
+
+    def __init__(self, parent, items):
+        self.items = items          # список карточек (workers_db), читается при каждой отрисовке
+        self.top = 0                # индекс первой видимой карточки
+        self.checked = set()
+        self.active = None
+        self.rows = []              # [(frame, checkbox, BooleanVar)] — пул переиспользуемых строк
+        self.frame = ctk.CTkFrame(parent)
+        self.body = ctk.CTkFrame(self.frame)
+        self.body.pack(side="left", fill="both", expand=True)
+        self.scrollbar = ctk.CTkScrollbar(self.frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.body.bind("<Configure>", lambda e: self.render())
+        self._bind_wheel(self.body)
+
+    def pack(self, **kw):
+        self.frame.pack(**kw)
+
+    def _visible_count(self):
+        return max(1, self.body.winfo_height() // self.ROW_HEIGHT)
+
+    def _bind_wheel(self, w):
+        try:
+            w.bind("<MouseWheel>", self._on_wheel)   # Windows / Mac
+            w.bind("<Button-4>", self._on_wheel)     # Linux scroll up
+            w.bind("<Button-5>", self._on_wheel)     # Linux scroll down
+        except Exception:
+            pass
+
+    def _make_row(self, r):
+        frame = ctk.CTkFrame(self.body, height=self.ROW_HEIGHT - 2)
+        var = tk.BooleanVar(value=False)
+        chk = ctk.CTkCheckBox(frame, text="", variable=var, command=lambda: self._on_toggle(r))
+        chk.pack(fill="x", side="left", expand=True, padx=(6,2), pady=6)
+        for w in (frame, chk):
+            try:
+                w.bind("<Button-1>", lambda e=None: self._on_click(r), add="+")
+            except Exception:
+                pass
+            self._bind_wheel(w)
+        return frame, chk, var
+
+    def render(self):
+        items = self.items
+        visible = self._visible_count()
+        self.top = max(0, min(self.top, len(items) - visible))
+        while len(self.rows) < visible:
+            self.rows.append(self._make_row(len(self.rows)))
+        for r, (frame, chk, var) in enumerate(self.rows):
+            i = self.top + r
+            if r < visible and i < len(items):
+                card = items[i]
+                chk.configure(text=card.get("fio", ""))
+                var.set(id(card) in self.checked)
+                frame.place(x=0, y=r * self.ROW_HEIGHT, relwidth=1.0)
+            else:
+                frame.place_forget()
+        if items:
+            self.scrollbar.set(self.top / len(items), min(1.0, (self.top + visible) / len(items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_to(self, top):
+        self.top = int(top)
+        self.render()
+
+    def _on_scrollbar(self, *args):
+        if not args:
+            return
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * len(self.items))
+        elif args[0] == "scroll":
+            step = self._visible_count() if len(args) > 2 and args[2] == "pages" else 1
+            self.scroll_to(self.top + int(args[1]) * step)
+
+    def _on_wheel(self, event):
+        if getattr(event, "num", None) == 4:
+            delta = -1
+        elif getattr(event, "num", None) == 5:
+            delta = 1
+        else:
+            delta = -1 if getattr(event, "delta", 0) > 0 else 1
+        self.scroll_to(self.top + delta * self.WHEEL_ROWS)
+
+    def _card_at(self, r):
+        i = self.top + r
+        return self.items[i] if 0 <= i < len(self.items) else None
+
+    def _on_click(self, r):
+        card = self._card_at(r)
+        if card is not None:
+            self.active = card
+
+    def _on_toggle(self, r):
+        card = self._card_at(r)
+        if card is None:
+            return
+        if self.rows[r][2].get():
+            self.checked.add(id(card))
+        else:
+            self.checked.discard(id(card))
+
+    def forget(self, card):
+        """Карточка удалена или заменена — снять с неё отметку и активность."""
+        self.checked.discard(id(card))
+        if self.active is card:
+            self.active = None
+
+    def selected_indices(self):
+        # отмеченные чекбоксами; если таких нет — активная строка
+        sel = [i for i, card in enumerate(self.items) if id(card) in self.checked] if self.checked else []
+        if sel:
+            return sel
+        if self.active is not None:
+            for i, card in enumerate(self.items):
+                if card is self.active:
+                    return [i]
+        return []
+
+workers_list = VirtualWorkerList(tab_workers, workers_db)
+workers_list.pack(fill="both", expand=True, padx=6, pady=6)
+
+def get_selected_worker_indices():
+    return workers_list.selected_indices()
+
+def refresh_workers_listbox():
+    # перерисовываются только видимые строки — стоимость не зависит от числа работников
+    workers_list.render()
+
+# initial fill
+refresh_workers_listbox()
+
+def save_workers_db():
+    workers_store.save(store_writer); refresh_workers_listbox()
+def open_worker_card(existing=None, index=None):
+    # Create centered modal window scaled to screen size so fields/buttons are visible
+    # Compute initial geometry to avoid brief flicker at default position. We'll refine height after layout.
+    sw = root.winfo_screenwidth()
+    sh = root.winfo_screenheight()
+    w = min(1000, int(sw * 0.6))
+    init_h = 480
+    x = (sw - w) // 2
+    y = max(0, (sh - init_h) // 2)
+    win = make_ctk_toplevel(root, "Карточка работника", geometry=f"{w}x{init_h}+{x}+{y}")
+
+    # fields: labels and entries made 2-2.5x larger (bigger width and larger font)
+    fields = [
+        ("fio", "ФИО (полностью)"),
+        ("position", "Должность"),
+        ("birth", "Дата рождения (дд.мм.гггг)"),
+        ("pass", "Серия и номер"),
+        ("place", "Кем выдан"),
+        ("notes", "Примечание")
+    ]
+    entries = {}
+    # choose larger font sizes
+    label_font = ("TkDefaultFont", 14)
+    entry_font = ("TkDefaultFont", 14)
+    # make entries 25% larger than before (previously 200)
+    entry_width = 250
+
+    # Use a frame with some padding and vertical layout so controls scale nicely
+    content = ctk.CTkFrame(win)
+    content.pack(fill="both", expand=True, padx=12, pady=12)
+    for key, label in fields:
+        ctk.CTkLabel(content, text=label, font=label_font).pack(anchor="w", padx=6, pady=(8,2))
+        ent = ctk.CTkEntry(content, width=entry_width, font=entry_font)
+        ent.pack(anchor="w", padx=6, pady=(0,6))
+        entries[key] = ent
+
+    if existing:
+        for k in entries:
+            entries[k].delete(0, "end")
+            entries[k].insert(0, existing.get(k, ""))
+
+    def do_save():
+        obj = {k: entries[k].get().strip() for k in entries}
+        if not obj["fio"]:
+            messagebox.showwarning("Внимание", "ФИО обязательно")
+            return
+        if existing is not None and index is not None:
+            workers_list.forget(workers_db[index])
+            workers_store.replace(index, obj)
+        else:
+            workers_store.add(obj)
+        save_workers_db()
+        refresh_permit_workers_display()
+        win.grab_release()
+        win.destroy()
+
+    # Button frame pinned to bottom so it remains visible
+    btn_frame = ctk.CTkFrame(win)
+    btn_frame.pack(fill="x", side="bottom", pady=10, padx=10)
+    make_button(btn_frame, text="Сохранить", command=do_save, width=20).pack(side="left", padx=8, pady=6)
+    make_button(btn_frame, text="Отмена", command=lambda: (win.grab_release(), win.destroy()), width=14).pack(side="left", padx=8, pady=6)
+
+    # Now that content is packed, compute required height and set geometry so buttons are visible without manual resize
+    win.update_idletasks()
+    req_h = win.winfo_reqheight()
+    # ensure height does not exceed 90% of screen height and is at least 480
+    h = max(480, min(int(sh * 0.9), req_h))
+    y = max(0, (sh - h) // 2)
+    win.geometry(f"{w}x{h}+{x}+{y}")
+    win.minsize(520, 420)
+    win.transient(root)
+    win.grab_set()
+
+def new_worker(): open_worker_card()
+def edit_worker():
+    try: idx = (lambda s=get_selected_worker_indices(): s[0] if s else None)()
+    except Exception: messagebox.showwarning("Внимание","Выберите работника для редактирования"); return
+    open_worker_card(existing=workers_db[idx], index=idx)
+def delete_worker():
+    try: idx = (lambda s=get_selected_worker_indices(): s[0] if s else None)()
+    except Exception: messagebox.showwarning("Внимание","Выберите работника для удаления"); return
+    if messagebox.askyesno("Подтвердите","Удалить выбранного работника?"):
+        workers_list.forget(workers_store.remove(idx)); save_workers_db(); refresh_permit_workers_display()
+
+def add_selected_to_spisok():
+    idxs = get_selected_worker_indices()
+    if not idxs:
+        messagebox.showwarning("Внимание","Выберите работника(ов)")
+        return
+    picks = [workers_db[i].get("fio","") for i in idxs]
+    s = widgets.get("spisok_workers",{}).get("widget")
+    if s:
+        existing = [ln.strip() for ln in s.get("1.0","end").splitlines() if ln.strip()]
+        to_add = []
+        for name in picks:
+            if name not in existing and name not in to_add:
+                to_add.append(name)
+        if to_add:
+            if existing:
+                s.insert("end", "\n" + "\n".join(to_add))
+            else:
+                s.insert("1.0", "\n".join(to_add))
+            schedule_autosave(); refresh_permit_workers_display()
+        else:
+            messagebox.showinfo("Внимание","Выбранные работники уже присутствуют в списке")
+    else:
+        messagebox.showinfo("Внимание","Поле 'Список' не найдено")
+
+wb_frame = ctk.CTkFrame(tab_workers); wb_frame.pack(anchor="w", padx=6, pady=(4,120))
+make_button(wb_frame, text="Новый", command=new_worker, width=18).pack(side="left", padx=6)
+make_button(wb_frame, text="Редактировать", command=edit_worker, width=18).pack(side="left", padx=6)
+make_button(wb_frame, text="Удалить", command=delete_worker, width=18).pack(side="left", padx=6)
+make_button(wb_frame, text="Добавить в Список", command=add_selected_to_spisok, width=BUTTON_WIDTH_LARGE).pack(side="left", padx=6)
+
+# Save profile / build context / generation
+def save_profile(show_msg=True):
+    new = profile_from_form(read_form())
+    defaults.clear(); defaults.update(new)
+    # на диск уходят только изменившиеся хранилища — автосохранение по каждому
+    # нажатию клавиши обычно не пишет ничего, кроме defaults.json
+    save_json(DEFAULTS_FILE, defaults)
+    workers_store.save(store_writer)
+    save_json(TEMPLATES_FILE, templates)
+    save_brigades_db()
+    if show_msg:
+        store_writer.flush()
+        messagebox.showinfo("OK","Профиль сохранён")
+
+def edit_numb_dialog():
+    d = make_ctk_toplevel(root, "Редактировать номер")
+    # title set by helper документа")
+    d.transient(root)
+    d.grab_set()
+    # center and size so buttons are visible immediately
+    d.update_idletasks()
+    sw = root.winfo_screenwidth(); sh = root.winfo_screenheight()
+    w = 600; h = 340
+    x = (sw - w)//2; y = (sh - h)//2
+    d.geometry(f"{w}x{h}+{x}+{y}")
+    d.minsize(520, 320)
+    d.resizable(False, False)
+
+    # content frame holds the labels/entries and expands
+    content = ctk.CTkFrame(d)
+    content.pack(fill="both", expand=True, padx=12, pady=(12,6))
+
+    ctk.CTkLabel(content, text="Введите номер (число):").pack(anchor="w", padx=6, pady=(4,2))
+    num_ent = ctk.CTkEntry(content, width=260, font=DEFAULT_FONT)
+    num_ent.insert(0, str(peek_numb(counters)[0]))
+    num_ent.pack(anchor="w", padx=6, pady=(0,8), fill="x")
+
+    ctk.CTkLabel(content, text="Введите буквенное обозначение (опционально):").pack(anchor="w", padx=6, pady=(6,2))
+    suff_ent = ctk.CTkEntry(content, width=120, font=DEFAULT_FONT)
+    suff_ent.insert(0, str(counters.get("numb_suffix", "")))
+    suff_ent.pack(anchor="w", padx=6, pady=(0,8), fill="x")
+
+    # Put buttons in bottom bar so they are always visible; styled as a frame (grey bar)
+    btnf = ctk.CTkFrame(d)
+    btnf.pack(fill="x", side="bottom", padx=0, pady=0)
+    inner = ctk.CTkFrame(btnf)
+    inner.pack(fill="x", padx=12, pady=12)
+    # Left-aligned Save/Cancel with generous padding so buttons are fully visible
+    make_button(inner, text="Сохранить", command=lambda: do_save_numb(num_ent, suff_ent, d), width=14).pack(side="left", padx=12, pady=8)
+    make_button(inner, text="Отмена", command=lambda: (d.grab_release(), d.destroy()), width=14).pack(side="left", padx=12, pady=8)
+
+    # Ensure focus is on the number entry
+    try:
+        num_ent.focus_set()
+    except Exception:
+        pass
+
+
+def do_save_numb(num_ent, suff_ent, dlg):
+    try:
+        v = int(num_ent.get().strip())
+    except Exception:
+        messagebox.showwarning("Ошибка", "Номер должен быть целым числом")
+        return
+    suff = suff_ent.get().strip()
+    set_numb(v, suff)
+    refresh_numb_display()
+    try:
+        dlg.grab_release()
+        dlg.destroy()
+    except Exception:
+        pass
+
+# Генерация идёт в фоновом потоке: форма остаётся доступной для редактирования,
+# а контексты снимаются с формы заранее, в главном потоке.
+_generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="docgen-render")
+_generation = None  # текущий GenerationProgress, пока идёт генерация
+
+class GenerationProgress:
+    """
+    Окно хода генерации: статус каждого документа, общий прогресс и кнопка «Отмена».
+    Фоновый поток только кладёт события в очередь; окно забирает их через root.after,
+    так что Tk трогается исключительно из главного потока. Задания (контексты и
+    манифесты шаблонов — при первом запуске это разбор .docx) тоже собираются в фоне.
+    """
+    POLL_MS = 100
+
+    def __init__(self, snapshot, block, output_dir):
+        self.snapshot = snapshot    # неизменяемый снимок формы
+        self.block = block          # NumberBlock с номером этой генерации
+        self.output_dir = output_dir
+        self.total = 0
+        self.cancel = threading.Event()
+        self.events = queue.Queue()
+        self.finished_count = 0
+
+        self.win = make_ctk_toplevel(root, "Генерация документов")
+        self.win.protocol("WM_DELETE_WINDOW", self.request_cancel)
+        self.body = ctk.CTkFrame(self.win)
+        self.body.pack(fill="both", expand=True, padx=12, pady=(12,6))
+        self.status_labels = []
+        self.rows = ctk.CTkFrame(self.body); self.rows.pack(fill="x")
+        self.preparing = ctk.CTkLabel(self.rows, text="подготовка шаблонов...", font=DEFAULT_FONT)
+        self.preparing.pack(padx=6, pady=2)
+        self.bar = ctk.CTkProgressBar(self.body)
+        self.bar.set(0)
+        self.bar.pack(fill="x", padx=6, pady=(10,4))
+        btnf = ctk.CTkFrame(self.win); btnf.pack(fill="x", side="bottom")
+        self.btn_cancel = make_button(btnf, text="Отмена", command=self.request_cancel, width=14)
+        self.btn_cancel.pack(side="right", padx=12, pady=8)
+
+    def start(self, parallel):
+        _generation_executor.submit(self._run, parallel)
+        root.after(self.POLL_MS, self._poll)
+
+    def request_cancel(self):
+        self.cancel.set()
+        try:
+            self.btn_cancel.configure(state="disabled", text="Отмена...")
+        except Exception:
+            pass
+
+    # --- фоновый поток ---
+    def _run(self, parallel):
+        try:
+            jobs = build_document_jobs(self.snapshot, self.block.format(self.block.start), self.output_dir)
+            if not jobs:
+                self.events.put(("finished", None, [], None))
+                return
+            self.events.put(("jobs", [Path(out).name for path, ctx, out in jobs]))
+            outs, errors = render_documents(jobs, parallel=parallel, cancel=self.cancel,
+                                            on_done=lambda i, res: self.events.put(("doc", i, res)))
+            log_path = write_error_log(errors) if errors else None
+        except Exception as e:
+            outs, errors = [], [("", str(e), traceback.format_exc())]
+            log_path = None
+        self.events.put(("finished", outs, errors, log_path))
+
+    # --- главный поток ---
+    def _poll(self):
+        try:
+            while True:
+                ev = self.events.get_nowait()
+                if ev[0] == "jobs":
+                    self._show_jobs(ev[1])
+                elif ev[0] == "doc":
+                    self._doc_done(ev[1], ev[2])
+                else:
+                    self._finish(*ev[1:])
+                    return
+        except queue.Empty:
+            pass
+        root.after(self.POLL_MS, self._poll)
+
+    def _show_jobs(self, names):
+        self.total = len(names)
+        try:
+            self.preparing.destroy()
+            for name in names:
+                row = ctk.CTkFrame(self.rows); row.pack(fill="x", padx=6, pady=2)
+                ctk.CTkLabel(row, text=name, font=DEFAULT_FONT).pack(side="left", padx=(6,12))
+                lbl = ctk.CTkLabel(row, text="в очереди", font=DEFAULT_FONT)
+                lbl.pack(side="right", padx=6)
+                self.status_labels.append(lbl)
+        except Exception:
+            pass
+
+    def _doc_done(self, i, res):
+        self.finished_count += 1
+        try:
+            self.status_labels[i].configure(text="готово" if res is None else "ошибка")
+            self.bar.set(self.finished_count / max(1, self.total))
+        except Exception:
+            pass
+
+    def _finish(self, outs, errors, log_path):
+        global _generation
+        _generation = None
+        try:
+            self.win.destroy()
+        except Exception:
+            pass
+
+        # Ни одного файла не создано — номер возвращаем (если за это время его никто не обошёл).
+        if not outs:
+            try:
+                self.block.release(self.block.numbers())
+            except Exception:
+                pass
+        refresh_numb_display()
+
+        if outs is None:
+            messagebox.showwarning("Генерация", "Не найдено ни одного шаблона")
+            return
+        if self.cancel.is_set():
+            messagebox.showinfo("Отменено", "Генерация отменена." + (("\nСозданы: " + ", ".join(outs)) if outs else ""))
+        elif outs:
+            messagebox.showinfo("OK", "Созданы: " + ", ".join(outs))
+
+        if errors:
+            short_msgs = []
+            for p, msg, tb in errors:
+                short_msgs.append(f"{Path(p).name}: {msg}")
+            errmsg = "Некоторые шаблоны не сгенерированы:\n" + "\n".join(short_msgs)
+            if log_path:
+                errmsg += f"\nПодробный лог: {log_path}"
+            messagebox.showerror("Ошибки генерации", errmsg)
+
+def generate_docx_all():
+    global _generation
+    if _generation is not None:
+        # предыдущая генерация ещё идёт — показываем её окно
+        try:
+            _generation.win.deiconify(); _generation.win.lift()
+        except Exception:
+            pass
+        return
+    save_profile(False)
+
+    # номер выдаётся из counters.json под блокировкой файла, так что два экземпляра DocGen
+    # в общей папке не получат один и тот же; если ничего не создастся, он будет возвращён.
+    # Всем генерируемым файлам даём один и тот же номер, например «наряд-допуск (1606-А).docx»
+    # один неизменяемый снимок формы на весь набор — его безопасно отдавать фоновому потоку и пулу
+    snapshot = form_snapshot(read_form(), workers_index, defaults)
+    block = reserve_numbers(1)
+    refresh_numb_display()
+
+    # снимок снят — дальше форму можно править; задания по шаблонам (манифесты,
+    # при первом запуске — разбор .docx) собираются уже в фоновом потоке
+    _generation = GenerationProgress(snapshot, block, get_output_dir())
+    _generation.start(parallel_var.get())
+
+# --- Output folder selection utilities ---
+def get_output_dir():
+    od = settings.get("output_dir")
+    if not od:
+        od = str(APPDIR)
+        settings["output_dir"] = od
+        save_json(SETTINGS_FILE, settings)
+    return Path(od)
+
+def choose_output_folder():
+    current = get_output_dir()
+    sel = filedialog.askdirectory(initialdir=str(current), title="Выберите папку для сохранения документов")
+    if sel:
+        settings["output_dir"] = sel
+        save_json(SETTINGS_FILE, settings)
+        update_output_dir_label()
+
+# -------------------------
+# Открытие исходных шаблонов (новая функциональность)
+# -------------------------
+def _open_path_with_default_app(pth: Path):
+    """Открыть файл в системном приложении (Windows/Mac/Linux)."""
+    try:
+        # Windows
+        if hasattr(os, "startfile"):
+            os.startfile(str(pth))
+            return
+    except Exception:
+        pass
+    try:
+        # macOS
+        import subprocess, sys as _sys
+        import platform
+        if _sys.platform == "darwin":
+            subprocess.call(["open", str(pth)])
+            return
+        # Linux (xdg-open)
+        subprocess.call(["xdg-open", str(pth)])
+    except Exception as e:
+        try:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\\n{pth}\\n\\n{e}")
+        except Exception:
+            print(f"Failed to open {pth}: {e}")
+
+def open_template_by_key(key):
+    """Открывает соответствующий шаблон .docx:
+      'наряд-допуск' -> TEMPLATE_PERMIT
+      'список'       -> TEMPLATE_SPISOK
+      'приказ'       -> TEMPLATE_ORDER
+      'приказ-пб'    -> TEMPLATE_PB_ORDER
+    """
+    mapping = {
+        "наряд-допуск": TEMPLATE_PERMIT,
+        "список": TEMPLATE_SPISOK,
+        "приказ": TEMPLATE_ORDER,
+        "приказ-пб": TEMPLATE_PB_ORDER
+    }
+    path = mapping.get(key)
+    if not path:
+        try:
+            messagebox.showerror("Ошибка", f"Неизвестный тип: {key}")
+            return
+        except Exception:
+            print(f"Unknown key: {key}")
+    if not path.exists():
+        try:
+            messagebox.showwarning("Файл не найден", f"Шаблон не найден:\\n{path}\\n\\nУбедитесь, что файл существует в каталоге приложения.")
+            return
+        except Exception:
+            print(f"Template not found: {path}")
+    try:
+        _open_path_with_default_app(path)
+    except Exception as e:
+        try:
+            messagebox.showerror("Ошибка", f"Не удалось открыть {path}:\\n{e}")
+        except Exception:
+            print(f"Failed to open {path}: {e}")
+
+def open_source_selector():
+    """Диалог выбора исходника — список из 4 элементов, каждый открывает свой .docx."""
+    dlg = make_ctk_toplevel(root, "Изменить исходник")
+    # title set by helper
+    dlg.geometry("420x260")
+    dlg.transient(root)
+    ctk.CTkLabel(dlg, text="Выберите исходник и нажмите «Открыть»:").pack(anchor="w", padx=10, pady=(10,6))
+    lb = tk.Listbox(dlg, font=DEFAULT_FONT, height=6, exportselection=False)
+    options = ["наряд-допуск", "список", "приказ", "приказ-пб"]
+    for opt in options:
+        lb.insert("end", opt)
+    lb.pack(fill="both", expand=True, padx=10, pady=(0,8))
+
+    def do_open(_evt=None):
+        try:
+            sel = lb.curselection()
+            if not sel:
+                messagebox.showwarning("Внимание", "Выберите пункт списка")
+                return
+            key = lb.get(sel[0])
+            open_template_by_key(key)
+        except Exception as e:
+            messagebox.showerror("Ошибка", str(e))
+
+    # двойной клик = открыть
+    lb.bind("<Double-1>", do_open)
+
+    btns = ctk.CTkFrame(dlg)
+    btns.pack(fill="x", padx=10, pady=(0,10))
+    make_button(btns, text="Открыть", command=do_open, width=20).pack(side="left", padx=(0,6))
+    make_button(btns, text="Отмена", command=dlg.destroy, width=20).pack(side="right")
+
+
+
+def update_output_dir_label():
+    lbl_text = str(get_output_dir())
+    p = Path(lbl_text)
+    parts = p.parts
+    if len(parts) > 4:
+        short = os.path.join("...", *parts[-3:])
+    else:
+        short = lbl_text
+    try:
+        output_dir_label.configure(text=short)
+    except Exception:
+        pass
+    try:
+        output_dir_label_overlay.configure(text=short)
+    except Exception:
+        pass
+
+
+# bottom controls (кнопки подогнаны шириной, чтобы текст помещался)
+frame_bot = ctk.CTkFrame(root); frame_bot.pack(side='bottom', fill="x", padx=0, pady=6)
+
+# Ensure bottom control frame is above other widgets
+try:
+    frame_bot.lift()
+except Exception:
+    pass
+
+# Theme switch placed in bottom controls (right side)
+def _toggle_theme_btn():
+    """Toggle appearance mode between Light and Dark and persist in settings.json"""
+    try:
+        current = ctk.get_appearance_mode()
+        new = 'Dark' if current.lower() != 'dark' else 'Light'
+        ctk.set_appearance_mode(new)
+        settings['appearance_mode'] = new
+        save_json(SETTINGS_FILE, settings)
+    except Exception:
+        pass
+try:
+    theme_var = tk.BooleanVar(value=(ctk.get_appearance_mode().lower()=='dark'))
+    theme_switch = ctk.CTkSwitch(frame_bot, text='Тёмная тема', command=_toggle_theme_btn, variable=theme_var)
+    theme_switch.pack(side='right', padx=6)
+except Exception:
+    pass
+
+# Make sure bottom frame stays on top after geometry changes
+def _keep_bottom_on_top(event=None):
+    try:
+        frame_bot.lift()
+    except Exception:
+        pass
+
+root.bind('<Configure>', _keep_bottom_on_top)
+
+# folder choose button + label
+folder_frame = ctk.CTkFrame(frame_bot); folder_frame.pack(side="left", padx=(0,8))
+make_button(folder_frame, text="📁", command=choose_output_folder, width=4).pack(side="left")
+output_dir_label = ctk.CTkLabel(folder_frame, text=""); output_dir_label.pack(side="left", padx=(6,0))
+update_output_dir_label()
+
+ctk.CTkCheckBox(frame_bot, text="Автосохранение", variable=autosave_var).pack(side="left")
+ctk.CTkCheckBox(frame_bot, text="Параллельно", variable=parallel_var, command=_toggle_parallel_render).pack(side="left", padx=(6,0))
+
+# <-- новая кнопка для открытия исходников
+make_button(frame_bot, text="Изменить исходник", command=open_source_selector, width=24).pack(side="left", padx=6)
+
+make_button(frame_bot, text="Сгенерировать Все", command=generate_docx_all, width=24).pack(side="left", padx=6)
+make_button(frame_bot, text="Сохранить профиль", command=lambda: save_profile(True), width=20).pack(side="left", padx=6)
+make_button(frame_bot, text="Выйти", command=lambda:(autosave_now(), root.destroy())).pack(side="right")
+
+
+# folder choose button + label
+
+def clear_all_sel():
+    for info in widgets.values():
+        w = info["widget"]
+        try:
+            if isinstance(w, (tk.Text, scrolledtext.ScrolledText)): w.tag_remove("sel","1.0","end")
+            else: w.select_clear()
+        except Exception:
+            pass
+clear_all_sel()
+
+# -------------------------
+# Автосохранение: привязать ко всем полям дополнительно,
+# на случай если где-то привязки не были сделаны ранее.
+# -------------------------
+for info in widgets.values():
+    w = info["widget"]
+    try:
+        if isinstance(w, (tk.Text, scrolledtext.ScrolledText)):
+            # use default argument to capture current widget
+            w.bind("<<Modified>>", lambda e, widget=w: (widget.edit_modified(False), schedule_autosave()))
+        else:
+            w.bind("<KeyRelease>", lambda e: schedule_autosave())
+    except Exception:
+        pass
+
+# initial refreshes
+refresh_workers_listbox()
+refresh_permit_workers_display()
+
+root.protocol("WM_DELETE_WINDOW", lambda:(autosave_now(), root.destroy()))
+root.after(1000, autosave_now)
+
+# Final ensure bottom controls are on top
+try:
+    frame_bot.lift()
+except Exception:
+    pass
+
+
+# Overlay bottom controls: ensure visibility above notebook and fixed at bottom
+try:
+    overlay_bot = ctk.CTkFrame(root, corner_radius=6)
+    overlay_bot.place(relx=0.0, rely=1.0, relwidth=1.0, anchor='sw')
+    overlay_bot.lift()
+
+    # Folder choose + label
+    of_frame = ctk.CTkFrame(overlay_bot, corner_radius=6); of_frame.pack(side='left', padx=(6,8), pady=6)
+    make_button(of_frame, text="📁", command=choose_output_folder, width=4).pack(side="left")
+    try:
+        output_dir_label_overlay = ctk.CTkLabel(of_frame, text=output_dir_label.cget('text'))
+    except Exception:
+        output_dir_label_overlay = ctk.CTkLabel(of_frame, text="")
+    output_dir_label_overlay.pack(side='left', padx=(6,0))
+
+    # Autosave checkbox
+    try:
+        autosave_chk_overlay = ctk.CTkCheckBox(overlay_bot, text="Автосохранение", variable=autosave_var)
+        autosave_chk_overlay.pack(side='left', padx=6)
+    except Exception:
+        pass
+    try:
+        parallel_chk_overlay = ctk.CTkCheckBox(overlay_bot, text="Параллельно", variable=parallel_var, command=_toggle_parallel_render)
+        parallel_chk_overlay.pack(side='left', padx=6)
+    except Exception:
+        pass
+
+    # Other action buttons
+    make_button(overlay_bot, text="Изменить исходник", command=open_source_selector, width=20).pack(side="left", padx=6)
+    make_button(overlay_bot, text="Сгенерировать Все", command=generate_docx_all, width=20).pack(side="left", padx=6)
+    make_button(overlay_bot, text="Сохранить профиль", command=lambda: save_profile(True), width=16).pack(side="left", padx=6)
+    make_button(overlay_bot, text="Выйти", command=lambda:(autosave_now(), root.destroy()), width=10).pack(side="right", padx=6)    # Theme switch on overlay right
+    try:
+        try:
+            theme_var  # noqa: F821
+        except NameError:
+            theme_var = tk.BooleanVar(value=(ctk.get_appearance_mode().lower()=='dark'))
+        theme_switch_overlay = ctk.CTkSwitch(overlay_bot, text='Тёмная тема', command=_toggle_theme_btn, variable=theme_var)
+        theme_switch_overlay.pack(side='right', padx=6)
+    except Exception:
+        pass
+    # Keep overlay on top
+    def _keep_overlay_on_top(e=None):
+        try:
+            overlay_bot.lift()
+        except Exception:
+            pass
+    root.bind('<Configure>', _keep_overlay_on_top)
+except Exception:
+    pass
+
+
+
+# Schedule removal of stray top widgets after UI is built
+try:
+    root.after(150, _remove_top_rects)
+except Exception:
+    pass
+
+root.mainloop()
+store_writer.flush()
\ No newline at end of file
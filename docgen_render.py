@@ -0,0 +1,853 @@
+"""
+Движок рендеринга DocGen: docxtpl/python-docx/Jinja2 и кэш скомпилированных шаблонов.
+
+Импортируется лениво из docgen_core при первой генерации, чтобы загрузка
+ядра (и запуск GUI) не платили за импорт docxtpl/lxml.
+"""
+import io
+import os
+import re
+import zlib
+import struct
+import zipfile
+import hashlib
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from pathlib import Path
+from datetime import datetime
+
+from docxtpl import DocxTemplate
+from docx import Document
+from jinja2 import Environment, meta
+from lxml import etree
+
+from docgen_core import APPDIR, SETTINGS_FILE, load_json, write_json_atomic
+
+# -------------------------
+# Запись .docx без пересжатия неизменённых частей
+# -------------------------
+DEFAULT_COMPRESSLEVEL = 6
+
+def docx_compresslevel():
+    """
+    Уровень deflate для перезаписанных частей готовых документов: 0 — без
+    сжатия (быстрее, файл крупнее) .. 9. Берётся из переменной окружения
+    DOCGEN_COMPRESSLEVEL (её ставит docgen_cli --compresslevel, процессы пула
+    её наследуют), затем из settings.json ("docx_compresslevel"), иначе 6.
+    """
+    value = os.environ.get("DOCGEN_COMPRESSLEVEL")
+    if value is None:
+        value = (load_json(SETTINGS_FILE, {}) or {}).get("docx_compresslevel", DEFAULT_COMPRESSLEVEL)
+    try:
+        return min(9, max(0, int(value)))
+    except (TypeError, ValueError):
+        return DEFAULT_COMPRESSLEVEL
+
+DOCX_COMPRESSLEVEL = docx_compresslevel()
+
+_ZIP_LOCAL = struct.Struct("<IHHHHHIIIHH")
+_ZIP_CENTRAL = struct.Struct("<IHHHHHHIIIHHHHHII")
+_ZIP_END = struct.Struct("<IHHHHIIH")
+
+class _ZipCopyWriter:
+    """Минимальный писатель zip: сжатые данные исходных записей переносятся байт в байт."""
+    def __init__(self, fp, compresslevel):
+        self.fp = fp
+        self.compresslevel = compresslevel
+        self.offset = 0
+        self.entries = []
+
+    def _add(self, info, method, flags, crc, payload, size):
+        name = info.filename.encode("utf-8")
+        if not info.filename.isascii():
+            flags |= 0x800
+        y, mo, d, h, mi, sec = info.date_time
+        dostime, dosdate = (h << 11) | (mi << 5) | (sec // 2), ((y - 1980) << 9) | (mo << 5) | d
+        head = _ZIP_LOCAL.pack(0x04034b50, 20, flags, method, dostime, dosdate, crc, len(payload), size, len(name), 0)
+        self.fp.write(head)
+        self.fp.write(name)
+        self.fp.write(payload)
+        self.entries.append((name, flags, method, dostime, dosdate, crc, len(payload), size, info.external_attr, self.offset))
+        self.offset += len(head) + len(name) + len(payload)
+
+    def copy(self, src, info):
+        """Перенести запись из src (байты исходного архива) без распаковки."""
+        start = info.header_offset
+        name_len, extra_len = struct.unpack_from("<HH", src, start + 26)
+        start += 30 + name_len + extra_len
+        # бит 3 (размеры в data descriptor) не нужен: размеры пишутся в заголовок
+        flags = info.flag_bits & ~0x0808
+        self._add(info, info.compress_type, flags, info.CRC, src[start:start + info.compress_size], info.file_size)
+
+    def write(self, info, data):
+        if self.compresslevel == 0:
+            method, payload = zipfile.ZIP_STORED, data
+        else:
+            packer = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+            method, payload = zipfile.ZIP_DEFLATED, packer.compress(data) + packer.flush()
+        self._add(info, method, 0, zlib.crc32(data), payload, len(data))
+
+    def close(self):
+        cd_offset, cd_size = self.offset, 0
+        for name, flags, method, dostime, dosdate, crc, csize, size, attr, offset in self.entries:
+            rec = _ZIP_CENTRAL.pack(0x02014b50, 20, 20, flags, method, dostime, dosdate, crc, csize, size,
+                                    len(name), 0, 0, 0, 0, attr, offset)
+            self.fp.write(rec)
+            self.fp.write(name)
+            cd_size += len(rec) + len(name)
+        n = len(self.entries)
+        self.fp.write(_ZIP_END.pack(0x06054b50, 0, 0, n, n, cd_size, cd_offset, 0))
+
+def write_docx(src: bytes, out, replaced: dict, compresslevel=None):
+    """
+    Записать копию архива src в out (путь или файловый объект): части из
+    replaced (имя -> байты) сжимаются заново, остальные копируются как есть,
+    без inflate/deflate. Имена из replaced, которых нет в src, дописываются в конец.
+    """
+    level = DOCX_COMPRESSLEVEL if compresslevel is None else compresslevel
+    view = memoryview(src)
+    fp = out if hasattr(out, "write") else open(out, "wb")
+    try:
+        writer = _ZipCopyWriter(fp, level)
+        with zipfile.ZipFile(io.BytesIO(src)) as zin:
+            infos = zin.infolist()
+        for info in infos:
+            data = replaced.get(info.filename)
+            if data is None:
+                writer.copy(view, info)
+            else:
+                writer.write(info, data)
+        known = {info.filename for info in infos}
+        for name, data in replaced.items():
+            if name not in known:
+                writer.write(zipfile.ZipInfo(name, datetime.now().timetuple()[:6]), data)
+        writer.close()
+    finally:
+        if fp is not out:
+            fp.close()
+
+# -------------------------
+# Экранирование одиночных фигурных скобок
+# -------------------------
+_brace_re = re.compile(rb"[{}]")
+_tag_re = re.compile(rb"<[^>]*>")
+
+def _only_markup(segment: bytes) -> bool:
+    # между скобками только разметка внутри одного абзаца — Word просто разбил текст на runs
+    return b"</w:p>" not in segment and not _tag_re.sub(b"", segment)
+
+def escape_single_braces(data: bytes) -> bytes:
+    """
+    Удвоить одиночные { и } в тексте части word/*.xml ({key} -> {{key}}) за
+    один проход по байтам. Скобки, разнесённые Word по соседним runs
+    (<w:t>{</w:t>...<w:t>{key}}</w:t>), считаются одной группой {{; скобки
+    внутри тегов и атрибутов (GUID в settings.xml, theme) не трогаются.
+    Если менять нечего, возвращается тот же объект data.
+    """
+    if b"{" not in data and b"}" not in data:
+        return data
+    braces = []
+    for m in _brace_re.finditer(data):
+        pos = m.start()
+        if data.rfind(b"<", 0, pos) <= data.rfind(b">", 0, pos):
+            braces.append(pos)
+    out = []
+    last = i = 0
+    while i < len(braces):
+        ch = data[braces[i]]
+        j = i + 1
+        while j < len(braces) and data[braces[j]] == ch and _only_markup(data[braces[j - 1] + 1:braces[j]]):
+            j += 1
+        if j - i == 1:
+            out.append(data[last:braces[i] + 1])
+            out.append(data[braces[i]:braces[i] + 1])
+            last = braces[i] + 1
+        i = j
+    if not out:
+        return data
+    out.append(data[last:])
+    return b"".join(out)
+
+def escape_docx_bytes(src: bytes) -> bytes:
+    """
+    Копия .docx (в памяти), где одиночные {key} превращены в {{key}}, а
+    оставшиеся одиночные скобки — в {{/}} (см. escape_single_braces).
+    Перезаписываются только изменившиеся части word/*.xml.
+    """
+    replaced = {}
+    with zipfile.ZipFile(io.BytesIO(src), 'r') as zin:
+        for item in zin.infolist():
+            if item.filename.startswith("word/") and item.filename.endswith(".xml"):
+                data = zin.read(item.filename)
+                escaped = escape_single_braces(data)
+                if escaped is not data:
+                    replaced[item.filename] = escaped
+    out = io.BytesIO()
+    write_docx(src, out, replaced)
+    return out.getvalue()
+
+# -------------------------
+# Кэш скомпилированных шаблонов
+# -------------------------
+TEMPLATE_CACHE_SIZE = 16  # сколько разобранных шаблонов (docxtpl и быстрых) держать в памяти (LRU)
+
+# строковые свойства docProps/core.xml, которые docxtpl прогоняет через Jinja
+_CORE_PROPS = ("author", "comments", "identifier", "language", "subject", "title")
+_FOOTNOTES_CT = "application/vnd.openxmlformats-officedocument.wordprocessingml.footnotes+xml"
+
+class CompiledTemplate(DocxTemplate):
+    """
+    DocxTemplate, подготовленный один раз: архив распакован, XML разобран,
+    тело/колонтитулы/сноски прогнаны через patch_xml и скомпилированы в Jinja.
+    render() только выполняет готовые шаблоны и подменяет части в уже
+    загруженном документе — повторные генерации не читают и не парсят .docx.
+    Один экземпляр нельзя рендерить из двух потоков: render+save делать под self.lock.
+    """
+    def __init__(self, data: bytes):
+        super().__init__(io.BytesIO(data))
+        self.lock = threading.Lock()
+        self._source = data
+        self.init_docx()
+        env = Environment()
+        self._body = env.from_string(self._prepare_xml(self.patch_xml(self.get_xml())))
+        self._headers_footers = {}
+        for uri in (self.HEADER_URI, self.FOOTER_URI):
+            parts = []
+            for rel_key, part in self.get_headers_footers(uri):
+                xml = self.get_part_xml(part)
+                encoding = self.get_headers_footers_encoding(xml)
+                parts.append((rel_key, encoding, env.from_string(self._prepare_xml(self.patch_xml(xml)))))
+            self._headers_footers[uri] = parts
+        self._props = {prop: env.from_string(getattr(self.docx.core_properties, prop) or "") for prop in _CORE_PROPS}
+        self._footnotes = []
+        if len(self.docx.sections):
+            for part in self.docx.part.package.parts:
+                if part.content_type == _FOOTNOTES_CT:
+                    blob = part.blob.decode("utf-8") if isinstance(part.blob, bytes) else part.blob
+                    self._footnotes.append((part, env.from_string(self._prepare_xml(self.patch_xml(blob)))))
+        # части, которые render() перезаписывает; остальные save() копирует из исходного архива
+        self._rendered_names = {str(self.docx._part.partname)}
+        for uri in (self.HEADER_URI, self.FOOTER_URI):
+            for rel_key, part in self.get_headers_footers(uri):
+                self._rendered_names.add(str(part.partname))
+        self._rendered_names.update(str(part.partname) for part, template in self._footnotes)
+        self._rendered_names.add(str(self.docx.part.package._core_properties_part.partname))
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            self._members = set(z.namelist())
+        self._package_sig = self._package_signature()
+
+    def _package_signature(self):
+        package = self.docx.part.package
+        sig = {"": sorted((r.rId, r.reltype, r.target_ref) for r in package.rels.values())}
+        for part in package.iter_parts():
+            sig[str(part.partname)] = sorted((r.rId, r.reltype, r.target_ref) for r in part.rels.values())
+        return sig
+
+    @staticmethod
+    def _prepare_xml(src_xml):
+        # то же, что docxtpl делает перед компиляцией в render_xml_part
+        return re.sub(r"<w:p([ >])", r"\n<w:p\1", src_xml)
+
+    def _render_part(self, template, part, context):
+        self.current_rendering_part = part
+        dst_xml = template.render(context)
+        dst_xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", dst_xml)
+        dst_xml = (dst_xml.replace("{_{", "{{").replace("}_}", "}}")
+                   .replace("{_%", "{%").replace("%_}", "%}"))
+        return self.resolve_listing(dst_xml)
+
+    def init_docx(self, reload=True):
+        # документ загружается один раз: render() сам перезаписывает все шаблонные части
+        if not self.docx:
+            self.docx = Document(self.template_file)
+
+    def build_xml(self, context, jinja_env=None):
+        return self._render_part(self._body, self.docx._part, context)
+
+    def build_headers_footers_xml(self, context, uri, jinja_env=None):
+        for rel_key, encoding, template in self._headers_footers.get(uri, []):
+            part = self.docx._part.rels[rel_key].target_part
+            yield rel_key, self._render_part(template, part, context).encode(encoding)
+
+    def render_properties(self, context, jinja_env=None):
+        for prop, template in self._props.items():
+            setattr(self.docx.core_properties, prop, template.render(context))
+
+    def render_footnotes(self, context, jinja_env=None):
+        for part, template in self._footnotes:
+            part._blob = self._render_part(template, part, context).encode("utf-8")
+
+    def save(self, filename, *args, **kwargs):
+        # если render() не добавил частей и связей (картинки, ссылки), пакет устроен как исходный
+        # архив: перезаписываются только отрендеренные части, остальное копируется сжатым
+        if not self.is_rendered or self._package_signature() != self._package_sig:
+            return super().save(filename, *args, **kwargs)
+        replaced = {}
+        for part in self.docx.part.package.iter_parts():
+            name = str(part.partname).lstrip("/")
+            if name not in self._members:
+                return super().save(filename, *args, **kwargs)
+            if str(part.partname) in self._rendered_names:
+                replaced[name] = part.blob
+        write_docx(self._source, filename, replaced, DOCX_COMPRESSLEVEL)
+        self.is_saved = True
+
+# -------------------------
+# Быстрый путь: склейка строк без docxtpl
+# -------------------------
+FAST_PATH = True  # False — всегда рендерить через docxtpl
+
+# части, которые docxtpl прогоняет через Jinja (тело, колонтитулы, сноски)
+_SPLICE_PARTS_re = re.compile(r"word/(document|header\d*|footer\d*|footnotes)\.xml$")
+_SPLICE_TAG_re = re.compile(r"\{\{(.*?)\}\}", flags=re.DOTALL)
+_SPLICE_NAME_re = re.compile(r"[^\W\d]\w*(?:\.[^\W\d]\w*)*$")
+_SPLICE_LISTING_re = re.compile(r"<w:t(?: [^>]*)?>[^<]*[\t\a\f\n]")
+_SPLICE_TYPES = (str, int, float, bool, type(None))
+
+# patch_xml/resolve_listing у DocxTemplate не используют состояние экземпляра
+_xml_tools = DocxTemplate.__new__(DocxTemplate)
+
+def _xml_escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+def _unescape_tags(text):
+    # то же, что docxtpl делает после рендера: {_{ -> {{ и т.п.
+    return text.replace("{_{", "{{").replace("}_}", "}}").replace("{_%", "{%").replace("%_}", "%}")
+
+class SpliceTemplate:
+    """
+    Шаблон только с подстановками {{ key }}, разобранный один раз на куски:
+    каждая шаблонная часть word/*.xml — список статических байтов и имён
+    переменных между ними. render() экранирует значения и склеивает байты,
+    остальные части архива копируются как есть. Если в шаблоне есть
+    {% %}/{# #}, фильтры, выражения или служебные теги docxtpl, fast = False
+    и рендерить нужно через docxtpl (причина — в reason). Состояния при
+    рендере нет, один экземпляр можно использовать из разных потоков.
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+        self.parts = {}    # имя части -> (статические куски, имена переменных, есть ли \t\n... в w:t)
+        self.fast = True
+        self.reason = ""
+        with zipfile.ZipFile(io.BytesIO(data)) as z:
+            for name in z.namelist():
+                if name == "docProps/core.xml":
+                    props = z.read(name)
+                    if b"{{" in props or b"{%" in props:
+                        self._reject("шаблонные теги в свойствах документа")
+                elif _SPLICE_PARTS_re.match(name):
+                    self._compile_part(name, z.read(name))
+                if not self.fast:
+                    break
+
+    def _reject(self, reason):
+        self.fast = False
+        self.reason = self.reason or reason
+
+    def _compile_part(self, name, raw):
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return self._reject(f"{name}: не UTF-8")
+        if "{" not in text:
+            return
+        text = _xml_tools.patch_xml(text)
+        if "{%" in text or "{#" in text:
+            return self._reject(f"{name}: теги {{% %}}/{{# #}}")
+        # как у Jinja: переводы строк приводятся к \n, один завершающий \n отбрасывается
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if text.endswith("\n"):
+            text = text[:-1]
+        chunks, slots = [], []
+        pos = 0
+        for m in _SPLICE_TAG_re.finditer(text):
+            expr = m.group(1).strip()
+            if not _SPLICE_NAME_re.match(expr):
+                return self._reject(f"{name}: выражение {{{{ {expr} }}}}")
+            chunks.append(text[pos:m.start()])
+            slots.append(expr.split("."))
+            pos = m.end()
+        chunks.append(text[pos:])
+        if any("{{" in c for c in chunks):
+            return self._reject(f"{name}: незакрытый {{{{")
+        chunks = [_unescape_tags(c) for c in chunks]
+        listing = bool(_SPLICE_LISTING_re.search("".join(chunks)))
+        self.parts[name] = ([c.encode("utf-8") for c in chunks], slots, listing)
+
+    @staticmethod
+    def _lookup(ctx, path):
+        """Значение переменной как у Jinja; KeyError, если склейкой его не получить."""
+        value = ctx.get(path[0], "")
+        for attr in path[1:]:
+            if isinstance(value, dict) and attr in value:
+                value = value[attr]
+            elif hasattr(value, attr):
+                value = getattr(value, attr)
+            else:
+                raise KeyError(attr)  # Jinja здесь дала бы Undefined/ошибку — пусть решает docxtpl
+        if not isinstance(value, _SPLICE_TYPES) or (isinstance(value, str) and type(value) is not str):
+            raise KeyError(path[0])   # InlineImage, RichText, Markup и прочие объекты
+        return value
+
+    def render_parts(self, ctx):
+        """{имя части: байты} или None, если контекст требует docxtpl."""
+        rendered = {}
+        for name, (chunks, slots, listing) in self.parts.items():
+            out = [chunks[0]]
+            for path, chunk in zip(slots, chunks[1:]):
+                try:
+                    value = self._lookup(ctx, path)
+                except KeyError:
+                    return None
+                value = _unescape_tags(_xml_escape(str(value)))
+                if not listing and any(ch in value for ch in "\t\a\f\n"):
+                    listing = True
+                out.append(value.encode("utf-8"))
+                out.append(chunk)
+            xml = b"".join(out)
+            if listing:
+                xml = _xml_tools.resolve_listing(xml.decode("utf-8")).encode("utf-8")
+            rendered[name] = xml
+        return rendered
+
+    def save(self, ctx, out):
+        """Отрендерить в out — путь или файловый объект (через write_docx); False (ничего не записано), если нужен docxtpl."""
+        if not self.fast:
+            return False
+        rendered = self.render_parts(ctx)
+        if rendered is None:
+            return False
+        write_docx(self.data, out, rendered, DOCX_COMPRESSLEVEL)
+        return True
+
+# -------------------------
+# Нормализация шаблона: теги, разбитые Word на несколько runs
+# -------------------------
+NORMALIZED_DIR = APPDIR / "normalized"   # нормализованные копии шаблонов: <sha1>-v<версия>.docx
+NORMALIZED_KEEP = 32                      # сколько копий держать на диске (старые удаляются)
+NORMALIZER_VERSION = 1                    # поднять при изменении normalize_part — старые копии не подхватятся
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+_jinja_span_re = re.compile(r"\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}", flags=re.DOTALL)
+
+def _merge_paragraph_tags(p):
+    """Собрать каждый тег Jinja абзаца в один w:t; True, если абзац изменён."""
+    texts = [t for t in p.iter(_W + "t") if next(t.iterancestors(_W + "p"), None) is p]
+    if len(texts) < 2:
+        return False
+    full = "".join(t.text or "" for t in texts)
+    if "{" not in full:
+        return False
+    starts, pos = [], 0
+    for t in texts:
+        starts.append(pos)
+        pos += len(t.text or "")
+    changed = False
+    # с конца: начала предыдущих w:t при этом не сдвигаются
+    for m in reversed(list(_jinja_span_re.finditer(full))):
+        a, b = m.span()
+        first = max(i for i, s in enumerate(starts) if s <= a)
+        last = max(i for i, s in enumerate(starts) if s < b)
+        if first == last:
+            continue
+        head = texts[first].text or ""
+        texts[first].text = head[:a - starts[first]] + m.group(0)
+        for k in range(first + 1, last):
+            texts[k].text = ""
+        tail = texts[last].text or ""
+        texts[last].text = tail[b - starts[last]:]
+        for k in (first, last):
+            texts[k].set(_XML_SPACE, "preserve")
+        changed = True
+    return changed
+
+def normalize_part(data: bytes) -> bytes:
+    """
+    Часть word/*.xml, где теги {{ }}, {% %} и {# #}, разнесённые Word по
+    соседним runs абзаца, собраны в первый run (с его форматированием).
+    Абзацы разбираются lxml iterparse; если менять нечего, возвращается data.
+    """
+    if b"{" not in data:
+        return data
+    changed = False
+    context = etree.iterparse(io.BytesIO(data), events=("end",), tag=_W + "p", huge_tree=True)
+    for _, p in context:
+        changed = _merge_paragraph_tags(p) or changed
+    if not changed:
+        return data
+    return etree.tostring(context.root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+def normalize_docx_bytes(src: bytes) -> bytes:
+    """Копия .docx с нормализованными шаблонными частями (остальное — без пересжатия)."""
+    replaced = {}
+    with zipfile.ZipFile(io.BytesIO(src)) as zin:
+        for name in zin.namelist():
+            if _SPLICE_PARTS_re.match(name):
+                data = zin.read(name)
+                normalized = normalize_part(data)
+                if normalized is not data:
+                    replaced[name] = normalized
+    if not replaced:
+        return src
+    out = io.BytesIO()
+    write_docx(src, out, replaced)
+    return out.getvalue()
+
+def normalized_template(data: bytes, digest: str) -> bytes:
+    """
+    Нормализованная версия шаблона из дискового кэша (ключ — sha1 исходника);
+    при первом обращении к новой версии шаблона она строится и сохраняется.
+    """
+    path = NORMALIZED_DIR / f"{digest}-v{NORMALIZER_VERSION}.docx"
+    try:
+        cached = path.read_bytes()
+        os.utime(path)  # для вытеснения: давно не использованные копии удаляются первыми
+        return cached
+    except Exception:
+        pass
+    normalized = normalize_docx_bytes(data)
+    try:
+        NORMALIZED_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=NORMALIZED_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(normalized)
+            os.replace(tmp, path)
+        except Exception:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        copies = sorted(NORMALIZED_DIR.glob("*.docx"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for old in copies[NORMALIZED_KEEP:]:
+            old.unlink(missing_ok=True)
+    except Exception:
+        pass  # без дискового кэша просто нормализуем заново в следующем процессе
+    return normalized
+
+def template_variables(data: bytes):
+    """
+    Имена переменных верхнего уровня (jinja2 meta), которые использует шаблон:
+    тело, колонтитулы, сноски и свойства документа. Исключение — шаблон не разбирается.
+    """
+    env = Environment()
+    names = set()
+    with zipfile.ZipFile(io.BytesIO(normalize_docx_bytes(data))) as z:
+        for name in z.namelist():
+            if _SPLICE_PARTS_re.match(name):
+                raw = z.read(name)
+                if b"{" in raw:
+                    names |= meta.find_undeclared_variables(env.parse(_xml_tools.patch_xml(raw.decode("utf-8"))))
+            elif name == "docProps/core.xml":
+                raw = z.read(name)
+                if b"{" in raw:
+                    names |= meta.find_undeclared_variables(env.parse(raw.decode("utf-8")))
+    return sorted(names)
+
+# -------------------------
+# Диагностика шаблонов
+# -------------------------
+DIAG_DIR = APPDIR / "diagnostics"   # JSON-отчёты: <имя шаблона>-<sha1[:12]>.json
+DIAG_KEEP = 20                        # сколько отчётов держать
+DIAG_MAX_AGE_DAYS = 30                # отчёты и старые *_diag_*.txt старше — удаляются
+
+_diag_token_re = re.compile(r"\{\{|\}\}|\{%|%\}|\{#|#\}|[{}]")
+_DIAG_CLOSERS = {"{{": "}}", "{%": "%}", "{#": "#}"}
+_tag_text_re = re.compile(r"<[^>]*>")
+_tag_name_re = re.compile(r"\{\{-?\s*([^\W\d]\w*)")  # имена переменных, если шаблон не разбирается Jinja
+
+def _paragraph_texts(data: bytes):
+    """Текст каждого абзаца части (как его видит Word, без разметки runs)."""
+    for _, p in etree.iterparse(io.BytesIO(data), events=("end",), tag=_W + "p", huge_tree=True):
+        yield "".join(t.text or "" for t in p.iter(_W + "t") if next(t.iterancestors(_W + "p"), None) is p)
+
+def _scan_paragraph(text):
+    """(теги, сломанные места) абзаца: незакрытые/лишние {{ }} {% %} {# #} и одиночные скобки."""
+    tags, broken = [], []
+    opened = None  # (токен, позиция)
+    for m in _diag_token_re.finditer(text):
+        tok, pos = m.group(0), m.start()
+        if tok in _DIAG_CLOSERS:
+            if opened:
+                broken.append({"offset": opened[1], "problem": f"{opened[0]} без закрывающего {_DIAG_CLOSERS[opened[0]]}"})
+            opened = (tok, pos)
+        elif opened and tok == _DIAG_CLOSERS[opened[0]]:
+            tags.append(text[opened[1]:m.end()])
+            opened = None
+        elif opened and tok in ("{", "}"):
+            continue  # скобки внутри выражения ({{ d['k'] }}, словари) — дело Jinja
+        elif tok in ("{", "}"):
+            broken.append({"offset": pos, "problem": f"одиночная «{tok}»"})
+        else:
+            broken.append({"offset": pos, "problem": f"{tok} без открывающего"})
+    if opened:
+        broken.append({"offset": opened[1], "problem": f"{opened[0]} без закрывающего {_DIAG_CLOSERS[opened[0]]}"})
+    for b in broken:
+        b["context"] = text[max(0, b["offset"] - 40):b["offset"] + 40]
+    return tags, broken
+
+def _analyze_template(data: bytes):
+    """Не зависящая от контекста часть отчёта: теги, сломанные места, переменные, ошибки Jinja."""
+    env = Environment()
+    tags, broken, variables, syntax = [], [], set(), []
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        for name in z.namelist():
+            if not _SPLICE_PARTS_re.match(name):
+                continue
+            raw = z.read(name)
+            if b"{" not in raw and b"}" not in raw:
+                continue
+            for index, text in enumerate(_paragraph_texts(raw)):
+                p_tags, p_broken = _scan_paragraph(text)
+                tags.extend(t for t in p_tags if t not in tags)
+                for b in p_broken:
+                    broken.append({"part": name, "paragraph": index, **b})
+            source = _xml_tools.patch_xml(raw.decode("utf-8", errors="replace"))
+            try:
+                variables.update(meta.find_undeclared_variables(env.parse(source)))
+            except Exception as e:
+                # номер строки Jinja относится к XML части — показываем текст этой строки без разметки
+                lines = source.splitlines()
+                lineno = getattr(e, "lineno", None) or 0
+                near = _tag_text_re.sub("", lines[lineno - 1]).strip() if 0 < lineno <= len(lines) else ""
+                syntax.append({"part": name, "error": str(e), "near": near[:200]})
+                variables.update(m.group(1) for m in _tag_name_re.finditer(source))
+    return {"tags": tags, "broken": broken, "variables": sorted(variables), "syntax_errors": syntax}
+
+def _prune_diagnostics():
+    cutoff = datetime.now().timestamp() - DIAG_MAX_AGE_DAYS * 86400
+    try:
+        reports = sorted(DIAG_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+        old = reports[DIAG_KEEP:] + [p for p in reports[:DIAG_KEEP] if p.stat().st_mtime < cutoff]
+        old += [p for p in APPDIR.glob("*_diag_*.txt") if p.stat().st_mtime < cutoff]
+        for p in old:
+            p.unlink(missing_ok=True)
+    except Exception:
+        pass
+
+def diagnose_template(template_path, error=None, ctx=None, data: bytes = None, label="") -> Path:
+    """
+    JSON-отчёт о шаблоне в DIAG_DIR: теги, сломанные места (часть, абзац,
+    смещение, контекст), переменные шаблона и — если передан ctx — те из
+    них, которых нет в контексте. Разбор шаблона кэшируется в самом отчёте
+    по sha1 содержимого: повторная ошибка того же шаблона только обновляет
+    error/undefined. data — содержимое, если его нет на диске (экранированная копия).
+    """
+    path = Path(template_path)
+    if data is None:
+        data = path.read_bytes()
+    digest = hashlib.sha1(data).hexdigest()
+    stem = f"{path.stem}-{label}" if label else path.stem
+    report_path = DIAG_DIR / f"{stem}-{digest[:12]}.json"
+    report = load_json(report_path, None)
+    if not isinstance(report, dict) or report.get("sha1") != digest:
+        report = {"template": str(path), "sha1": digest, **_analyze_template(data)}
+    report["generated"] = datetime.now().isoformat(timespec="seconds")
+    report["error"] = "".join(traceback.format_exception_only(type(error), error)).strip() if error else None
+    if ctx is not None:
+        report["undefined"] = [v for v in report.get("variables", []) if v not in ctx]
+    DIAG_DIR.mkdir(parents=True, exist_ok=True)
+    write_json_atomic(report_path, report)
+    _prune_diagnostics()
+    return report_path
+
+_template_cache = OrderedDict()  # (вид, path, mtime_ns, sha1) -> CompiledTemplate/SpliceTemplate
+_template_digests = {}           # path -> (mtime_ns, size, sha1): не хешировать неизменённый файл
+_template_cache_lock = threading.Lock()
+
+def _template_digest(template_path):
+    """(путь, mtime_ns, sha1, байты или None) — файл хешируется, только если изменился."""
+    path = Path(template_path).resolve()
+    st = path.stat()
+    path_key = str(path)
+    data = None
+    known = _template_digests.get(path_key)
+    if known and known[0] == st.st_mtime_ns and known[1] == st.st_size:
+        digest = known[2]
+    else:
+        data = path.read_bytes()
+        digest = hashlib.sha1(data).hexdigest()
+        _template_digests[path_key] = (st.st_mtime_ns, st.st_size, digest)
+    return path_key, st.st_mtime_ns, digest, data
+
+def _get_cached_template(kind, factory, template_path):
+    """
+    Разобранный шаблон из кэша процесса; ключ — вид + путь + mtime + хеш содержимого.
+    factory получает нормализованную версию файла (normalized_template).
+    """
+    path_key, mtime_ns, digest, data = _template_digest(template_path)
+    key = (kind, path_key, mtime_ns, digest)
+    with _template_cache_lock:
+        tpl = _template_cache.get(key)
+        if tpl is not None:
+            _template_cache.move_to_end(key)
+            return tpl
+    if data is None:
+        data = Path(path_key).read_bytes()
+    tpl = factory(normalized_template(data, digest))
+    with _template_cache_lock:
+        # старые версии того же файла больше не понадобятся
+        for stale in [k for k in _template_cache if k[:2] == key[:2] and k != key]:
+            del _template_cache[stale]
+        _template_cache[key] = tpl
+        _template_cache.move_to_end(key)
+        while len(_template_cache) > TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+    return tpl
+
+def get_compiled_template(template_path) -> CompiledTemplate:
+    """Вернуть разобранный шаблон docxtpl из кэша процесса."""
+    return _get_cached_template("docxtpl", CompiledTemplate, template_path)
+
+def get_splice_template(template_path) -> SpliceTemplate:
+    """Вернуть шаблон быстрого пути из кэша процесса (см. SpliceTemplate.fast)."""
+    return _get_cached_template("splice", SpliceTemplate, template_path)
+
+def get_escaped_template(template_path) -> CompiledTemplate:
+    """
+    Шаблон docxtpl из экранированной копии (escape_docx_bytes) — для шаблонов
+    с одиночными {key}. Копия строится в памяти один раз на версию файла.
+    """
+    return _get_cached_template("escaped", lambda data: CompiledTemplate(escape_docx_bytes(data)), template_path)
+
+def clear_template_cache():
+    with _template_cache_lock:
+        _template_cache.clear()
+        _template_digests.clear()
+
+# -------------------------
+# Запомненные стратегии рендеринга
+# -------------------------
+STRATEGY_FILE = APPDIR / "render_strategies.json"  # sha1 шаблона -> {"strategy", "template"}
+STRATEGY_FILE_LIMIT = 64  # сколько версий шаблонов помнить (старые вытесняются)
+
+_strategies = None
+_strategies_lock = threading.Lock()
+
+def _load_strategies():
+    global _strategies
+    if _strategies is None:
+        data = load_json(STRATEGY_FILE, {})
+        _strategies = data if isinstance(data, dict) else {}
+    return _strategies
+
+def known_strategy(digest):
+    """Стратегия ("splice", "docxtpl", "escaped"), которой этот шаблон уже рендерился, или None."""
+    with _strategies_lock:
+        entry = _load_strategies().get(digest)
+    return entry.get("strategy") if isinstance(entry, dict) else None
+
+def remember_strategy(digest, strategy, template_path):
+    with _strategies_lock:
+        strategies = _load_strategies()
+        entry = strategies.get(digest)
+        if isinstance(entry, dict) and entry.get("strategy") == strategy:
+            return
+        # другие процессы могли дописать свои шаблоны — объединяем с файлом
+        on_disk = load_json(STRATEGY_FILE, {})
+        if isinstance(on_disk, dict):
+            for k, v in on_disk.items():
+                strategies.setdefault(k, v)
+        strategies.pop(digest, None)
+        strategies[digest] = {"strategy": strategy, "template": Path(template_path).name}
+        while len(strategies) > STRATEGY_FILE_LIMIT:
+            del strategies[next(iter(strategies))]
+        try:
+            write_json_atomic(STRATEGY_FILE, strategies)
+        except Exception:
+            pass  # не запомнили — в следующий раз просто пройдём цепочку заново
+
+def forget_strategy(digest):
+    with _strategies_lock:
+        if _load_strategies().pop(digest, None) is not None:
+            try:
+                write_json_atomic(STRATEGY_FILE, _strategies)
+            except Exception:
+                pass
+
+def _render_with(tpl, ctx):
+    buf = io.BytesIO()
+    with tpl.lock:
+        tpl.render(ctx)
+        tpl.save(buf)
+    return buf.getvalue()
+
+def render_docx_bytes(template_path: Path, ctx: dict) -> bytes:
+    """
+    Отрендерить шаблон в память и вернуть готовый .docx. Тот же кэш шаблонов и
+    та же цепочка, что и при записи на диск: склейка строк, docxtpl,
+    экранированная копия; если не вышло ничего — RuntimeError с путями диагностики.
+    """
+    last_exc = None
+    digest = _template_digest(template_path)[2]
+    strategy = known_strategy(digest)
+    if strategy == "escaped":
+        # шаблон уже известен как требующий экранирования: без заведомо неудачной попытки и диагностики
+        try:
+            return _render_with(get_escaped_template(template_path), ctx)
+        except Exception:
+            forget_strategy(digest)  # что-то изменилось — пройти всю цепочку и перепроверить
+    if FAST_PATH and strategy != "docxtpl":
+        try:
+            splice = get_splice_template(template_path)
+            buf = io.BytesIO()
+            if splice.save(ctx, buf):
+                remember_strategy(digest, "splice", template_path)
+                return buf.getvalue()
+        except Exception:
+            splice = None  # всё, что не вышло склейкой, рендерит docxtpl ниже
+    else:
+        splice = None
+    try:
+        data = _render_with(get_compiled_template(template_path), ctx)
+        # "docxtpl" запоминается, только если склейка невозможна для самого шаблона, а не для этого контекста
+        if not FAST_PATH or splice is None or not splice.fast:
+            remember_strategy(digest, "docxtpl", template_path)
+        return data
+    except Exception as e:
+        last_exc = e
+        try:
+            diag_orig = diagnose_template(template_path, e, ctx)
+        except Exception:
+            diag_orig = None
+
+    tpl = None
+    try:
+        tpl = get_escaped_template(template_path)
+        data = _render_with(tpl, ctx)
+        remember_strategy(digest, "escaped", template_path)
+        return data
+    except Exception as e2:
+        try:
+            data = tpl._source if tpl is not None else escape_docx_bytes(Path(template_path).read_bytes())
+            diag_esc = diagnose_template(template_path, e2, ctx, data=data, label="escaped")
+        except Exception:
+            diag_esc = None
+
+        tb1 = "".join(traceback.format_exception_only(type(last_exc), last_exc)) if last_exc else ""
+        tb2 = "".join(traceback.format_exception_only(type(e2), e2))
+        msg = f"Render failed (original): {tb1}\nAttempt with escaped/converted copy failed: {tb2}\n"
+        if diag_orig:
+            msg += f"\nDiagnostic log for original template: {diag_orig}\n"
+        if diag_esc:
+            msg += f"\nDiagnostic log for escaped copy: {diag_esc}\n"
+        msg += ("\nПодсказки:\n- Откройте указанный файл с диагностикой и найдите проблемный фрагмент.\n")
+        raise RuntimeError(msg)
+
+def render_docx(template_path: Path, ctx: dict, out):
+    """
+    Отрендерить шаблон в out — путь или двоичный файловый объект (BytesIO,
+    сокет, ответ HTTP). Документ собирается в памяти целиком, поэтому при
+    ошибке в out ничего не пишется и неудачная попытка не оставляет полфайла.
+    """
+    data = render_docx_bytes(template_path, ctx)
+    if hasattr(out, "write"):
+        out.write(data)
+    else:
+        with open(out, "wb") as f:
+            f.write(data)
+
+def render_docx_safely(template_path: Path, ctx: dict, out_path: str):
+    """Отрендерить шаблон в файл out_path (см. render_docx_bytes)."""
+    render_docx(template_path, ctx, out_path)
@@ -0,0 +1,266 @@
+"""
+DocGen как локальный HTTP-сервис: генерация документов для других программ без GUI.
+
+    python docgen_server.py --port 8765 -j 4
+
+POST /render?template=permit[&output=path][&numb=1606-А]
+    Тело — JSON-объект контекста в том же виде, что строка задания docgen_cli
+    (fio, a, hazards, workers, ...). Ответ — сам .docx (номер в заголовке
+    X-DocGen-Numb) или, с output=path, JSON {"numb", "path"} с файлом в output_dir.
+    Если работников больше, чем слотов в шаблоне, документ состоит из
+    нескольких листов: .zip с ними (X-DocGen-Sheets) или "sheets" в JSON.
+POST /render-set[?numb=...]
+    Полный набор документов в output_dir; ответ — JSON {"numb", "outputs", "errors"}.
+
+Номер, если он не передан явно, выдаётся из counters.json той же
+reserve_numbers(), что и у «Сгенерировать Все», и возвращается, если ни
+одного документа не получилось. Рендер идёт в пуле процессов ядра с
+прогретым кэшем шаблонов; одновременно выполняется не больше --queue
+запросов, лишние сразу получают 503 с Retry-After.
+"""
+import io
+import sys
+import json
+import zipfile
+import traceback
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs, quote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import docgen_core as core
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+MAX_BODY = 4 * 1024 * 1024  # больше контекст формы не бывает
+
+
+class BadJob(ValueError):
+    """Контекст задания не разбирается (ошибка клиента, а не сервиса)."""
+
+
+class RenderService:
+    """Общее состояние сервиса: карточки работников, ограничение очереди, номера и папка вывода."""
+    def __init__(self, output_dir, counters_path=core.COUNTERS_FILE, queue_size=None):
+        self.output_dir = Path(output_dir)
+        self.counters_path = Path(counters_path)
+        self.slots = threading.BoundedSemaphore(queue_size or core.RENDER_POOL_SIZE * 2)
+        self.workers_store = core.open_worker_store(core.load_json(core.SETTINGS_FILE, {}) or {})
+        self._workers_mtime = None
+        self._workers_loaded = False
+        self._workers_lock = threading.Lock()
+
+    def workers_index(self):
+        """Индекс карточек; файл перечитывается, только если его изменили (например, из GUI)."""
+        with self._workers_lock:
+            try:
+                mtime = self.workers_store.path.stat().st_mtime_ns
+            except OSError:
+                mtime = None
+            if not self._workers_loaded or mtime != self._workers_mtime:
+                self.workers_store.load()
+                self._workers_mtime = mtime
+                self._workers_loaded = True
+            return self.workers_store.index
+
+    def warm_up(self):
+        """Манифесты — в этом процессе, разбор шаблонов — в инициализаторе каждого процесса пула."""
+        for path in core.DOCUMENT_TEMPLATES.values():
+            if path.exists():
+                core.template_manifest(path)
+        pool = core.get_render_pool(initializer=core.warm_templates)
+        # ProcessPoolExecutor не запускает процессы до первого submit (при fork — по одному на
+        # задание, пока нет свободных), так что initializer сработал бы уже внутри первых
+        # запросов и они ждали бы разбор шаблонов. Пустые задания поднимают все процессы сразу.
+        for _ in range(core.RENDER_POOL_SIZE):
+            pool.submit(int)
+
+    def _prepare(self, job, numb):
+        """Снимок контекста задания и номер (выданный из counters.json, если не передан явно)."""
+        workers_db = self.workers_index()
+        try:
+            snapshot = core.ContextSnapshot(core.complete_ctx(job, workers_db))
+        except (ValueError, TypeError) as e:
+            raise BadJob(f"{type(e).__name__}: {e}") from e
+        block = None
+        if numb is None:
+            block = core.reserve_numbers(1, self.counters_path)
+            numb = block.format(block.start)
+        return snapshot, numb, block
+
+    def render(self, job, keys, numb=None):
+        """
+        Отрендерить документы keys (ключи DOCUMENT_TEMPLATES) с одним номером.
+        Возвращает (номер, {ключ: [пути листов]}, ошибки в формате render_documents).
+        """
+        snapshot, numb, block = self._prepare(job, numb)
+        jobs, job_keys = [], []
+        for key, path in core.DOCUMENT_TEMPLATES.items():
+            if key in keys and path.exists():
+                sheets = core.template_jobs(key, path, snapshot, numb, self.output_dir)
+                jobs += sheets
+                job_keys += [key] * len(sheets)
+        outs, errors = core.render_documents(jobs, parallel=True) if jobs else ([], [])
+        if block is not None and not outs:
+            block.release(block.numbers())
+        done = {}
+        for key, (path, ctx, out) in zip(job_keys, jobs):
+            if out in outs:
+                done.setdefault(key, []).append(out)
+        return numb, done, errors
+
+    def render_bytes(self, job, key, numb=None):
+        """
+        Отрендерить документ key в память: (номер, [(имя файла, данные .docx)], ошибки).
+        Листов несколько, если работников больше, чем слотов в шаблоне; при любой ошибке список пуст.
+        """
+        snapshot, numb, block = self._prepare(job, numb)
+        path = core.DOCUMENT_TEMPLATES[key]
+        sheets = core.template_jobs(key, path, snapshot, numb, "")
+        results = core.render_documents_bytes([(p, ctx) for p, ctx, out in sheets], parallel=True)
+        errors = [(str(path), err[0], err[1]) for data, err in results if err]
+        files = [] if errors else [(Path(out).name, data) for (p, ctx, out), (data, err) in zip(sheets, results)]
+        if block is not None and not files:
+            block.release(block.numbers())
+        return numb, files, errors
+
+
+def _result_body(numb, errors):
+    body = {"numb": numb, "errors": [{"template": p, "error": msg} for p, msg, tb in errors]}
+    if errors:
+        body["log"] = str(core.write_error_log(errors, tag=numb))
+    return body
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None  # RenderService, задаётся в serve()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        sys.stderr.write("%s - %s\n" % (self.address_string(), fmt % args))
+
+    def _send(self, status, body, content_type="application/json; charset=utf-8", headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _close_unread(self, status, body):
+        # тело запроса не прочитано — его остаток испортил бы следующий запрос на этом соединении
+        self.close_connection = True
+        return self._send(status, body, headers=[("Connection", "close")])
+
+    def _read_job(self, length):
+        job = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(job, dict):
+            raise ValueError("контекст должен быть JSON-объектом")
+        return job
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path not in ("/render", "/render-set"):
+            return self._close_unread(404, {"error": f"неизвестный адрес {url.path}"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            return self._close_unread(400, {"error": "некорректный Content-Length"})
+        if length > MAX_BODY:
+            return self._close_unread(413, {"error": f"слишком большой запрос (больше {MAX_BODY} байт)"})
+        try:
+            job = self._read_job(length)
+        except ValueError as e:
+            return self._send(400, {"error": f"некорректный JSON: {e}"})
+        if url.path == "/render":
+            key = query.get("template", "permit")
+            if key not in core.DOCUMENT_TEMPLATES or not core.DOCUMENT_TEMPLATES[key].exists():
+                return self._send(404, {"error": f"нет шаблона {key}"})
+            keys = (key,)
+        else:
+            keys = tuple(core.DOCUMENT_TEMPLATES)
+        if not self.service.slots.acquire(blocking=False):
+            # очередь полна — клиент повторит позже, а не будет висеть на соединении
+            return self._send(503, {"error": "очередь генерации заполнена"}, headers=[("Retry-After", "1")])
+        try:
+            if url.path == "/render" and query.get("output", "bytes") == "bytes":
+                self._render_bytes(job, keys[0], query.get("numb"))
+            else:
+                numb, done, errors = self.service.render(job, keys, query.get("numb"))
+                body = _result_body(numb, errors)
+                if url.path == "/render":
+                    paths = done.get(keys[0], [])
+                    body["path"] = paths[0] if paths else None
+                    if len(paths) > 1:
+                        body["sheets"] = paths
+                else:
+                    body["outputs"] = [p for paths in done.values() for p in paths]
+                self._send(200 if done else 422, body)
+        except BadJob as e:
+            self._send(422, {"error": f"некорректное задание: {e}"})
+        except Exception as e:
+            log = core.write_error_log([(self.path, f"{type(e).__name__}: {e}", traceback.format_exc())], tag="server")
+            self._send(500, {"error": "внутренняя ошибка сервиса", "log": str(log)})
+        finally:
+            self.service.slots.release()
+
+    def _render_bytes(self, job, key, numb):
+        numb, files, errors = self.service.render_bytes(job, key, numb)
+        if not files:
+            return self._send(422, _result_body(numb, errors))
+        if len(files) == 1:
+            filename, data, content_type = files[0][0], files[0][1], DOCX_MIME
+        else:
+            # длинный список работников — несколько листов, отдаются одним архивом
+            buf = io.BytesIO()
+            with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as z:
+                for name, sheet in files:
+                    z.writestr(name, sheet)
+            filename, data, content_type = Path(files[0][0]).stem + ".zip", buf.getvalue(), "application/zip"
+        self._send(200, data, content_type, headers=[
+            ("X-DocGen-Numb", quote(numb)),
+            ("X-DocGen-Sheets", str(len(files))),
+            ("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}"),
+        ])
+
+
+def serve(host="127.0.0.1", port=8765, output_dir=None, counters_path=core.COUNTERS_FILE, queue_size=None):
+    Handler.service = RenderService(output_dir or core.get_output_dir(), counters_path, queue_size)
+    Handler.service.output_dir.mkdir(parents=True, exist_ok=True)
+    Handler.service.warm_up()
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    print(f"DocGen слушает http://{host}:{httpd.server_address[1]}", file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        core.shutdown_render_pool()
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="docgen-server", description="Локальный HTTP-сервис генерации документов DocGen.")
+    ap.add_argument("--host", default="127.0.0.1", help="адрес (по умолчанию только локальный)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("-j", "--workers", type=int, default=core.RENDER_POOL_SIZE,
+                    help=f"число процессов рендеринга (по умолчанию {core.RENDER_POOL_SIZE})")
+    ap.add_argument("--queue", type=int, help="сколько запросов обрабатывать одновременно (по умолчанию 2 × workers)")
+    ap.add_argument("--output-dir", help="папка для документов (по умолчанию output_dir из settings.json)")
+    ap.add_argument("--counters", default=str(core.COUNTERS_FILE), help="counters.json, из которого выдаются номера")
+    args = ap.parse_args(argv)
+    core.RENDER_POOL_SIZE = max(1, args.workers)
+    serve(args.host, args.port, Path(args.output_dir) if args.output_dir else None, Path(args.counters),
+          args.queue or core.RENDER_POOL_SIZE * 2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
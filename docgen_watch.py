@@ -0,0 +1,197 @@
+"""
+DocGen в режиме «горячей папки»: генерация наборов документов из файлов-заданий.
+
+    python docgen_watch.py \\\\server\\docgen\\inbox --counters \\\\server\\docgen\\counters.json
+
+Каждый *.json в папке — одно задание в том же виде, что строка JSONL для
+docgen_cli (fio, a, hazards, workers, ...). Класть файл лучше под другим
+именем (например, .tmp) и переименовывать в .json, когда он дописан.
+
+Задание забирается атомарным переименованием в processing/ — из нескольких
+процессов (и машин, смотрящих в одну сетевую папку) его получит ровно один.
+Затем набор рендерится в output_dir, а файл переезжает в done/ (рядом —
+<имя>.result.json с номером и путями) или в failed/ (рядом — <имя>.log с
+ошибками). Задания, застрявшие в processing/ дольше --stale секунд (процесс
+упал), возвращаются в очередь. Чтобы номера не повторялись между машинами,
+counters.json тоже должен лежать на общем ресурсе (--counters).
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import traceback
+from pathlib import Path
+
+import docgen_core as core
+
+POLL_INTERVAL = 2.0    # секунд между просмотрами папки
+SETTLE_SECONDS = 1.0   # файл моложе этого, возможно, ещё пишется
+STALE_SECONDS = 3600   # сколько задание может лежать в processing/, прежде чем его вернут в очередь
+
+
+def _unique(path):
+    """path, а если такой файл уже есть — path с отметкой времени перед расширением."""
+    if not path.exists():
+        return path
+    return path.with_name(f"{path.stem}.{time.strftime('%Y%m%d_%H%M%S')}.{os.getpid()}{path.suffix}")
+
+
+class HotFolder:
+    def __init__(self, inbox, output_dir, counters_path=core.COUNTERS_FILE, parallel=True):
+        self.inbox = Path(inbox)
+        self.processing = self.inbox / "processing"
+        self.done = self.inbox / "done"
+        self.failed = self.inbox / "failed"
+        for d in (self.processing, self.done, self.failed):
+            d.mkdir(parents=True, exist_ok=True)
+        self.output_dir = Path(output_dir)
+        self.counters_path = Path(counters_path)
+        self.parallel = parallel
+        self.owner = f"{socket.gethostname()}-{os.getpid()}"
+        self.workers_store = core.open_worker_store(core.load_json(core.SETTINGS_FILE, {}) or {})
+        self._workers_mtime = None
+        self._workers_loaded = False
+
+    def workers_index(self):
+        try:
+            mtime = self.workers_store.path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        if not self._workers_loaded or mtime != self._workers_mtime:
+            self.workers_store.load()
+            self._workers_mtime = mtime
+            self._workers_loaded = True
+        return self.workers_store.index
+
+    def pending(self):
+        """Задания во входной папке в порядке появления (без недописанных)."""
+        now = time.time()
+        jobs = []
+        for p in self.inbox.glob("*.json"):
+            try:
+                mtime = p.stat().st_mtime
+            except OSError:
+                continue  # уже забрал другой процесс
+            if now - mtime >= SETTLE_SECONDS:
+                jobs.append((mtime, p))
+        return [p for _, p in sorted(jobs)]
+
+    def claim(self, path):
+        """Забрать задание переименованием; None, если его успел забрать кто-то другой."""
+        claimed = self.processing / f"{path.name}.{self.owner}"
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            return None
+        try:
+            os.utime(claimed)  # отсчёт --stale идёт от момента захвата
+        except OSError:
+            pass
+        return claimed
+
+    def requeue_stale(self, stale=STALE_SECONDS):
+        """Вернуть в очередь задания, которые слишком долго лежат в processing/ (их процесс упал)."""
+        now = time.time()
+        for p in self.processing.glob("*.json.*"):
+            try:
+                if now - p.stat().st_mtime < stale:
+                    continue
+                name = p.name[:p.name.index(".json.") + len(".json")]
+                os.rename(p, _unique(self.inbox / name))
+            except (OSError, ValueError):
+                continue
+
+    def process(self, claimed):
+        """Отрендерить набор по заданию и разложить файл в done/ или failed/. Возвращает True при успехе."""
+        name = claimed.name[:claimed.name.index(".json.") + len(".json")]
+        record = {"job": name, "owner": self.owner}
+        errors = []
+        block = None
+        try:
+            job = json.loads(claimed.read_text(encoding="utf-8"))
+            if not isinstance(job, dict):
+                raise ValueError("задание должно быть JSON-объектом")
+            ctx = core.complete_ctx(job, self.workers_index())
+            block = core.reserve_numbers(1, self.counters_path)
+            record["numb"] = block.format(block.start)
+            doc_jobs = core.build_document_jobs(ctx, record["numb"], self.output_dir)
+            outs, errors = core.render_documents(doc_jobs, parallel=self.parallel)
+            record["outputs"] = outs
+            if not outs:
+                block.release(block.numbers())
+                if not errors:
+                    errors = [("", "не найдено ни одного шаблона", "")]
+        except Exception as e:
+            errors = [("", f"{type(e).__name__}: {e}", traceback.format_exc())]
+            if block is not None and not record.get("outputs"):
+                block.release(block.numbers())
+        record["errors"] = [{"template": p, "error": msg} for p, msg, tb in errors]
+
+        target = _unique((self.failed if errors else self.done) / name)
+        os.replace(claimed, target)
+        if errors:
+            with open(target.with_suffix(".log"), "w", encoding="utf-8") as lf:
+                for p, msg, tb in errors:
+                    lf.write(f"=== {p} ===\n{msg}\n{tb}\n\n")
+        with open(target.with_suffix(".result.json"), "w", encoding="utf-8") as rf:
+            json.dump(record, rf, ensure_ascii=False, indent=2)
+        print(json.dumps(record, ensure_ascii=False), flush=True)
+        return not errors
+
+    def run_once(self):
+        """Один проход по папке; возвращает (успешных, с ошибками)."""
+        ok = failed = 0
+        for path in self.pending():
+            claimed = self.claim(path)
+            if claimed is None:
+                continue
+            if self.process(claimed):
+                ok += 1
+            else:
+                failed += 1
+        return ok, failed
+
+    def run(self, interval=POLL_INTERVAL, stale=STALE_SECONDS):
+        while True:
+            self.requeue_stale(stale)
+            self.run_once()
+            time.sleep(interval)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="docgen-watch", description="Генерация документов DocGen из горячей папки с заданиями.")
+    ap.add_argument("inbox", help="папка, в которую кладут *.json с заданиями")
+    ap.add_argument("--output-dir", help="папка для документов (по умолчанию output_dir из settings.json)")
+    ap.add_argument("--counters", default=str(core.COUNTERS_FILE),
+                    help="counters.json, из которого выдаются номера (для нескольких машин — на общем ресурсе)")
+    ap.add_argument("-j", "--workers", type=int, default=core.RENDER_POOL_SIZE,
+                    help=f"процессов рендеринга на набор (по умолчанию {core.RENDER_POOL_SIZE}; 1 — без пула)")
+    ap.add_argument("--interval", type=float, default=POLL_INTERVAL, help="секунд между просмотрами папки")
+    ap.add_argument("--stale", type=float, default=STALE_SECONDS,
+                    help="через сколько секунд вернуть в очередь задание, застрявшее в processing/")
+    ap.add_argument("--once", action="store_true", help="обработать то, что есть, и выйти")
+    args = ap.parse_args(argv)
+
+    core.RENDER_POOL_SIZE = max(1, args.workers)
+    output_dir = Path(args.output_dir) if args.output_dir else core.get_output_dir()
+    output_dir.mkdir(parents=True, exist_ok=True)
+    folder = HotFolder(args.inbox, output_dir, Path(args.counters), parallel=args.workers > 1)
+    try:
+        if args.once:
+            folder.requeue_stale(args.stale)
+            ok, failed = folder.run_once()
+            print(f"Готово: {ok}, с ошибками: {failed}", file=sys.stderr)
+            return 1 if failed else 0
+        print(f"Жду задания в {folder.inbox}", file=sys.stderr)
+        folder.run(args.interval, args.stale)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        core.shutdown_render_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())